@@ -1,16 +1,40 @@
 #!/usr/bin/python
 
 from collections import deque
+import array
+import heapq
+import httplib
+import json
 import logging
 import math
-import pyaudio
+import multiprocessing
+import Queue
 import random
+import re
 import serial
+import shlex
+import signal
 import socket
+import ssl
 import struct
+import subprocess
 import sys, os
 import threading, thread
 import time, datetime
+import urlparse
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    # Only used to speed up bulk dose rate conversion
+    numpy = None
+
+try:
+    import pyaudio
+except ImportError:
+    # Only needed by the audio protocol
+    pyaudio = None
 
 ##############################################################################
 #  pyRadMon - logger for Geiger counters                                     #
@@ -64,8 +88,15 @@ class config():
     GMC = 3
     NETIO = 4
     AUDIO = 5
-
-    def __init__(self):
+    FILTER_NONE = 0
+    FILTER_HAMPEL = 1
+    # Settings that belong to a device, in a [deviceN] section or as parameterN
+    DEVICE_PARAMETERS = ["user", "password", "serialport", "speed", "device", "protocol",
+        "filter", "filterwindow", "filtersigma", "tube", "conversionfactor", "energycompensation", "uploadinterval"]
+    # Device settings that, outside a section, apply to every device
+    SHARED_PARAMETERS = ["filter", "filterwindow", "filtersigma", "uploadinterval"]
+
+    def __init__(self, uploadInterval = 60):
         # Define constants
         self.CONFIGFILE = "config.txt"
         self.UNKNOWN = 0
@@ -74,181 +105,398 @@ class config():
         self.GMC = 3
         self.NETIO = 4
         self.AUDIO = 5
-        self.user = "not_set"
-        self.password = "not_set"
-        self.portName = None
-        self.portSpeed = 2400
-        self.timeout = 40 # Not used for now
-        self.protocol = self.UNKNOWN
-        self.deviceIndex = 0
+        self.FILTER_NONE = 0
+        self.FILTER_HAMPEL = 1
+        # One deviceConfig per counter, in config.txt order
+        self.devices = []
+        # Default uploadinterval of the counters
+        self.uploadInterval = uploadInterval
+        # deviceConfig of the [fused] section, its member device numbers (None for all)
+        self.fused = None
+        self.fusedMembers = None
+        self.fusedStale = 120
+        self.alertThreshold = None
+        self.alertRate = None
+        self.alertSustained = None
+        self.alertHysteresis = 5.0
+        self.alertDebounce = 1
+        self.alertCommand = None
+        self.alertFile = None
+        self.alertUrl = None
+        self.uploadQueue = 100
+        self.spoolFile = "pyradmon_spool.dat"
+        self.backfillRate = 2.0
+        self.backfillPipeline = 5
+        self.dnsTtl = 300
+        self.dnsNegativeTtl = 30
+        self.uploadRetries = 2
+        self.retryBackoff = 1.0
+        self.breakerFailures = 3
+        self.breakerCooldown = 300
+        self.sampleSinks = []
+        self.sinkQueue = 50
+        # Point these at tests/mock_radmon.py for debug purposes (with https=no)
+        self.serverHost = "www.radmon.org"
+        # None is the port of the scheme, 443 with https and 80 without
+        self.serverPort = None
+        # Uploads go over TLS unless https=no, they carry the password
+        self.https = True
+        self.caFile = None
+        self.connectTimeout = 5.0
+        self.sendTimeout = 10.0
+        self.receiveTimeout = 10.0
+        # Run every driver in a process of its own
+        self.processMode = False
+        self.stallTimeout = 300
+        self.restartBackoff = 5
+        self.restartMax = 300
+        # Seconds, None leaves coincidence detection off
+        self.coincidenceWindow = None
+        self.coincidenceBuffer = 10000
 
     def readConfig(self):
         print "Reading configuration:\r\n\t"
-        logger.info("Reading configuration 1")
+        logger.info("Reading configuration")
 
         # If file is present then try to read configuration from it
         try:
             f = open(self.CONFIGFILE)
             line = " "
 
+            # Device number of the current [deviceN] section, "fused" in [fused]
+            section = None
+            deviceParameters = {}
+            # Shared settings outside a section apply to every device
+            sharedDefaults = []
+
             # Analyze file line by line, format is parameter=value
             while(line):
                 line = f.readline()
+                match = re.match(r"^\s*\[(?:device(\d+)|(fused))\]\s*$", line, re.IGNORECASE)
+
+                if match:
+                    section = int(match.group(1)) if match.group(1) else "fused"
+                    continue
+
                 params = line.split("=")
 
                 if len(params) == 2:
                     parameter = params[0].strip().lower()
                     value = params[1].strip()
                     
-                    if parameter == "user":
-                        self.user = value
-                        print "\tUser name configured\r\n\t"
-                        logger.info("User name 1 configured")
-                    elif parameter == "password":
-                        self.password = value
-                        print "\tPassword configured\r\n\t"
-                        logger.info("Password 1 configured")
-                    elif parameter == "serialport":
-                        self.portName = value
-                        print "\tSerial port name 1 configured\r\n\t"
-                        logger.info("Serial port name 1 configured")
-                    elif parameter == "speed":
-                        self.portSpeed = int(value)
-                        print "\tSerial port speed 1 configured\r\n\t"
-                        logger.info("Serial port speed 1 configured")
-                    elif parameter == "device":
-                        self.deviceIndex = int(value)
-                        print "\tDevice number 1 configured\r\n\t"
-                        logger.info("Device number 1 configured")
-                    elif parameter == "protocol":
-                        value = value.lower()
-
-                        if value == "mygeiger":
-                            self.protocol = self.MYGEIGER
-                        elif value == "demo":
-                            self.protocol = self.DEMO
-                        elif value == "gmc":
-                            self.protocol = self.GMC
-                        elif value == "netio":
-                            self.protocol = self.NETIO
-                        elif value == "audio":
-                            self.protocol = self.AUDIO
+                    if section is not None:
+                        if section == "fused" and parameter == "members":
+                            self.fusedMembers = [int(number) for number in value.split(",")]
+                            print "\tFused members configured\r\n\t"
+                            logger.info("Fused members configured")
+                        elif parameter in config.DEVICE_PARAMETERS:
+                            self.getDevice(deviceParameters, section).append([parameter, value])
                         else:
-                            self.protocol = self.UNKNOWN
+                            print "\tUnknown parameter " + parameter + " for device " + str(section) + "\r\n\t"
+                            logger.warning("Unknown parameter " + parameter + " for device " + str(section))
+                    elif parameter == "alertthreshold":
+                        self.alertThreshold = float(value)
+                        print "\tAlert threshold configured\r\n\t"
+                        logger.info("Alert threshold configured")
+                    elif parameter == "alertrate":
+                        self.alertRate = float(value)
+                        print "\tAlert rate of change configured\r\n\t"
+                        logger.info("Alert rate of change configured")
+                    elif parameter == "alertsustained":
+                        # Format is cpm,seconds
+                        level, seconds = value.split(",")
+                        self.alertSustained = [float(level), float(seconds)]
+                        print "\tAlert sustained elevation configured\r\n\t"
+                        logger.info("Alert sustained elevation configured")
+                    elif parameter == "alerthysteresis":
+                        self.alertHysteresis = float(value)
+                        print "\tAlert hysteresis configured\r\n\t"
+                        logger.info("Alert hysteresis configured")
+                    elif parameter == "alertdebounce":
+                        self.alertDebounce = int(value)
+                        print "\tAlert debounce configured\r\n\t"
+                        logger.info("Alert debounce configured")
+                    elif parameter == "alertcommand":
+                        self.alertCommand = value
+                        print "\tAlert command configured\r\n\t"
+                        logger.info("Alert command configured")
+                    elif parameter == "alertfile":
+                        self.alertFile = value
+                        print "\tAlert file configured\r\n\t"
+                        logger.info("Alert file configured")
+                    elif parameter == "alerturl":
+                        self.alertUrl = value
+                        print "\tAlert URL configured\r\n\t"
+                        logger.info("Alert URL configured")
+                    elif parameter == "uploadqueue":
+                        self.uploadQueue = int(value)
+                        print "\tUpload queue size configured\r\n\t"
+                        logger.info("Upload queue size configured")
+                    elif parameter == "spoolfile":
+                        self.spoolFile = value
+                        print "\tSpool file configured\r\n\t"
+                        logger.info("Spool file configured")
+                    elif parameter == "backfillrate":
+                        self.backfillRate = float(value)
+                        print "\tBackfill rate configured\r\n\t"
+                        logger.info("Backfill rate configured")
+                    elif parameter == "backfillpipeline":
+                        self.backfillPipeline = int(value)
+                        print "\tBackfill pipeline depth configured\r\n\t"
+                        logger.info("Backfill pipeline depth configured")
+                    elif parameter == "dnsttl":
+                        self.dnsTtl = int(value)
+                        print "\tDNS cache TTL configured\r\n\t"
+                        logger.info("DNS cache TTL configured")
+                    elif parameter == "dnsnegativettl":
+                        self.dnsNegativeTtl = int(value)
+                        print "\tDNS negative cache TTL configured\r\n\t"
+                        logger.info("DNS negative cache TTL configured")
+                    elif parameter == "uploadretries":
+                        self.uploadRetries = int(value)
+                        print "\tUpload retries configured\r\n\t"
+                        logger.info("Upload retries configured")
+                    elif parameter == "retrybackoff":
+                        self.retryBackoff = float(value)
+                        print "\tUpload retry backoff configured\r\n\t"
+                        logger.info("Upload retry backoff configured")
+                    elif parameter == "breakerfailures":
+                        self.breakerFailures = int(value)
+                        print "\tCircuit breaker failures configured\r\n\t"
+                        logger.info("Circuit breaker failures configured")
+                    elif parameter == "breakercooldown":
+                        self.breakerCooldown = int(value)
+                        print "\tCircuit breaker cool-down configured\r\n\t"
+                        logger.info("Circuit breaker cool-down configured")
+                    elif parameter in ("httpsink", "mqttsink", "csvsink", "udpsink"):
+                        # May be given more than once
+                        self.sampleSinks.append([parameter[:-4], value])
+                        print "\tSample sink configured\r\n\t"
+                        logger.info("Sample sink configured: " + parameter + "=" + value)
+                    elif parameter == "sinkqueue":
+                        self.sinkQueue = int(value)
+                        print "\tSample sink queue size configured\r\n\t"
+                        logger.info("Sample sink queue size configured")
+                    elif parameter == "serverhost":
+                        self.serverHost = value
+                        print "\tUpload server configured\r\n\t"
+                        logger.info("Upload server configured: " + value)
+                    elif parameter == "serverport":
+                        self.serverPort = int(value)
+                        print "\tUpload server port configured\r\n\t"
+                        logger.info("Upload server port configured")
+                    elif parameter == "https":
+                        self.https = value.lower() in ("1", "yes", "true", "on")
+                        print "\tHTTPS upload " + ("enabled" if self.https else "disabled") + "\r\n\t"
+                        logger.info("HTTPS upload " + ("enabled" if self.https else "disabled"))
+                    elif parameter == "cafile":
+                        self.caFile = value
+                        print "\tCA file configured\r\n\t"
+                        logger.info("CA file configured")
+                    elif parameter == "connecttimeout":
+                        self.connectTimeout = float(value)
+                        print "\tConnect timeout configured\r\n\t"
+                        logger.info("Connect timeout configured")
+                    elif parameter == "sendtimeout":
+                        self.sendTimeout = float(value)
+                        print "\tSend timeout configured\r\n\t"
+                        logger.info("Send timeout configured")
+                    elif parameter == "receivetimeout":
+                        self.receiveTimeout = float(value)
+                        print "\tReceive timeout configured\r\n\t"
+                        logger.info("Receive timeout configured")
+                    elif parameter == "stalltimeout":
+                        self.stallTimeout = int(value)
+                        print "\tStall timeout configured\r\n\t"
+                        logger.info("Stall timeout configured")
+                    elif parameter == "restartbackoff":
+                        self.restartBackoff = int(value)
+                        print "\tRestart backoff configured\r\n\t"
+                        logger.info("Restart backoff configured")
+                    elif parameter == "restartmax":
+                        self.restartMax = int(value)
+                        print "\tMaximum restart backoff configured\r\n\t"
+                        logger.info("Maximum restart backoff configured")
+                    elif parameter == "coincidencewindow":
+                        self.coincidenceWindow = float(value)
+                        print "\tCoincidence window configured\r\n\t"
+                        logger.info("Coincidence window configured")
+                    elif parameter == "coincidencebuffer":
+                        self.coincidenceBuffer = int(value)
+                        print "\tCoincidence buffer configured\r\n\t"
+                        logger.info("Coincidence buffer configured")
+                    elif parameter == "fusedstale":
+                        self.fusedStale = int(value)
+                        print "\tFused stale time configured\r\n\t"
+                        logger.info("Fused stale time configured")
+                    elif parameter == "processmode":
+                        self.processMode = value.lower() in ("1", "yes", "true", "on")
+                        print "\tProcess mode configured\r\n\t"
+                        logger.info("Process mode configured")
+                    elif parameter in config.DEVICE_PARAMETERS:
+                        # Old style file, device settings outside a section are device 1
+                        if parameter in config.SHARED_PARAMETERS:
+                            sharedDefaults.append([parameter, value])
+                        else:
+                            self.getDevice(deviceParameters, 1).append([parameter, value])
+                    else:
+                        # Old style file, parameter2 configures device 2
+                        match = re.match(r"^([a-z]+)(\d+)$", parameter)
 
-                        if self.protocol != self.UNKNOWN:
-                            print "\tProtocol 1 configured\r\n\t"
-                            logger.info("Protocol 1 configured")
+                        if match and match.group(1) in config.DEVICE_PARAMETERS:
+                            self.getDevice(deviceParameters, int(match.group(2))).append([match.group(1), value])
                 # End of if
             # End of while
 
             f.close()
+            fusedParameters = deviceParameters.pop("fused", None)
+
+            for number in sorted(deviceParameters.keys()):
+                device = deviceConfig(number, self.uploadInterval)
+
+                for parameter, value in sharedDefaults + deviceParameters[number]:
+                    device.setParameter(parameter, value)
+
+                self.devices.append(device)
+
+            if fusedParameters is not None:
+                self.fused = deviceConfig("fused", self.uploadInterval)
+
+                for parameter, value in sharedDefaults + fusedParameters:
+                    self.fused.setParameter(parameter, value)
         except Exception as e:
-            print "\tFailed to read configuration file 1:\r\n\t" + str(e) + "\r\nExiting\r\n"
-            logger.exception("Failed to read configuration file 1: " + str(e))
+            print "\tFailed to read configuration file:\r\n\t" + str(e) + "\r\nExiting\r\n"
+            logger.exception("Failed to read configuration file: " + str(e))
             # Set EOL for log
             logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
             logging.shutdown()
             exit(1)
 
+        # An explicit serverport wins, whatever the order of the settings
+        if self.serverPort is None:
+            self.serverPort = 443 if self.https else 80
+
         # Well done, configuration is ready to use
         print ""
 
-class config2():
-    # Used as enums
-    UNKNOWN = 0
-    DEMO = 1
-    MYGEIGER = 2
-    GMC = 3
-    NETIO = 4
-    AUDIO = 5
+    def getDevice(self, deviceParameters, number):
+        if number not in deviceParameters:
+            deviceParameters[number] = []
 
-    def __init__(self):
-        # Define constants
-        self.CONFIGFILE = "config.txt"
-        self.UNKNOWN = 0
-        self.DEMO = 1
-        self.MYGEIGER = 2
-        self.GMC = 3
-        self.NETIO = 4
-        self.AUDIO = 5
+        return deviceParameters[number]
+
+class deviceConfig():
+    """
+      Settings of one Geiger counter, number is its position in config.txt
+      and names it "geiger <number>" everywhere.
+    """
+    def __init__(self, number, uploadInterval = 60):
+        self.number = number
         self.user = "not_set"
         self.password = "not_set"
         self.portName = None
         self.portSpeed = 2400
         self.timeout = 40 # Not used for now
-        self.protocol = self.UNKNOWN
+        self.protocol = config.UNKNOWN
         self.deviceIndex = 0
+        self.filter = config.FILTER_HAMPEL
+        self.filterWindow = 9
+        self.filterSigma = 5.0
+        self.tube = "sbm-20"
+        self.conversionFactor = None
+        self.energyCompensation = 1.0
+        # Seconds between two averaged samples of this counter
+        self.uploadInterval = uploadInterval
+
+    def setParameter(self, parameter, value):
+        """
+          Returns False when parameter is not a device setting.
+        """
+        number = str(self.number)
+
+        if parameter == "user":
+            self.user = value
+            print "\tUser name " + number + " configured\r\n\t"
+            logger.info("User name " + number + " configured")
+        elif parameter == "password":
+            self.password = value
+            print "\tPassword " + number + " configured\r\n\t"
+            logger.info("Password " + number + " configured")
+        elif parameter == "serialport":
+            self.portName = value
+            print "\tSerial port name " + number + " configured\r\n\t"
+            logger.info("Serial port name " + number + " configured")
+        elif parameter == "speed":
+            self.portSpeed = int(value)
+            print "\tSerial port speed " + number + " configured\r\n\t"
+            logger.info("Serial port speed " + number + " configured")
+        elif parameter == "device":
+            self.deviceIndex = int(value)
+            print "\tDevice number " + number + " configured\r\n\t"
+            logger.info("Device number " + number + " configured")
+        elif parameter == "filter":
+            value = value.lower()
+
+            if value == "hampel":
+                self.filter = config.FILTER_HAMPEL
+            else:
+                self.filter = config.FILTER_NONE
+
+            print "\tSample filter " + number + " configured\r\n\t"
+            logger.info("Sample filter " + number + " configured")
+        elif parameter == "filterwindow":
+            self.filterWindow = int(value)
+            print "\tSample filter window " + number + " configured\r\n\t"
+            logger.info("Sample filter window " + number + " configured")
+        elif parameter == "filtersigma":
+            self.filterSigma = float(value)
+            print "\tSample filter sigma " + number + " configured\r\n\t"
+            logger.info("Sample filter sigma " + number + " configured")
+        elif parameter == "tube":
+            value = value.lower()
+
+            if value in TUBE_FACTORS:
+                self.tube = value
+                print "\tTube type " + number + " configured\r\n\t"
+                logger.info("Tube type " + number + " configured")
+            else:
+                print "\tUnknown tube type " + number + ", set conversionfactor instead\r\n\t"
+                logger.warning("Unknown tube type " + number + ": " + value)
+        elif parameter == "conversionfactor":
+            self.conversionFactor = float(value)
+            print "\tConversion factor " + number + " configured\r\n\t"
+            logger.info("Conversion factor " + number + " configured")
+        elif parameter == "energycompensation":
+            self.energyCompensation = float(value)
+            print "\tEnergy compensation " + number + " configured\r\n\t"
+            logger.info("Energy compensation " + number + " configured")
+        elif parameter == "uploadinterval":
+            self.uploadInterval = max(5, int(value))
+            print "\tUpload interval " + number + " configured\r\n\t"
+            logger.info("Upload interval " + number + " configured")
+        elif parameter == "protocol":
+            value = value.lower()
+
+            if value == "mygeiger":
+                self.protocol = config.MYGEIGER
+            elif value == "demo":
+                self.protocol = config.DEMO
+            elif value == "gmc":
+                self.protocol = config.GMC
+            elif value == "netio":
+                self.protocol = config.NETIO
+            elif value == "audio":
+                self.protocol = config.AUDIO
+            else:
+                self.protocol = config.UNKNOWN
 
-    def readConfig(self):
-        print "Reading configuration 2:\r\n\t"
-        logger.info("Reading configuration 2")
-
-        # If file is present then try to read configuration from it
-        try:
-            f = open(self.CONFIGFILE)
-            line = " "
-
-            # Analyze file line by line, format is parameter=value
-            while(line):
-                line = f.readline()
-                params = line.split("=")
-
-                if len(params) == 2:
-                    parameter = params[0].strip().lower()
-                    value = params[1].strip()
-                    if parameter == "user2":
-                        self.user = value
-                        print "\tUser name 2 configured\r\n\t"
-                        logger.info("User name 2 configured")
-                    elif parameter == "password2":
-                        self.password = value
-                        print "\tPassword 2 configured\r\n\t"
-                        logger.info("Password 2 configured")
-                    elif parameter == "serialport2":
-                        self.portName = value
-                        print "\tSerial port name 2 configured\r\n\t"
-                        logger.info("Serial port name 2 configured")
-                    elif parameter == "speed2":
-                        self.portSpeed = int(value)
-                        print "\tSerial port speed 2 configured\r\n\t"
-                        logger.info("Serial port speed 2 configured")
-                    elif parameter == "device2":
-                        self.deviceIndex = int(value)
-                        print "\tDevice number 2 configured\r\n\t"
-                        logger.info("Device number 2 configured")
-                    elif parameter == "protocol2":
-                        value = value.lower()
-                        if value == "mygeiger":
-                            self.protocol = self.MYGEIGER
-                        elif value == "demo":
-                            self.protocol = self.DEMO
-                        elif value == "gmc":
-                            self.protocol = self.GMC
-                        elif value == "netio":
-                            self.protocol = self.NETIO
-                        elif value == "audio":
-                            self.protocol = self.AUDIO
-                        else:
-                            self.protocol = self.UNKNOWN
-
-                        if self.protocol != self.UNKNOWN:
-                            print "\tProtocol 2 configured\r\n\t"
-                            logger.info("Protocol 2 configured")
-                # End of if
-            # End of while
-
-            f.close()
-        except Exception as e:
-            print "\tFailed to read configuration file 2:\r\n\t" + str(e) + "\r\nExiting\r\n"
-            logger.exception("Failed to read configuration file 2 " + str(e))
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            exit(1)
+            if self.protocol != config.UNKNOWN:
+                print "\tProtocol " + number + " configured\r\n\t"
+                logger.info("Protocol " + number + " configured")
+        else:
+            return False
 
-        # well done, configuration is ready to use
-        print ""
+        return True
 
 ################################################################################
 # Part 2 - Geiger counter communication
@@ -257,21 +505,39 @@ class config2():
 # creating new class based on baseGeigerCommunication, as it's done in
 # classes Demo and myGeiger
 ################################################################################
+class deviceFailure(Exception):
+    """
+      Raised by driver.fail() to end a driver thread that gave up.
+    """
+    pass
+
 class baseGeigerCommunication(threading.Thread):
+    # Integration time of a single reading in seconds, serial devices report a
+    # CPM value so assume it covers a minute unless the driver knows better
+    sampleSeconds = 60
+
     def __init__(self, cfg):
         super(baseGeigerCommunication, self).__init__()
+        self.deviceName = "geiger " + str(cfg.number)
         self.sPortName = cfg.portName
         self.sPortSpeed = cfg.portSpeed
         self.timeout = cfg.timeout
         self.stopwork = 0
-        self.queue = deque()
+        self.accumulator = sampleAccumulator(self.sampleSeconds)
+        self.sampleFilter = createSampleFilter(cfg)
         self.queueLock = 0
         self.is_running = 1
+        # Set when the driver gave up, the device supervisor restarts it
+        self.failed = 0
+        # time.time() of the last accepted sample, start counts as one
+        self.lastSample = time.time()
+        # fusedCommunication this counter is part of
+        self.fusion = None
         self.name = "baseGeigerCommunication"
 
     def run(self):
         try:
-            print "Gathering data started => geiger 1\r\n"
+            print "Gathering data started => " + self.deviceName + "\r\n"
             self.serialPort = serial.Serial(self.sPortName, self.sPortSpeed, timeout = 1)
             self.serialPort.flushInput()
             self.initCommunication()
@@ -279,29 +545,38 @@ class baseGeigerCommunication(threading.Thread):
             while(self.stopwork == 0):
                 result = self.getData()
 
+                if not self.sampleFilter.check(result):
+                    print "Geiger sample rejected by filter => " + self.deviceName + ":\tCPM =", result[0], "\t", str(result[1]), "\r\n"
+                    logger.warning("Geiger sample rejected by filter => " + self.deviceName + ": CPM = " + str(result[0]))
+                    continue
+
                 while(self.queueLock == 1):
-                    print "Geiger communication: queue locked! => geiger 1\r\n"
-                    logger.warning("Geiger communication: queue locked! => geiger 1")
+                    print "Geiger communication: queue locked! => " + self.deviceName + "\r\n"
+                    logger.warning("Geiger communication: queue locked! => " + self.deviceName)
                     time.sleep(0.5)
 
                 self.queueLock = 1
-                self.queue.append(result)
+                counted = self.accumulator.add(result)
+                self.lastSample = time.time()
                 self.queueLock = 0
-                print "Geiger sample => geiger 1:\tCPM =", result[0], "\t", str(result[1])
+
+                if self.fusion is not None:
+                    self.fusion.add(self.deviceName, counted, result[1])
+
+                print "Geiger sample => " + self.deviceName + ":\tCPM =", result[0], "\t", str(result[1])
 
             self.serialPort.close()
-            print "Gathering data from Geiger stopped => geiger 1\r\n"
+            print "Gathering data from Geiger stopped => " + self.deviceName + "\r\n"
         except serial.SerialException as e:
-            print "Problem with serial port => geiger 1:\r\n\t", str(e),"\r\nExiting\r\n"
-            logger.exception("Problem with serial port => geiger 1: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            print "Problem with serial port => " + self.deviceName + ":\r\n\t", str(e),"\r\nExiting\r\n"
+            logger.exception("Problem with serial port => " + self.deviceName + ": " + str(e))
+            self.fail(False)
+        except deviceFailure:
+            # Already reported where it happened
+            self.closePort()
 
     def initCommunication(self):
-        print "Initializing geiger communication => geiger 1\r\n"
+        print "Initializing geiger communication => " + self.deviceName + "\r\n"
 
     def sendCommand(self, command):
         self.serialPort.flushInput()
@@ -326,56 +601,79 @@ class baseGeigerCommunication(threading.Thread):
         self.queueLock = 0
         self.is_running = 0
 
+    def fail(self, unwind = True):
+        """
+          Give up on the device: mark the driver failed, stop it and end the
+          thread. Only this counter is affected, the device supervisor
+          restarts it.
+        """
+        self.failed = 1
+        self.stop()
+
+        if unwind:
+            raise deviceFailure(self.deviceName)
+
+    def closePort(self):
+        try:
+            self.serialPort.close()
+        except Exception:
+            pass
+
     def getResult(self):
         # Check if we have some data in queue
-        if len(self.queue) > 0:
+        if self.accumulator.samples > 0:
             # Check if it's safe to process queue
             while(self.queueLock == 1):
-                print "getResult: queue locked! => geiger 1\r\n"
-                logger.warning("getResult: queue locked! => geiger 1")
+                print "getResult: queue locked! => " + self.deviceName + "\r\n"
+                logger.warning("getResult: queue locked! => " + self.deviceName)
                 time.sleep(0.5)
 
             # Put lock so measuring process will not interfere with queue,
             # processing should be fast enought to not break data acquisition from geiger
             self.queueLock = 1
-            cpm = 0
-
-            # Now get sum of all CPM's
-            for singleData in self.queue:
-                cpm = cpm + singleData[0]
-
-            # And divide by number of elements to get mean value, 0.5 is for rounding up/down
-            cpm = int((float(cpm) / len(self.queue)) + 0.5)
-            # Report with latest time from quene
-            utcTime = self.queue.pop()[1]
-            # Clear queue and remove lock
-            self.queue.clear()
+            # Time weighted mean CPM, total counts, integration time and
+            # confidence interval, reported with latest sample time
+            data = self.accumulator.getResult()
+            # Start a new window and remove lock
+            self.accumulator.clear()
             self.queueLock = 0
-            data = [cpm, utcTime]
         else:
             # No data in queue, return invalid CPM data and current time
-            data = [-1, datetime.datetime.utcnow()]
+            data = [-1, datetime.datetime.utcnow(), 0.0, 0.0, 0.0, 0.0]
 
         return data
 
 class Demo(baseGeigerCommunication):
+    # One random reading per 5 seconds
+    sampleSeconds = 5
+
     def run(self):
-        print "Gathering data started => geiger 1\r\n"
+        print "Gathering data started => " + self.deviceName + "\r\n"
 
         while(self.stopwork == 0):
             result = self.getData()
 
+            if not self.sampleFilter.check(result):
+                print "Geiger sample rejected by filter => " + self.deviceName + ":\tCPM =", result[0], "\t", str(result[1]), "\r\n"
+                logger.warning("Geiger sample rejected by filter => " + self.deviceName + ": CPM = " + str(result[0]))
+                continue
+
             while(self.queueLock == 1):
-                print "Geiger communication: quene locked! => geiger 1\r\n"
-                logger.warning("Geiger communication: queue locked! => geiger 1")
+                print "Geiger communication: quene locked! => " + self.deviceName + "\r\n"
+                logger.warning("Geiger communication: queue locked! => " + self.deviceName)
                 time.sleep(0.5)
 
             self.queueLock = 1
-            self.queue.append(result)
+            counted = self.accumulator.add(result)
+            self.lastSample = time.time()
             self.queueLock = 0
-            print "Geiger sample => geiger 1:\t", result, "\r\n"
 
-        print "Gathering data from Geiger stopped => geiger 1\r\n"
+            if self.fusion is not None:
+                self.fusion.add(self.deviceName, counted, result[1])
+
+            print "Geiger sample => " + self.deviceName + ":\t", result, "\r\n"
+
+        print "Gathering data from Geiger stopped => " + self.deviceName + "\r\n"
 
     def getData(self):
         for i in range(0, 5):
@@ -409,38 +707,33 @@ class myGeiger(baseGeigerCommunication):
             data = [cpm, utcTime]
             return data
         except Exception as e:
-            print "\r\nProblem in getData procedure (disconnected USB device?) => geiger 1:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem in getData procedure (disconnected USB device?) => geiger 1: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            print "\r\nProblem in getData procedure (disconnected USB device?) => " + self.deviceName + ":\r\n\t", str(e), "\r\nExiting\r\n"
+            logger.exception("Problem in getData procedure (disconnected USB device?) => " + self.deviceName + ": " + str(e))
+            self.fail()
 
 class gmc(baseGeigerCommunication):
+    # <GETCPM>> is polled every 3 seconds plus the 0.5 second command delay
+    sampleSeconds = 3.5
+
     def initCommunication(self):
-        print "Initializing GMC protocol communication => geiger 1\r\n"
-        logger.info("Initializing GMC protocol communication => geiger 1")
+        print "Initializing GMC protocol communication => " + self.deviceName + "\r\n"
+        logger.info("Initializing GMC protocol communication => " + self.deviceName)
         # Get firmware version
         response = self.sendCommand("<GETVER>>")
 
         if len(response) > 0:
-            print "Found GMC-compatible device, version => geiger 1: ", response, "\r\n"
+            print "Found GMC-compatible device, version => " + self.deviceName + ": ", response, "\r\n"
             # Disable heartbeat, we will request data from script
             self.sendCommand("<HEARTBEAT0>>")
-            print "Please note data will be acquired once per 5 seconds => geiger 1\r\n"
+            print "Please note data will be acquired once per 5 seconds => " + self.deviceName + "\r\n"
             # Update the device time
             unitTime = self.sendCommand("<GETDATETIME>>")
-            print "Unit shows time as => geiger 1: ", unitTime, "\r\n"
+            print "Unit shows time as => " + self.deviceName + ": ", unitTime, "\r\n"
             print "<SETDATETIME[" + time.strftime("%y%m%d%H%M%S") + "]>>"
         else:
-            print "No response from device => geiger 1\r\n"
-            logger.error("No response from device => geiger 1")
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            print "No response from device => " + self.deviceName + "\r\n"
+            logger.error("No response from device => " + self.deviceName)
+            self.fail()
 
     def getData(self):
         cpm = -1
@@ -457,26 +750,25 @@ class gmc(baseGeigerCommunication):
                 # Convert bytes to 16 bit int
                 cpm = ord(response[0]) * 256 + ord(response[1])
             else:
-                print "Unknown response to CPM request, device is not GMC-compatible? => geiger 1\r\n"
-                logger.error("Unknown response to CPM request, device is not GMC-compatible? => geiger 1")
-                self.stop()
-                logger.shutdown()
-                sys.exit(1)
+                print "Unknown response to CPM request, device is not GMC-compatible? => " + self.deviceName + "\r\n"
+                logger.error("Unknown response to CPM request, device is not GMC-compatible? => " + self.deviceName)
+                self.fail()
 
             utcTime = datetime.datetime.utcnow()
             data = [cpm, utcTime]
             return data
 
+        except deviceFailure:
+            raise
         except Exception as e:
-            print "\r\nProblem in getData procedure (disconnected USB device?) => geiger 1:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem in getData procedure (disconnected USB device?) => geiger 1: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            print "\r\nProblem in getData procedure (disconnected USB device?) => " + self.deviceName + ":\r\n\t", str(e), "\r\nExiting\r\n"
+            logger.exception("Problem in getData procedure (disconnected USB device?) => " + self.deviceName + ": " + str(e))
+            self.fail()
 
 class netio(baseGeigerCommunication):
+    # NetIO is read once per 30 seconds
+    sampleSeconds = 30
+
     def getData(self):
         cpm = -1
 
@@ -509,793 +801,3026 @@ class netio(baseGeigerCommunication):
             return data
 
         except Exception as e:
-            print "\r\nProblem in getData procedure (disconnected USB device?) => geiger 1:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem in getData procedure (disconnected USB device?) => geiger 1: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            print "\r\nProblem in getData procedure (disconnected USB device?) => " + self.deviceName + ":\r\n\t", str(e), "\r\nExiting\r\n"
+            logger.exception("Problem in getData procedure (disconnected USB device?) => " + self.deviceName + ": " + str(e))
+            self.fail()
 
     def initCommunication(self):
-        print "Initializing NetIO => geiger 1\r\n"
-        logger.info("Initializing NetIO => geiger 1")
+        print "Initializing NetIO => " + self.deviceName + "\r\n"
+        logger.info("Initializing NetIO => " + self.deviceName)
         # send "go" to start receiving CPM data
         response = self.sendCommand("go\r\n")
-        print "Please note data will be acquired once per 30 seconds => geiger 1\r\n"
-
-class baseGeigerCommunication2(threading.Thread):
-    def __init__(self, cfg2):
-        super(baseGeigerCommunication2, self).__init__()
-        self.sPortName = cfg2.portName
-        self.sPortSpeed = cfg2.portSpeed
-        self.timeout = cfg2.timeout
+        print "Please note data will be acquired once per 30 seconds => " + self.deviceName + "\r\n"
+
+################################################################################
+# Part 2b - audio geiger handeler
+################################################################################
+# If the noise was longer than this many blocks, it's not a 'tap'
+def get_rms(block):
+    """
+      RMS amplitude is defined as the square root of the mean over time of the square of the amplitude.
+      So we need to convert this string of bytes into a string of 16-bit samples...
+      We will get one short out for each two chars in the string.
+    """
+    count = len(block) / 2
+    format = "%dh"%(count)
+    shorts = struct.unpack(format, block)
+    # Iterate over the block.
+    sum_squares = 0.0
+
+    for sample in shorts:
+        # Sample is a signed short in +/- 32768. Normalize it to 1.0
+        n = sample * (1.0 / 32768.0)
+        sum_squares += n * n
+
+    return math.sqrt(sum_squares / count)
+
+def get_peak(block, channels):
+    """
+      Frame index of the loudest sample in the block, where the tap is.
+    """
+    shorts = struct.unpack("%dh" % (len(block) / 2), block)
+    peak = 0
+
+    for i in range(1, len(shorts)):
+        if abs(shorts[i]) > abs(shorts[peak]):
+            peak = i
+
+    return peak / channels
+
+class audioCommunication(threading.Thread):
+    # Taps are counted over 30 second blocks
+    sampleSeconds = 30
+
+    def __init__(self, cfg):
+        super(audioCommunication, self).__init__()
+        self.deviceName = "geiger " + str(cfg.number)
+        self.initCommunication()
+        self.timeout = cfg.timeout
         self.stopwork = 0
-        self.queue = deque()
+        self.accumulator = sampleAccumulator(self.sampleSeconds)
+        self.sampleFilter = createSampleFilter(cfg)
         self.queueLock = 0
         self.is_running = 1
-        self.name = "baseGeigerCommunication2"
+        # Set when the driver gave up, the device supervisor restarts it
+        self.failed = 0
+        # time.time() of the last accepted sample, start counts as one
+        self.lastSample = time.time()
+        # fusedCommunication this counter is part of
+        self.fusion = None
+        # Opened by getData, stays None when the sound card refused
+        self.stream = None
+        self.pa = pyaudio.PyAudio()
+        self.device_index = cfg.deviceIndex
+        self.device_Channels = self.pa.get_device_info_by_index(self.device_index)['maxInputChannels']
+        self.noisycount = 0
+        self.bSquelchIoerror = int(1) != 0
+        # Set by the device to a pulseStream when coincidence detection is on
+        self.pulseStream = None
+        self.name = "audioCommunication"
+
+    def initCommunication(self):
+        print "Initializing audio communication => " + self.deviceName + "\r\n"
+        logger.info("Initializing audio communication => " + self.deviceName)
 
     def run(self):
         try:
-            print "Gathering data started => geiger 2\r\n"
-            self.serialPort = serial.Serial(self.sPortName, self.sPortSpeed, timeout = 1)
-            self.serialPort.flushInput()
-            self.initCommunication()
+            print "Gathering data started => " + self.deviceName + "\r\n"
 
             while(self.stopwork == 0):
                 result = self.getData()
 
+                if not self.sampleFilter.check(result):
+                    print "Geiger sample rejected by filter => " + self.deviceName + ":\tCPM =", result[0], "\t", str(result[1]), "\r\n"
+                    logger.warning("Geiger sample rejected by filter => " + self.deviceName + ": CPM = " + str(result[0]))
+                    continue
+
                 while(self.queueLock == 1):
-                    print "Geiger communication: queue locked! => geiger 2\r\n"
-                    logger.warning("Geiger communication: queue locked! => geiger 2")
+                    print "Geiger communication: quene locked! => " + self.deviceName + "\r\n"
+                    logger.warning("Geiger communication: quene locked! => " + self.deviceName)
                     time.sleep(0.5)
 
                 self.queueLock = 1
-                self.queue.append(result)
+                counted = self.accumulator.add(result)
+                self.lastSample = time.time()
                 self.queueLock = 0
-                print "Geiger sample => geiger 2:\tCPM =", result[0], "\t", str(result[1]), "\r\n"
 
-            self.serialPort.close()
-            print "Gathering data from Geiger stopped => geiger 2\r\n"
-        except serial.SerialException as e:
-            print "Problem with serial port => geiger 2:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem with serial port => geiger 2: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+                if self.fusion is not None:
+                    self.fusion.add(self.deviceName, counted, result[1])
 
-    def initCommunication(self):
-        print "Initializing geiger communication => geiger 2\r\n"
+                print "Geiger sample => " + self.deviceName + ":\tCPM =", result[0], "\t", str(result[1]), "\r\n"
 
-    def sendCommand(self, command):
-        self.serialPort.flushInput()
-        self.serialPort.write(command)
-        # Sssume that device responds within 0.5s
-        time.sleep(0.5)
-        response = ""
+            print "Gathering data from Geiger stopped => " + self.deviceName + "\r\n"
+        except deviceFailure:
+            # Already reported where it happened
+            pass
+        except Exception as e:
+            print "Problem with audio port => " + self.deviceName + ":\r\n\t", str(e), "\r\nExiting\r\n"
+            logger.exception("Problem with audio port => " + self.deviceName + ": " + str(e))
+            self.fail(False)
 
-        while(self.serialPort.inWaiting() > 0 and self.stopwork == 0):
-            response = response + self.serialPort.read()
+    def getData(self):
+        if self.device_Channels > 2:
+            self.device_Channels = 2
 
-        return response
+        startTime = time.time()
+        self.stream = self.pa.open(format = pyaudio.paInt16,
+                                   channels = self.device_Channels,
+                                   rate = 44100,
+                                   input = True,
+                                   input_device_index = self.device_index,
+                                   start = True,
+                                   frames_per_buffer = int(44100 * 0.05))
+        # Tap times are counted in frames of the sample clock from here
+        streamStart = time.time()
+        frames = 0
+
+        for i in range(0, int(44100 / 1024 * 30)):
+            try:
+                if not self.stream: break
+
+                block = self.stream.read(1024)
+            except (pyaudio.paInputOverflowed, IOError,):
+                """
+                  Buffer overflows are a real problem in pyaudio depending on the choice of fRate and CHUNK.
+                  Signal them to the user, but ignore them - play with fRate and CHUNK until they are at a minimum
+                """
+                if self.is_running and not self.bSquelchIoerror:
+                    print "paInputOverflow on audio port => %d"
+                    logger.error("paInputOverflow on audio port => %d")
+
+                # The lost block still took its time on the sample clock
+                frames += 1024
+
+                if self.pulseStream is not None:
+                    self.pulseStream.advance(streamStart + frames / 44100.0)
+
+                continue
+            except Exception as ex:
+                print "Problem with audio port => " + self.deviceName + "\r\n\t", str(ex), "\r\n\tExiting\r\n\t"
+                logger.exception("Problem with serial port => " + self.deviceName + ": " + str(ex))
+
+                if self.stream:
+                    self.stream.stop_stream()
+                    self.stream.close()
+                    self.stream = None
+
+                self.fail()
+
+            amplitude = get_rms(block)
+
+            if amplitude > 0.010:
+                # Noisy block
+                self.noisycount += 1
+
+                if self.pulseStream is not None:
+                    self.pulseStream.add(streamStart + (frames + get_peak(block, self.device_Channels)) / 44100.0)
+
+            frames += 1024
+
+            if self.pulseStream is not None:
+                self.pulseStream.advance(streamStart + frames / 44100.0)
+
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+        if self.noisycount >= 0:
+            counts = self.noisycount
+            cpm = self.noisycount * (60 / 30)
+            self.noisycount = 0
 
-    def getData(self):
-        cpm = 25
         utcTime = datetime.datetime.utcnow()
-        data = [cpm, utcTime]
+        # Taps are real counts, so report them with the time actually spent listening
+        data = [cpm, utcTime, counts, time.time() - startTime]
         return data
 
     def stop(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
         self.stopwork = 1
         self.queueLock = 0
         self.is_running = 0
 
+    def fail(self, unwind = True):
+        """
+          Give up on the sound card: mark the driver failed, stop it and end
+          the thread. The device supervisor restarts it.
+        """
+        self.failed = 1
+        self.stop()
+        self.pa.terminate()
+
+        if unwind:
+            raise deviceFailure(self.deviceName)
+
     def getResult(self):
         # Check if we have some data in queue
-        if len(self.queue) > 0:
-
+        if self.accumulator.samples > 0:
             # Check if it's safe to process queue
             while(self.queueLock == 1):
-                print "getResult: queue locked! => geiger 2\r\n"
-                logger.warning("getResult: queue locked! => geiger 2")
+                print "getResult: quene locked! => " + self.deviceName + "\r\n"
+                logger.warning("getResult: queue locked! => " + self.deviceName)
                 time.sleep(0.5)
 
-            # Put lock so measuring process will not interfere with queue,
-            # processing should be fast enought to not break data acquisition from geiger
+            """
+              Put a lock so measuring process will not interfere with queue,
+              processing should be fast enought to not break data acquisition from geiger
+            """
             self.queueLock = 1
-
-            cpm = 0
-            # Now get sum of all CPM's
-            for singleData in self.queue:
-                cpm = cpm + singleData[0]
-
-            # And divide by number of elements to get mean value, 0.5 is for rounding up/down
-            cpm = int((float(cpm) / len(self.queue)) + 0.5)
-            # Report with latest time from quene
-            utcTime = self.queue.pop()[1]
-            # Clear queue and remove lock
-            self.queue.clear()
+            # Time weighted mean CPM, total counts, integration time and
+            # confidence interval, reported with latest sample time
+            data = self.accumulator.getResult()
+            # Start a new window and remove lock
+            self.accumulator.clear()
             self.queueLock = 0
-            data = [cpm, utcTime]
         else:
             # No data in queue, return invalid CPM data and current time
-            data = [-1, datetime.datetime.utcnow()]
+            data = [-1, datetime.datetime.utcnow(), 0.0, 0.0, 0.0, 0.0]
 
         return data
+    
+################################################################################
+# Part 2c - sample statistics
+################################################################################
+# z-value of the two sided confidence interval reported with every average,
+# 1.96 gives the usual 95% interval
+POISSON_Z = 1.96
 
-class Demo2(baseGeigerCommunication2):
-    def run(self):
-        print "Gathering data started => geiger 2\r\n"
+def poissonInterval(counts, seconds):
+    """
+      Confidence interval of a counting rate, returned as [low, high] in CPM.
+      Uses Byar's approximation of the exact (chi-square) Poisson interval,
+      it stays within a few percent of the exact limits down to a handful of
+      counts and only costs a couple of float operations.
+    """
+    if seconds <= 0:
+        return [0.0, 0.0]
 
-        while(self.stopwork == 0):
-            result = self.getData()
+    minutes = seconds / 60.0
+    low = 0.0
 
-            while(self.queueLock == 1):
-                print "Geiger communication: queue locked! => geiger 2\r\n"
-                logger.warning("Geiger communication: queue locked! => geiger 2")
-                time.sleep(0.5)
+    if counts > 0:
+        n = float(counts)
+        low = n * (1.0 - 1.0 / (9.0 * n) - POISSON_Z / (3.0 * math.sqrt(n))) ** 3
 
-            self.queueLock = 1
-            self.queue.append(result)
-            self.queueLock = 0
-            print "Geiger sample => geiger 2:\t", result, "\r\n"
+    n = float(counts) + 1.0
+    high = n * (1.0 - 1.0 / (9.0 * n) + POISSON_Z / (3.0 * math.sqrt(n))) ** 3
+    return [max(low, 0.0) / minutes, high / minutes]
 
-        print "Gathering data from Geiger stopped => geiger 2\r\n"
+class sampleAccumulator():
+    """
+      Running aggregate of driver samples, weighted by the time each sample
+      covers so that drivers with different or varying sampling intervals still
+      give the right mean. Only sums are kept, adding a sample is O(1).
+      A driver sample is [cpm, utcTime] and may carry [counts, seconds] when
+      the driver knows them (audio), otherwise the sample covers the time since
+      the previous one, limited to twice the nominal sampleSeconds so a gap
+      after a reconnect or stall is not counted as measured time.
+    """
+    def __init__(self, sampleSeconds):
+        self.sampleSeconds = sampleSeconds
+        self.lastTime = None
+        self.clear()
+
+    def clear(self):
+        self.samples = 0
+        self.counts = 0.0
+        self.seconds = 0.0
+        self.cpmSum = 0
+        self.utcTime = None
+
+    def add(self, data):
+        cpm = data[0]
+        utcTime = data[1]
+
+        if len(data) > 3:
+            counts = data[2]
+            seconds = data[3]
+        else:
+            seconds = self.sampleSeconds
 
-    def getData(self):
-        for i in range(0, 5):
-            time.sleep(1)
+            if self.lastTime is not None:
+                elapsed = (utcTime - self.lastTime).total_seconds()
 
-        cpm = random.randint(5, 40)
-        utcTime = datetime.datetime.utcnow()
-        data = [cpm, utcTime]
-        return data
+                if elapsed > 0:
+                    seconds = min(elapsed, 2 * self.sampleSeconds)
 
-class myGeiger2(baseGeigerCommunication2):
-    def getData(self):
-        cpm = -1
+            counts = cpm * seconds / 60.0
 
-        try:
-            # Wait for data
-            while(self.serialPort.inWaiting() == 0 and self.stopwork == 0):
-                time.sleep(1)
+        self.lastTime = utcTime
+        self.samples = self.samples + 1
+        self.counts = self.counts + counts
+        self.seconds = self.seconds + seconds
+        self.cpmSum = self.cpmSum + cpm
+        self.utcTime = utcTime
+        return [counts, seconds]
 
-            time.sleep(0.1) # Just to ensure all CPM bytes are in serial port buffer
-            # Read all available data
-            x = ""
-            while(self.serialPort.inWaiting() > 0 and self.stopwork == 0):
-                x = x + self.serialPort.read()
+    def getResult(self):
+        """
+          Aggregate of the current window:
+            [cpm, utcTime, counts, seconds, cpmLow, cpmHigh]
+        """
+        if self.seconds > 0:
+            cpm = self.counts * 60.0 / self.seconds
+        else:
+            cpm = float(self.cpmSum) / self.samples
 
-            if len(x) > 0:
-                cpm = int(x)
+        # 0.5 is for rounding up/down
+        return [int(cpm + 0.5), self.utcTime, self.counts, self.seconds] + poissonInterval(self.counts, self.seconds)
 
-            utcTime = datetime.datetime.utcnow()
-            data = [cpm, utcTime]
-            return data
-        except Exception as e:
-            print "\r\nProblem in getData procedure (disconnected USB device?) => geiger 2:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem in getData procedure (disconnected USB device?) => geiger 2: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+################################################################################
+# Part 2d - sample filters
+#
+# A filter sits between a driver and its accumulator and decides per sample
+# whether it is averaged. New filters are made by creating a class based on
+# baseSampleFilter and adding it to createSampleFilter.
+################################################################################
+class runningMedian():
+    """
+      Median of the last 'window' values in O(log window) per value. Two heaps
+      hold the lower and upper half, values that slide out of the window are
+      only marked and dropped once they reach the top of their heap.
+    """
+    def __init__(self, window):
+        self.window = deque()
+        self.windowSize = window
+        self.low = [] # Max heap, stored negated
+        self.high = [] # Min heap
+        self.lowSize = 0
+        self.highSize = 0
+        self.delayed = {}
+
+    def __len__(self):
+        return len(self.window)
+
+    def prune(self, heap, sign):
+        while heap:
+            value = heap[0] * sign
+
+            if self.delayed.get(value, 0) == 0:
+                break
+
+            self.delayed[value] -= 1
+            heapq.heappop(heap)
+
+    def balance(self):
+        if self.lowSize > self.highSize + 1:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.lowSize -= 1
+            self.highSize += 1
+            self.prune(self.low, -1)
+        elif self.lowSize < self.highSize:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.highSize -= 1
+            self.lowSize += 1
+            self.prune(self.high, 1)
+
+    def add(self, value):
+        if not self.low or value <= -self.low[0]:
+            heapq.heappush(self.low, -value)
+            self.lowSize += 1
+        else:
+            heapq.heappush(self.high, value)
+            self.highSize += 1
 
-class gmc2(baseGeigerCommunication2):
-    def initCommunication(self):
-        print "Initializing GMC protocol communication => geiger 2\r\n"
-        logger.info("Initializing GMC protocol communication => geiger 2")
-        # Get firmware version
-        response=self.sendCommand("<GETVER>>")
+        self.window.append(value)
 
-        if len(response) > 0:
-            print "Found GMC-compatible device, version => geiger 2: ", response, "\r\n"
-            # Disable heartbeat, we will request data from script
-            self.sendCommand("<HEARTBEAT0>>")
-            print "Please note data will be acquired once per 5 seconds => geiger 2\r\n"
-            # Update the device time
-            unitTime=self.sendCommand("<GETDATETIME>>")
-            print "Unit shows time as => geiger 2: ", unitTime, "\r\n"
-            print "<SETDATETIME[" + time.strftime("%y%m%d%H%M%S") + "]>>"
+        if len(self.window) > self.windowSize:
+            old = self.window.popleft()
+            self.delayed[old] = self.delayed.get(old, 0) + 1
+
+            if old <= -self.low[0]:
+                self.lowSize -= 1
+
+                if old == -self.low[0]:
+                    self.prune(self.low, -1)
+            else:
+                self.highSize -= 1
+
+                if self.high and old == self.high[0]:
+                    self.prune(self.high, 1)
+
+        self.balance()
+
+    def median(self):
+        if self.lowSize > self.highSize:
+            return float(-self.low[0])
+
+        return (-self.low[0] + self.high[0]) / 2.0
+
+class baseSampleFilter():
+    def __init__(self, cfg):
+        # Rejected samples are kept aside for inspection, the latest 100 of them
+        self.rejected = deque(maxlen = 100)
+        self.rejectedCount = 0
+
+    def isValid(self, data):
+        return True
+
+    def check(self, data):
+        """
+          Returns True when the sample may be averaged, otherwise it is
+          counted and kept aside in self.rejected.
+        """
+        if data[0] >= 0 and self.isValid(data):
+            return True
+
+        self.rejected.append(data)
+        self.rejectedCount += 1
+        return False
+
+class hampelFilter(baseSampleFilter):
+    """
+      Hampel style spike filter: a sample is rejected when it is further than
+      filtersigma standard deviations from the running median of the last
+      filterwindow samples. The deviation is the Poisson one of the median
+      rate, a device CPM reading being a one minute count unless the sample
+      carries its own integration time. Rejected samples still enter the
+      window, so a real and lasting change is followed after window/2 samples.
+    """
+    def __init__(self, cfg):
+        baseSampleFilter.__init__(self, cfg)
+        self.sigma = cfg.filterSigma
+        self.median = runningMedian(cfg.filterWindow)
+
+    def isValid(self, data):
+        cpm = data[0]
+        valid = True
 
+        # Need a few samples before the median means anything
+        if len(self.median) >= 3:
+            median = self.median.median()
+            seconds = 60.0
+
+            if len(data) > 3 and data[3] > 0:
+                seconds = data[3]
+
+            deviation = math.sqrt(max(median, 1.0) * 60.0 / seconds)
+            valid = abs(cpm - median) <= self.sigma * deviation
+
+        self.median.add(cpm)
+        return valid
+
+def createSampleFilter(cfg):
+    if cfg.filter == config.FILTER_HAMPEL:
+        return hampelFilter(cfg)
+
+    return baseSampleFilter(cfg)
+
+################################################################################
+# Part 2e - dose rate conversion
+################################################################################
+# Cs-137 conversion factors in uSv/h per CPM for common tubes,
+# "conversionfactor" in the configuration overrides these
+TUBE_FACTORS = {
+    "sbm-20": 0.0057,
+    "sbm-19": 0.0021,
+    "si-29bg": 0.0082,
+    "lnd-712": 0.0081,
+    "j305": 0.0081,
+    "m4011": 0.0065
+}
+
+class doseConverter():
+    def __init__(self, cfg):
+        factor = cfg.conversionFactor
+
+        if factor is None:
+            factor = TUBE_FACTORS[cfg.tube]
+
+        # Energy compensation scales the Cs-137 factor to the spectrum actually measured
+        self.factor = factor * cfg.energyCompensation
+
+    def convert(self, sample):
+        """
+          Extend an aggregate from getResult with its dose rate:
+            [cpm, utcTime, counts, seconds, cpmLow, cpmHigh, usvh, usvhLow, usvhHigh]
+        """
+        sample.extend([sample[0] * self.factor, sample[4] * self.factor, sample[5] * self.factor])
+        return sample
+
+    def convertHistory(self, cpmValues):
+        """
+          Convert a whole series of CPM values at once, used to reprocess stored
+          history after a recalibration. Uses numpy when it is installed.
+        """
+        if numpy is not None:
+            return numpy.asarray(cpmValues, dtype = numpy.float64) * self.factor
+
+        factor = self.factor
+        return array.array("d", [cpm * factor for cpm in cpmValues])
+
+    def convertHistoryFile(self, fileName):
+        """
+          Reprocess a "datetime,cpm" history file into fileName.usvh.csv with
+          "datetime,cpm,usvh" lines, returns the number of converted samples.
+        """
+        times = []
+        cpmValues = []
+        f = open(fileName)
+
+        for line in f:
+            params = line.strip().split(",")
+
+            if len(params) < 2:
+                continue
+
+            try:
+                cpmValues.append(float(params[1]))
+                times.append(params[0])
+            except ValueError:
+                # Header or comment line
+                continue
+
+        f.close()
+        doseValues = self.convertHistory(cpmValues)
+        f = open(fileName + ".usvh.csv", "w")
+
+        for i in range(0, len(times)):
+            f.write("%s,%s,%.5f\n" % (times[i], repr(cpmValues[i]), doseValues[i]))
+
+        f.close()
+        return len(times)
+
+################################################################################
+# Part 2f - devices
+#   Every counter in config.txt gets the same driver, conversion and upload
+#   classes, only its deviceConfig differs.
+################################################################################
+def createGeigerCommunication(cfg):
+    """
+      Driver thread for the configured protocol, None when it is unknown.
+    """
+    name = "geiger " + str(cfg.number)
+
+    if cfg.protocol == config.MYGEIGER:
+        print "Using myGeiger protocol => " + name + "\r\n"
+        logger.info("Using myGeiger protocol => " + name)
+        return myGeiger(cfg)
+    elif cfg.protocol == config.DEMO:
+        print "Using Demo mode => " + name + "\r\n"
+        logger.info("Using DEMO protocol => " + name)
+        return Demo(cfg)
+    elif cfg.protocol == config.GMC:
+        print "Using GMC protocol => " + name + "\r\n"
+        logger.info("Using GMC protocol => " + name)
+        return gmc(cfg)
+    elif cfg.protocol == config.NETIO:
+        print "Using NetIO protocol => " + name + "\r\n"
+        logger.info("Using NetIO protocol => " + name)
+        return netio(cfg)
+    elif cfg.protocol == config.AUDIO:
+        if pyaudio is None:
+            print "PyAudio is not installed, can't use the audio protocol => " + name + "\r\n"
+            logger.error("PyAudio is not installed, can't use the audio protocol => " + name)
+            return None
+
+        print "Using audio protocol => " + name + "\r\n"
+        logger.info("Using audio protocol => " + name)
+        return audioCommunication(cfg)
+
+    print "Unknown protocol configured, can't run => " + name + "\r\n"
+    logger.error("Unknown protocol configured, can't run => " + name)
+    return None
+
+class geigerDevice():
+    """
+      One counter: its driver thread, dose rate conversion and radmon.org
+      account. driver is None when the protocol is unknown, in process mode
+      it is the processCommunication of the device process.
+    """
+    def __init__(self, cfg, connection, processMode = False):
+        self.cfg = cfg
+        self.number = cfg.number
+        self.name = "geiger " + str(cfg.number)
+        self.processMode = processMode
+        # Tap timestamps for the coincidence engine, audio in thread mode only
+        self.pulseStream = None
+        # fusedCommunication this counter is part of
+        self.fusion = None
+        self.driver = self.createDriver()
+        self.started = time.time()
+        self.doseService = doseConverter(cfg)
+        self.webService = webCommunication(cfg, connection)
+
+    def createDriver(self):
+        if self.processMode and self.cfg.protocol != config.UNKNOWN:
+            driver = processCommunication(self.cfg)
         else:
-            print "No response from device => geiger 2\r\n"
-            logger.error("No response from device => geiger 2")
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            driver = createGeigerCommunication(self.cfg)
 
-    def getData(self):
-        cpm=-1
+        if isinstance(driver, audioCommunication):
+            driver.pulseStream = self.pulseStream
 
-        try:
-            # Wait, we want sample every 30s
-            for i in range(0, 3):
-                time.sleep(1)
+        if driver is not None:
+            driver.fusion = self.fusion
 
-            # Send request
-            response = self.sendCommand("<GETCPM>>")
-            
-            if len(response) == 2:
-                # Convert bytes to 16 bit int
-                cpm = ord(response[0]) * 256 + ord(response[1])
-            else:
-                print "Unknown response to CPM request, device is not GMC-compatible? => geiger 2\r\n"
-                logger.error("Unknown response to CPM request, device is not GMC-compatible? => geiger 2")
-                self.stop()
-                logger.shutdown()
-                sys.exit(1)
+        return driver
 
-            utcTime = datetime.datetime.utcnow()
-            data = [cpm, utcTime]
-            return data
+    def enableCoincidence(self, engine):
+        """
+          Feed this counter's taps to engine, False when it has none to give.
+        """
+        if not isinstance(self.driver, audioCommunication):
+            return False
 
+        self.pulseStream = engine.createStream(self.number)
+        self.driver.pulseStream = self.pulseStream
+        return True
+
+    def restart(self):
+        """
+          Replace a stopped driver with a new one, samples the old one still
+          held are carried over. Returns False when the new driver could not
+          be created.
+        """
+        try:
+            driver = self.createDriver()
         except Exception as e:
-            print "\r\nProblem in getData procedure (disconnected USB device?) => geiger 2:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem in getData procedure (disconnected USB device?) => geiger 2: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+            print "Failed to restart => " + self.name + ":\r\n\t", str(e), "\r\n"
+            logger.exception("Failed to restart => " + self.name + ": " + str(e))
+            return False
 
-class netio2(baseGeigerCommunication2):
-    def getData(self):
-        cpm = -1
+        data = self.driver.getResult()
 
-        try:
-            # We want data only once per 30 seconds, ignore rest it's averaged for 60 seconds by device anyway
-            for i in range(0, 30):
-                time.sleep(1)
+        if data[0] != -1:
+            driver.accumulator.add(data[:4])
+
+        self.started = time.time()
+        driver.lastSample = self.started
+        self.driver = driver
+        print "Device restarted => " + self.name + "\r\n"
+        logger.info("Device restarted => " + self.name)
+        driver.start()
+        return True
+
+def nextAlignedSlot(after, interval):
+    """
+      First time.time() after 'after' that is a whole multiple of interval.
+    """
+    return (math.floor(after / interval) + 1) * interval
+
+def sleepUntil(deadline, interrupted = None):
+    """
+      Sleep in 0.5 second steps until deadline, it has a better response when
+      CTRL+C is used. Returns how many seconds late it woke up, or 0 as soon
+      as interrupted() is true.
+    """
+    while True:
+        remaining = deadline - time.time()
+
+        if remaining <= 0:
+            return -remaining
+
+        if interrupted is not None and interrupted():
+            return 0
+
+        time.sleep(min(0.5, remaining))
+
+class deviceScheduler():
+    """
+      Shared timetable of the counters, every device is due on its own
+      uploadInterval at wall-clock instants that are whole multiples of it
+      (30 seconds: :00 and :30 of every minute). A device without samples is
+      only retried itself, the others keep their slots. Lateness of every
+      slot is kept as jitter, slots that passed while the loop was busy are
+      skipped and counted as missed.
+    """
+    # Seconds until a device with an empty queue is asked again
+    RETRY_INTERVAL = 5
+
+    def __init__(self, devices, now = None):
+        if now is None:
+            now = time.time()
+
+        # Heap of [due, device number, device]
+        self.heap = []
+        self.jitter = latencyHistogram()
+        self.missed = 0
+
+        for device in devices:
+            self.schedule(device, nextAlignedSlot(now, device.cfg.uploadInterval))
+
+    def schedule(self, device, due):
+        heapq.heappush(self.heap, [due, device.number, device])
+
+    def nextDue(self):
+        if len(self.heap) == 0:
+            return None
+
+        return self.heap[0][0]
+
+    def popDue(self, now = None):
+        """
+          Devices due at now, with their due times.
+        """
+        if now is None:
+            now = time.time()
+
+        due = []
+
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            due.append((entry[2], entry[0]))
+            self.jitter.add(now - entry[0])
+
+        return due
+
+    def wait(self, interrupted = None):
+        """
+          Sleep until the next device is due, or until interrupted() is true.
+        """
+        sleepUntil(self.nextDue(), interrupted)
+
+    def sampled(self, device, due, now = None):
+        """
+          Next aligned slot after the one just served, also after a retry.
+          Deadlines are absolute, so processing time does not add up.
+        """
+        if now is None:
+            now = time.time()
+
+        interval = device.cfg.uploadInterval
+        nextDue = nextAlignedSlot(due, interval)
+
+        if nextDue <= now:
+            self.missed = self.missed + int(round((nextAlignedSlot(now, interval) - nextDue) / interval))
+            nextDue = nextAlignedSlot(now, interval)
+
+        self.schedule(device, nextDue)
+
+    def formatStats(self):
+        stats = self.jitter.getStats()
+        return "jitter mean %.1f ms, p95 <= %.0f ms, max %.1f ms, %d missed slots" % (stats["mean"] * 1000,
+            stats["p95"] * 1000, stats["max"] * 1000, self.missed)
+
+    def empty(self, device, now = None):
+        if now is None:
+            now = time.time()
+
+        self.schedule(device, now + deviceScheduler.RETRY_INTERVAL)
+
+class deviceSupervisor(threading.Thread):
+    """
+      Watches every driver and restarts the ones that failed, died or did
+      not deliver a sample for 'stalltimeout' seconds. Restarts back off
+      exponentially from 'restartbackoff' up to 'restartmax' seconds and the
+      backoff resets once the new driver delivers. The other counters are
+      never touched.
+    """
+    def __init__(self, cfg, devices):
+        super(deviceSupervisor, self).__init__()
+        self.name = "deviceSupervisor"
+        self.daemon = True
+        self.devices = devices
+        self.stallTimeout = cfg.stallTimeout
+        self.restartBackoff = cfg.restartBackoff
+        self.restartMax = cfg.restartMax
+        self.stopwork = 0
+        # Per device number: [restarts in a row, time.time() of the next restart or None]
+        self.state = {}
+
+        for device in devices:
+            self.state[device.number] = [0, None]
+
+    def run(self):
+        while(self.stopwork == 0):
+            self.check()
+
+            for i in range(0, 2):
+                if self.stopwork == 1: break
 
-            # Wait for data, should be already there (from last 30s)
-            while(self.serialPort.inWaiting() == 0 and self.stopwork == 0):
                 time.sleep(0.5)
-            
-            time.sleep(0.1) # Just to ensure all CPM bytes are in serial port buffer
-            # Read all available data do not stop receiving unless it ends with \r\n
-            x = ""
 
-            while(x.endswith("\r\n") == False and self.stopwork == 0):
-                while(self.serialPort.inWaiting() > 0 and self.stopwork == 0 ):
-                    x = x + self.serialPort.read()
+    def check(self, now = None):
+        if now is None:
+            now = time.time()
 
-            # If CTRL+C pressed then x can be invalid so check it
-            if x.endswith("\r\n"):
-                # We want only latest data, ignore older
-                tmp = x.splitlines()
-                x = tmp[len(tmp) - 1]
-                cpm = int(x)
+        for device in self.devices:
+            # A driver that breaks while being stopped must not end the watch on the others
+            try:
+                self.checkDevice(device, now)
+            except Exception as e:
+                print "Device supervision error => " + device.name + ":\r\n\t", str(e), "\r\n"
+                logger.exception("Device supervision error => " + device.name + ": " + str(e))
 
-            utcTime = datetime.datetime.utcnow()
-            data = [cpm, utcTime]
-            return data
+    def checkDevice(self, device, now):
+        state = self.state[device.number]
+        driver = device.driver
 
-        except Exception as e:
-            print "\r\nProblem in getData procedure (disconnected USB device?) => geiger 2:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem in getData procedure (disconnected USB device?) => geiger 2: " + str(e))
-            self.stop()
-            # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+        if state[1] is None:
+            problem = self.getProblem(driver, now)
 
-    def initCommunication(self):
-        print "Initializing NetIO => geiger 2\r\n"
-        logger.info("Initializing NetIO => geiger 2")
-        # send "go" to start receiving CPM data
-        response=self.sendCommand("go\r\n")
-        print "Please note data will be acquired once per 30 seconds => geiger 2\r\n"
+            if problem is None:
+                if state[0] > 0 and driver.lastSample > device.started:
+                    print "Device recovered => " + device.name + "\r\n"
+                    logger.info("Device recovered => " + device.name)
+                    state[0] = 0
+
+                return
+
+            delay = min(self.restartBackoff * 2 ** state[0], self.restartMax)
+            state[1] = now + delay
+            print "Device " + problem + ", restarting in %.0f seconds => " % delay + device.name + "\r\n"
+            logger.error("Device " + problem + ", restarting in %.0f seconds => " % delay + device.name)
+            driver.stop()
+        elif now >= state[1]:
+            state[0] = state[0] + 1
+            state[1] = None
+
+            if not device.restart():
+                # Counts as failed right away, next attempt after a longer backoff
+                state[1] = now + min(self.restartBackoff * 2 ** state[0], self.restartMax)
+
+    def getProblem(self, driver, now):
+        if driver.failed == 1:
+            return "failed"
+
+        if not driver.is_alive():
+            return "thread died"
+
+        if now - driver.lastSample > self.stallTimeout:
+            return "stalled"
+
+        return None
+
+    def stop(self):
+        self.stopwork = 1
 
 ################################################################################
-# Part 2b - audio geiger handeler
+# Part 2g - process mode
+#   With processmode=yes every driver runs in a process of its own, so audio
+#   counters (get_rms on every block) are not limited to one core by the GIL.
+#   The process forwards its readings over a pipe, aggregation, conversion
+#   and uploads stay in the main process.
 ################################################################################
-# If the noise was longer than this many blocks, it's not a 'tap'
-def get_rms(block):
+def deviceProcess(cfg, pipe):
     """
-      RMS amplitude is defined as the square root of the mean over time of the square of the amplitude.
-      So we need to convert this string of bytes into a string of 16-bit samples...
-      We will get one short out for each two chars in the string.
+      Entry point of a device process: runs the driver and every
+      FORWARD_INTERVAL sends what it measured as [cpm, utcTime, counts, seconds],
+      until the parent sends "stop" or the driver ends.
     """
-    count = len(block) / 2
-    format = "%dh"%(count)
-    shorts = struct.unpack(format, block)
-    # Iterate over the block.
-    sum_squares = 0.0
+    # CTRL+C reaches the whole process group, the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    driver = createGeigerCommunication(cfg)
+    driver.daemon = True
+    driver.start()
 
-    for sample in shorts:
-        # Sample is a signed short in +/- 32768. Normalize it to 1.0
-        n = sample * (1.0 / 32768.0)
-        sum_squares += n * n
+    try:
+        while(driver.is_running == 1):
+            if pipe.poll(processCommunication.FORWARD_INTERVAL) and pipe.recv() == "stop":
+                break
 
-    return math.sqrt(sum_squares / count)
+            data = driver.getResult()
+
+            if data[0] != -1:
+                pipe.send(data[:4])
+    except (EOFError, IOError):
+        # Parent is gone
+        pass
+
+    driver.stop()
+
+    try:
+        pipe.send("stopped")
+    except (EOFError, IOError):
+        pass
+
+    pipe.close()
+
+class processCommunication(threading.Thread):
+    """
+      Stands in for a driver thread in the main process: starts the device
+      process and adds the readings it forwards to an accumulator of its own,
+      getResult and stop work as for any driver.
+    """
+    # Seconds between two forwards from the device process
+    FORWARD_INTERVAL = 1.0
 
-class audioCommunication(threading.Thread):
     def __init__(self, cfg):
-        super(audioCommunication, self).__init__()
-        self.initCommunication()
-        self.timeout = cfg.timeout
+        super(processCommunication, self).__init__()
+        self.name = "processCommunication"
+        self.daemon = True
+        self.cfg = cfg
+        self.deviceName = "geiger " + str(cfg.number)
+        self.accumulator = sampleAccumulator(60)
+        self.lock = threading.Lock()
+        self.pipe, childPipe = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = deviceProcess, args = (cfg, childPipe), name = "pyradmon " + self.deviceName)
+        self.process.daemon = True
         self.stopwork = 0
-        self.queue = deque()
-        self.queueLock = 0
         self.is_running = 1
-        self.pa = pyaudio.PyAudio()
-        self.device_index = cfg.deviceIndex
-        self.device_Channels = self.pa.get_device_info_by_index(self.device_index)['maxInputChannels']
-        self.noisycount = 0
-        self.bSquelchIoerror = int(1) != 0
-        self.name = "audioCommunication"
-
-    def initCommunication(self):
-        print "Initializing audio communication => geiger 1\r\n"
-        logger.info("Initializing audio communication => geiger 1")
+        self.failed = 0
+        self.lastSample = time.time()
+        self.fusion = None
 
     def run(self):
-        try:
-            print "Gathering data started => geiger 1\r\n"
+        print "Device process started => " + self.deviceName + "\r\n"
+        logger.info("Device process started => " + self.deviceName)
+        self.process.start()
 
+        try:
             while(self.stopwork == 0):
-                result = self.getData()
+                if not self.pipe.poll(0.5):
+                    if not self.process.is_alive():
+                        break
 
-                while(self.queueLock == 1):
-                    print "Geiger communication: quene locked! => geiger 1\r\n"
-                    logger.warning("Geiger communication: quene locked! => geiger 1")
-                    time.sleep(0.5)
+                    continue
 
-                self.queueLock = 1
-                self.queue.append(result)
-                self.queueLock = 0
-                print "Geiger sample => geiger 1:\tCPM =", result[0], "\t", str(result[1]), "\r\n"
+                data = self.pipe.recv()
 
-            print "Gathering data from Geiger stopped => geiger 1\r\n"
-        except Exception as e:
-            print "Problem with audio port => geiger 1:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem with audio port => geiger 1: " + str(e))
-            self.stop() # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+                if data == "stopped":
+                    break
 
-    def getData(self):
-        if self.device_Channels > 2:
-            self.device_Channels = 2
+                with self.lock:
+                    counted = self.accumulator.add(data)
+                    self.lastSample = time.time()
 
-        self.stream = self.pa.open(format = pyaudio.paInt16,
-                                   channels = self.device_Channels,
-                                   rate = 44100,
-                                   input = True,
-                                   input_device_index = self.device_index,
-                                   start = True,
-                                   frames_per_buffer = int(44100 * 0.05))
+                if self.fusion is not None:
+                    self.fusion.add(self.deviceName, counted, data[1])
+        except (EOFError, IOError) as e:
+            print "Lost device process => " + self.deviceName + ":\r\n\t", str(e), "\r\n"
+            logger.error("Lost device process => " + self.deviceName + ": " + str(e))
 
-        for i in range(0, int(44100 / 1024 * 30)):
-            try:
-                if not self.stream: break
+        if self.stopwork == 0:
+            print "Device process ended => " + self.deviceName + "\r\n"
+            logger.error("Device process ended => " + self.deviceName)
+            self.failed = 1
 
-                block = self.stream.read(1024)
-            except (pyaudio.paInputOverflowed, IOError,):
-                """
-                  Buffer overflows are a real problem in pyaudio depending on the choice of fRate and CHUNK.
-                  Signal them to the user, but ignore them - play with fRate and CHUNK until they are at a minimum
-                """
-                if self.is_running and not self.bSquelchIoerror:
-                    print "paInputOverflow on audio port => %d"
-                    logger.error("paInputOverflow on audio port => %d")
+        self.is_running = 0
+
+    def stop(self):
+        self.stopwork = 1
+        self.is_running = 0
+
+        if self.process.is_alive():
+            try:
+                self.pipe.send("stop")
+            except (EOFError, IOError):
+                pass
+
+            self.process.join(2 * processCommunication.FORWARD_INTERVAL + 1)
+
+            if self.process.is_alive():
+                self.process.terminate()
+
+    def getResult(self):
+        with self.lock:
+            if self.accumulator.samples > 0:
+                data = self.accumulator.getResult()
+                self.accumulator.clear()
+            else:
+                # No data in queue, return invalid CPM data and current time
+                data = [-1, datetime.datetime.utcnow(), 0.0, 0.0, 0.0, 0.0]
+
+        return data
+
+################################################################################
+# Part 2h - coincidence detection
+#   Audio counters timestamp every tap from the sound card sample clock
+#   (1 / 44100 s resolution, counted from the moment the stream opened, so
+#   absolute alignment between cards is limited by their input latency).
+#   The engine merges the per-device streams in time order and counts taps
+#   of different counters that fall within 'coincidencewindow' seconds.
+################################################################################
+class pulseStream():
+    """
+      Tap timestamps of one counter, oldest first. The driver adds taps and
+      advances the watermark, the time up to which it has looked at the
+      signal. The buffer is bounded, when the engine falls behind the
+      oldest taps are dropped and counted.
+    """
+    def __init__(self, number, size):
+        self.number = number
+        self.buffer = deque(maxlen = size)
+        self.watermark = None
+        self.dropped = 0
+        self.pulses = 0
+
+    def add(self, timestamp):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+
+        self.buffer.append(timestamp)
+        self.pulses += 1
+
+    def advance(self, timestamp):
+        self.watermark = timestamp
+
+    def take(self, limit):
+        """
+          Remove and return the taps up to limit as (timestamp, number) pairs.
+        """
+        taken = []
+
+        while len(self.buffer) > 0 and self.buffer[0] <= limit:
+            taken.append((self.buffer.popleft(), self.number))
+
+        return taken
+
+class coincidenceEngine(threading.Thread):
+    """
+      Every second the taps of all streams up to the oldest watermark are
+      merged in time order (heapq.merge of the already sorted streams), so
+      nothing later can still arrive before them. A tap opens an event, taps
+      within 'window' seconds of its first tap join it, an event that saw two
+      or more counters is a coincidence. Only the open event and per report
+      counters are kept. A stream that did not advance for STALE_SECONDS
+      (failed or restarting driver) is left out of the watermark so it does
+      not hold up the others, taps it delivers for already merged time are
+      counted as late.
+    """
+    STALE_SECONDS = 5
+
+    def __init__(self, cfg):
+        super(coincidenceEngine, self).__init__()
+        self.name = "coincidenceEngine"
+        self.daemon = True
+        self.window = cfg.coincidenceWindow
+        self.bufferSize = cfg.coincidenceBuffer
+        self.streams = []
+        self.lock = threading.Lock()
+        self.stopwork = 0
+        # Time up to which the streams have been merged
+        self.merged = None
+        # Open event: [first tap time, set of device numbers]
+        self.event = None
+        self.resetStats(time.time())
+
+    def createStream(self, number):
+        stream = pulseStream(number, self.bufferSize)
+        self.streams.append(stream)
+        return stream
+
+    def resetStats(self, now):
+        self.since = now
+        self.coincidences = 0
+        self.multiplicity = {}
+        self.late = 0
+        self.pulses = dict([(stream.number, stream.pulses) for stream in self.streams])
+        self.dropped = dict([(stream.number, stream.dropped) for stream in self.streams])
+
+    def run(self):
+        while(self.stopwork == 0):
+            self.process()
+
+            for i in range(0, 2):
+                if self.stopwork == 1: break
+
+                time.sleep(0.5)
+
+    def process(self, now = None):
+        if now is None:
+            now = time.time()
+
+        active = [stream.watermark for stream in self.streams
+            if stream.watermark is not None and now - stream.watermark <= coincidenceEngine.STALE_SECONDS]
+
+        if len(active) == 0:
+            return
+
+        limit = min(active)
+
+        with self.lock:
+            for timestamp, number in heapq.merge(*[stream.take(limit) for stream in self.streams]):
+                self.addPulse(timestamp, number)
+
+            self.merged = limit
+
+            # Nothing can join the open event any more
+            if self.event is not None and limit - self.event[0] > self.window:
+                self.closeEvent()
+
+    def addPulse(self, timestamp, number):
+        if self.merged is not None and timestamp < self.merged:
+            self.late += 1
+            return
+
+        if self.event is not None and timestamp - self.event[0] <= self.window:
+            self.event[1].add(number)
+            return
+
+        self.closeEvent()
+        self.event = [timestamp, set([number])]
+
+    def closeEvent(self):
+        if self.event is not None and len(self.event[1]) > 1:
+            fold = len(self.event[1])
+            self.coincidences += 1
+            self.multiplicity[fold] = self.multiplicity.get(fold, 0) + 1
+
+        self.event = None
+
+    def getStats(self, reset = True):
+        """
+          Coincidences since the last report with the rate expected from
+          chance alone, 2 * window * r1 * r2 summed over all pairs of counters.
+        """
+        now = time.time()
+
+        with self.lock:
+            seconds = max(now - self.since, 1e-6)
+            rates = [(stream.pulses - self.pulses.get(stream.number, 0)) / seconds for stream in self.streams]
+            accidental = 0.0
+
+            for i in range(0, len(rates)):
+                for j in range(i + 1, len(rates)):
+                    accidental = accidental + 2 * self.window * rates[i] * rates[j]
+
+            stats = {"seconds": seconds, "coincidences": self.coincidences, "rate": self.coincidences * 60.0 / seconds,
+                "accidental": accidental * 60.0, "multiplicity": dict(self.multiplicity), "late": self.late,
+                "dropped": sum([stream.dropped - self.dropped.get(stream.number, 0) for stream in self.streams])}
+
+            if reset:
+                self.resetStats(now)
+
+        return stats
+
+    def formatStats(self, stats):
+        folds = ", ".join(["%d-fold %d" % (fold, stats["multiplicity"][fold]) for fold in sorted(stats["multiplicity"].keys())])
+        return "%d in %.0f s (%.2f /min, %.2f /min expected by chance)%s, %d late, %d dropped" % (stats["coincidences"],
+            stats["seconds"], stats["rate"], stats["accidental"], (", " + folds) if folds else "", stats["late"], stats["dropped"])
+
+    def stop(self):
+        self.stopwork = 1
+
+################################################################################
+# Part 2i - fused reading
+#   Co-located tubes of one type can be pooled into a virtual counter with
+#   less statistical noise than any of them. It is configured in a [fused]
+#   section and uploaded, converted and exported like a real counter.
+################################################################################
+class fusedCommunication():
+    """
+      Stands in for the driver of the fused counter. Member drivers hand
+      every accepted sample to add(), which only sums counts and seconds.
+      getResult pools the members that are healthy, delivered within
+      'fusedstale' seconds and did not fail: CPM is total counts over total
+      time, the count-weighted mean of their rates, with the Poisson
+      interval of the pooled counts as its uncertainty.
+    """
+    def __init__(self, cfg, staleSeconds):
+        self.deviceName = "geiger " + str(cfg.number)
+        self.staleSeconds = staleSeconds
+        self.lock = threading.Lock()
+        # Per member device name: [device, counts, seconds, time.time() of last sample]
+        self.members = {}
+        self.utcTime = None
+        self.is_running = 1
+        self.failed = 0
+        self.lastSample = time.time()
+
+    def addMember(self, device):
+        self.members[device.name] = [device, 0.0, 0.0, None]
+
+    def add(self, deviceName, counted, utcTime):
+        """
+          counted is [counts, seconds] as returned by sampleAccumulator.add.
+        """
+        with self.lock:
+            member = self.members[deviceName]
+            member[1] = member[1] + counted[0]
+            member[2] = member[2] + counted[1]
+            member[3] = time.time()
+            self.lastSample = member[3]
+
+            if self.utcTime is None or utcTime > self.utcTime:
+                self.utcTime = utcTime
+
+    def getHealthy(self, now = None):
+        if now is None:
+            now = time.time()
+
+        return [name for name, member in self.members.items()
+            if member[3] is not None and now - member[3] <= self.staleSeconds and member[0].driver.failed == 0]
+
+    def getResult(self):
+        with self.lock:
+            healthy = self.getHealthy()
+            counts = sum([self.members[name][1] for name in healthy])
+            seconds = sum([self.members[name][2] for name in healthy])
+            left = sorted([name for name in self.members.keys() if name not in healthy])
+            utcTime = self.utcTime
+
+            # Start a new window for every member, data of left out ones is discarded
+            for member in self.members.values():
+                member[1] = 0.0
+                member[2] = 0.0
+
+            self.utcTime = None
+
+        if len(left) > 0 and len(healthy) > 0:
+            print "Left out of " + self.deviceName + " => " + ", ".join(left) + "\r\n"
+            logger.warning("Left out of " + self.deviceName + " => " + ", ".join(left))
+
+        if seconds <= 0:
+            # No data in queue, return invalid CPM data and current time
+            return [-1, datetime.datetime.utcnow(), 0.0, 0.0, 0.0, 0.0]
+
+        cpm = counts * 60.0 / seconds
+        # 0.5 is for rounding up/down
+        return [int(cpm + 0.5), utcTime, counts, seconds] + poissonInterval(counts, seconds)
+
+    def start(self):
+        print "Fusing " + ", ".join(sorted(self.members.keys())) + " => " + self.deviceName + "\r\n"
+        logger.info("Fusing " + ", ".join(sorted(self.members.keys())) + " => " + self.deviceName)
+
+    def stop(self):
+        self.is_running = 0
+
+class fusedDevice(geigerDevice):
+    """
+      The [fused] counter, its driver is a fusedCommunication fed by the
+      member devices. It is not supervised, the members are.
+    """
+    def __init__(self, cfg, connection, members, staleSeconds):
+        self.staleSeconds = staleSeconds
+        geigerDevice.__init__(self, cfg, connection)
+
+        for device in members:
+            self.driver.addMember(device)
+            device.fusion = self.driver
+            device.driver.fusion = self.driver
+
+    def createDriver(self):
+        return fusedCommunication(self.cfg, self.staleSeconds)
+
+################################################################################
+# Part 3 - Web server communication
+################################################################################
+class hostResolver(threading.Thread):
+    """
+      Small DNS cache for the upload host, keeps the system resolver out of the
+      per-sample path. Addresses are kept for 'dnsttl' seconds and refreshed by
+      this thread before they expire, a failed lookup is remembered for
+      'dnsnegativettl' seconds. When a lookup fails the last addresses that
+      worked are used, only a host that never resolved raises an error. An
+      expired or invalidated entry is looked up by resolve() itself when the
+      thread has not refreshed it yet.
+      Every address of the host is kept (IPv6 and IPv4) and connect() tries
+      them in turn like socket.create_connection, the one that answered is
+      tried first from then on.
+    """
+    def __init__(self, cfg):
+        super(hostResolver, self).__init__()
+        self.name = "hostResolver"
+        self.ttl = cfg.dnsTtl
+        self.negativeTtl = cfg.dnsNegativeTtl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stopwork = 0
+
+    def lookup(self, host, port):
+        # Entry is [[(family, sockaddr), ...], resolved at, failed until]
+        entry = self.entries.get((host, port))
+
+        try:
+            addresses = []
+
+            for info in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+                if (info[0], info[4]) not in addresses:
+                    addresses.append((info[0], info[4]))
+
+            with self.lock:
+                # Keep the address that worked last in front
+                if entry is not None and entry[0] and entry[0][0] in addresses:
+                    addresses = [entry[0][0]] + [other for other in addresses if other != entry[0][0]]
+
+                self.entries[(host, port)] = [addresses, time.time(), 0]
+
+            return addresses
+        except socket.error as e:
+            print "DNS lookup of", host, "failed:", str(e), "\r\n"
+            logger.warning("DNS lookup of " + host + " failed: " + str(e))
+
+            with self.lock:
+                if entry is None:
+                    entry = [None, 0, 0]
+                    self.entries[(host, port)] = entry
+
+                entry[2] = time.time() + self.negativeTtl
+
+            if entry[0] is None:
+                raise
+
+            return entry[0]
+
+    def resolve(self, host, port):
+        """
+          Returns the [(family, sockaddr), ...] of host, from the cache when
+          possible.
+        """
+        entry = self.entries.get((host, port))
+        now = time.time()
+
+        if entry is not None and entry[0] is not None:
+            # Expired or invalidated, unless the last lookup failed recently
+            if now - entry[1] > self.ttl and now >= entry[2]:
+                return self.lookup(host, port)
+
+            return entry[0]
+
+        if entry is not None and now < entry[2]:
+            raise socket.gaierror("Lookup of " + host + " failed recently")
+
+        return self.lookup(host, port)
+
+    def connect(self, host, port, timeout):
+        """
+          Returns a TCP socket connected to the first address of host that
+          answers within timeout. Raises the last error when none does, only
+          then the cached addresses are looked up again.
+        """
+        addresses = self.resolve(host, port)
+        error = None
+
+        for address in addresses:
+            sock = socket.socket(address[0], socket.SOCK_STREAM)
+            # Set before connecting, otherwise a black-holed server blocks for minutes
+            sock.settimeout(timeout)
+
+            try:
+                sock.connect(address[1])
+            except socket.error as e:
+                sock.close()
+                error = e
+                logger.info("Connecting to " + str(address[1][0]) + " failed: " + str(e))
+                continue
+
+            if address != addresses[0]:
+                with self.lock:
+                    entry = self.entries.get((host, port))
+
+                    # A new list, other threads may be walking the old one
+                    if entry is not None and entry[0] is not None and address in entry[0]:
+                        entry[0] = [address] + [other for other in entry[0] if other != address]
+
+            return sock
+
+        self.invalidate(host, port)
+        raise error
+
+    def invalidate(self, host, port):
+        # Connecting failed, look the host up again on the next pass
+        entry = self.entries.get((host, port))
+
+        if entry is not None:
+            entry[1] = 0
+
+    def run(self):
+        while(self.stopwork == 0):
+            now = time.time()
+
+            for (host, port), entry in self.entries.items():
+                # Refresh at 3/4 of the TTL, but not while a failure is cached
+                if now - entry[1] > self.ttl * 0.75 and now >= entry[2]:
+                    try:
+                        self.lookup(host, port)
+                    except socket.error:
+                        # Never resolved, lookup() reported it and the failure is cached
+                        pass
+                    except Exception as e:
+                        print "DNS refresh of", host, "failed:", str(e), "\r\n"
+                        logger.exception("DNS refresh of " + host + " failed: " + str(e))
+
+            time.sleep(1)
+
+    def stop(self):
+        self.stopwork = 1
+
+class httpConnection():
+    """
+      HTTP/1.1 connection to the upload server that is kept alive between
+      samples, so steady state uploads skip the DNS lookup and TCP connect.
+      One connection is shared by every webCommunication object, a lock keeps
+      their request/response pairs from interleaving. When the server closed
+      the idle connection the request is sent again on a fresh one.
+      With an ssl context the connection is wrapped in TLS, keeping it alive
+      means the handshake is paid once instead of for every sample.
+      Connecting (with the handshake), sending and receiving each have their
+      own timeout, in seconds. abort() on shutdown ends a request in flight.
+    """
+    def __init__(self, host, port, resolver, context = None, connectTimeout = 5.0, sendTimeout = 10.0, receiveTimeout = 10.0):
+        self.host = host
+        self.port = port
+        self.resolver = resolver
+        self.context = context
+        self.connectTimeout = connectTimeout
+        self.sendTimeout = sendTimeout
+        self.receiveTimeout = receiveTimeout
+        self.sock = None
+        self.buffer = ""
+        self.lock = threading.Lock()
+        self.aborted = False
+
+    def connect(self):
+        if self.aborted:
+            raise socket.error("Connection aborted, shutting down")
+
+        sock = self.resolver.connect(self.host, self.port, self.connectTimeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        if self.context is not None:
+            try:
+                sock = self.context.wrap_socket(sock, server_hostname = self.host)
+            except (socket.error, ssl.SSLError):
+                sock.close()
+                raise
+
+        self.sock = sock
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+        self.buffer = ""
+
+    def abort(self):
+        """
+          Called from another thread, a request waiting on the server fails
+          at once instead of after its timeout and nothing new is sent.
+        """
+        self.aborted = True
+        sock = self.sock
+
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def sendAll(self, data):
+        deadline = time.time() + self.sendTimeout
+
+        while data:
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                raise socket.timeout("Timeout reached while sending request")
+
+            self.sock.settimeout(remaining)
+
+            try:
+                data = data[self.sock.send(data):]
+            except ssl.SSLError as e:
+                # TLS sockets report a write timeout as a plain SSLError
+                if "timed out" in str(e):
+                    raise socket.timeout(str(e))
+
+                raise
+
+    def request(self, request):
+        """
+          Send one request and return its httpResponse.
+        """
+        with self.lock:
+            while True:
+                reused = self.sock is not None
+                started = time.time()
+                connectTime = None
+
+                if not reused:
+                    self.connect()
+                    connectTime = time.time() - started
+
+                sent = time.time()
+                response = httpResponse(self.sock, sent + self.receiveTimeout, self.buffer)
+
+                try:
+                    self.sendAll(request)
+                    response.deadline = time.time() + self.receiveTimeout
+                    response.read()
+                    self.buffer = response.buffer
+                    response.connectTime = connectTime
+                    response.firstByteTime = response.firstByte - sent
+                    response.totalTime = time.time() - started
+                except socket.timeout:
+                    self.close()
+                    raise
+                except socket.error:
+                    self.close()
+
+                    # Closed while idle, the server never saw this request
+                    if reused and response.bytesReceived == 0:
+                        logger.info("Server closed kept-alive connection, reconnecting")
+                        continue
+
+                    raise
+
+                if not response.keepAlive:
+                    self.close()
+
+                return response
+
+    def pipeline(self, requests):
+        """
+          Send several requests back to back on the kept-alive connection and
+          read their responses in order. Returns the responses that arrived,
+          requests after a failure or a "Connection: close" were not handled
+          by the server and can be sent again.
+        """
+        responses = []
+
+        with self.lock:
+            while True:
+                reused = self.sock is not None
+                started = time.time()
+                connectTime = None
+                response = None
+
+                try:
+                    # Server unreachable is no responses, like a failure halfway
+                    if not reused:
+                        self.connect()
+                        connectTime = time.time() - started
+
+                    sent = time.time()
+                    self.sendAll("".join(requests))
+
+                    for request in requests:
+                        response = httpResponse(self.sock, time.time() + self.receiveTimeout, self.buffer)
+                        response.read()
+                        self.buffer = response.buffer
+                        # Only the first response paid for the connect
+                        response.connectTime = connectTime if len(responses) == 0 else None
+                        response.firstByteTime = response.firstByte - sent
+                        response.totalTime = time.time() - started
+                        responses.append(response)
+
+                        if not response.keepAlive:
+                            break
+                except socket.error as e:
+                    self.close()
+
+                    # Closed while idle, the server never saw these requests
+                    if reused and len(responses) == 0 and (response is None or response.bytesReceived == 0) and not isinstance(e, socket.timeout):
+                        logger.info("Server closed kept-alive connection, reconnecting")
+                        continue
+
+                    logger.warning("Pipelined upload interrupted after " + str(len(responses)) + " responses: " + str(e))
+
+                break
+
+            if len(responses) > 0 and not responses[-1].keepAlive:
+                self.close()
+
+        return responses
+
+def createSslContext(caFile = None):
+    """
+      Verifying client context. Python 2.7 has no client side session
+      resumption API, connection reuse is what keeps handshakes rare.
+    """
+    if not hasattr(ssl, "create_default_context"):
+        raise ssl.SSLError("Certificate verification needs Python 2.7.9 or newer")
+
+    context = ssl.create_default_context(cafile = caFile)
+    # No TLS compression and nothing older than TLS 1.1
+    context.options |= getattr(ssl, "OP_NO_COMPRESSION", 0)
+    context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | getattr(ssl, "OP_NO_TLSv1", 0)
+    return context
+
+def checkHttpsSupport(cfg):
+    """
+      Returns why this Python can't make the configured HTTPS connections,
+      None when it can. Verified TLS came with Python 2.7.9.
+    """
+    if hasattr(ssl, "create_default_context"):
+        return None
+
+    version = sys.version.split()[0]
+
+    if cfg.https:
+        return "HTTPS upload needs Python 2.7.9 or newer, this is " + version + ". Update Python or set https=no in config.txt"
+
+    for kind, target in cfg.sampleSinks:
+        if kind == "http" and target.lower().startswith("https:"):
+            return "HTTPS sink " + target + " needs Python 2.7.9 or newer, this is " + version + ". Update Python or use http://"
+
+    return None
+
+class httpResponse():
+    """
+      HTTP response read straight from the socket. Returns as soon as the
+      response is complete: the body is framed by chunked encoding or
+      Content-Length, only without either it is read until the server closes.
+      The whole response has to arrive before 'deadline' (a time.time() value).
+    """
+    def __init__(self, sock, deadline, buffer = ""):
+        self.sock = sock
+        self.deadline = deadline
+        # Bytes already received after the previous response on this connection
+        self.buffer = buffer
+        self.bytesReceived = 0
+        self.statusLine = ""
+        self.version = ""
+        self.status = 0
+        self.reason = ""
+        self.headers = {}
+        self.body = ""
+        self.keepAlive = False
+        # Timings filled in by httpConnection.request
+        self.firstByte = None
+        self.connectTime = None
+        self.firstByteTime = 0.0
+        self.totalTime = 0.0
+
+    def fill(self):
+        remaining = self.deadline - time.time()
+
+        if remaining <= 0:
+            raise socket.timeout("Timeout reached while reading response")
+
+        self.sock.settimeout(remaining)
+
+        try:
+            data = self.sock.recv(4096)
+        except ssl.SSLError as e:
+            # TLS sockets report a read timeout as a plain SSLError
+            if "timed out" in str(e):
+                raise socket.timeout(str(e))
+
+            raise
+
+        if not data:
+            raise socket.error("Connection closed by server")
+
+        if self.firstByte is None:
+            self.firstByte = time.time()
+
+        self.bytesReceived += len(data)
+        self.buffer = self.buffer + data
+
+    def readLine(self):
+        while "\r\n" not in self.buffer:
+            self.fill()
+
+        line, self.buffer = self.buffer.split("\r\n", 1)
+        return line
+
+    def readBytes(self, length):
+        while len(self.buffer) < length:
+            self.fill()
+
+        data = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        return data
+
+    def read(self):
+        self.statusLine = self.readLine()
+
+        if self.firstByte is None:
+            # Already buffered behind the previous pipelined response
+            self.firstByte = time.time()
+        params = self.statusLine.split(" ", 2)
+
+        if len(params) < 2 or not params[0].startswith("HTTP/"):
+            raise socket.error("Invalid HTTP status line: " + self.statusLine)
+
+        self.version = params[0]
+        self.status = int(params[1])
+        self.reason = params[2] if len(params) > 2 else ""
+
+        # Headers end with an empty line
+        line = self.readLine()
+
+        while line:
+            params = line.split(":", 1)
+
+            if len(params) == 2:
+                self.headers[params[0].strip().lower()] = params[1].strip()
+
+            line = self.readLine()
+
+        connection = self.headers.get("connection", "").lower()
+
+        if self.version == "HTTP/1.1":
+            self.keepAlive = connection != "close"
+        else:
+            self.keepAlive = connection == "keep-alive"
+
+        if self.status < 200 or self.status in (204, 304):
+            return
+
+        if "chunked" in self.headers.get("transfer-encoding", "").lower():
+            self.readChunked()
+        elif "content-length" in self.headers:
+            self.body = self.readBytes(int(self.headers["content-length"]))
+        else:
+            self.readUntilClose()
+
+    def readChunked(self):
+        body = []
+        size = int(self.readLine().split(";", 1)[0], 16)
+
+        while size > 0:
+            body.append(self.readBytes(size))
+            # Every chunk is followed by CRLF
+            self.readLine()
+            size = int(self.readLine().split(";", 1)[0], 16)
+
+        # Skip trailers up to the final empty line
+        while self.readLine():
+            pass
+
+        self.body = "".join(body)
+
+    def readUntilClose(self):
+        self.keepAlive = False
+
+        try:
+            while True:
+                self.fill()
+        except socket.timeout:
+            raise
+        except socket.error:
+            # Server closed the connection, the body is complete
+            pass
+
+        self.body = self.buffer
+        self.buffer = ""
+
+class latencyHistogram():
+    """
+      Fixed bucket histogram of durations in seconds, percentiles are reported
+      as the upper bound of the bucket they fall in.
+    """
+    BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self):
+        # One extra bucket for everything above the last bound
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        i = 0
+
+        while i < len(self.BOUNDS) and seconds > self.BOUNDS[i]:
+            i += 1
+
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+
+        rank = p / 100.0 * self.count
+        seen = 0
+
+        for i in range(0, len(self.buckets)):
+            seen += self.buckets[i]
+
+            if seen >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+
+        return self.max
+
+    def getStats(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count > 0 else 0.0, "max": self.max,
+            "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+            "buckets": dict(zip([str(bound) for bound in self.BOUNDS] + ["inf"], self.buckets))}
+
+class uploadStats():
+    """
+      Outcome counters and connect, time to first byte and total duration
+      histograms of one upload destination.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.success = 0
+        self.httpError = 0
+        self.timeout = 0
+        self.authFailure = 0
+        self.connectionError = 0
+        self.connect = latencyHistogram()
+        self.firstByte = latencyHistogram()
+        self.total = latencyHistogram()
+
+    def recordResponse(self, response, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+            # Only a new connection has a connect time
+            if response.connectTime is not None:
+                self.connect.add(response.connectTime)
+
+            self.firstByte.add(response.firstByteTime)
+            self.total.add(response.totalTime)
+
+    def recordFailure(self, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def getStats(self):
+        with self.lock:
+            return {"success": self.success, "httpError": self.httpError, "timeout": self.timeout,
+                "authFailure": self.authFailure, "connectionError": self.connectionError,
+                "connect": self.connect.getStats(), "firstByte": self.firstByte.getStats(), "total": self.total.getStats()}
+
+    def formatStats(self):
+        stats = self.getStats()
+        return "%d ok, %d http errors, %d timeouts, %d auth failures, %d connection errors, total p50 %.3f s p95 %.3f s, first byte p95 %.3f s" % (
+            stats["success"], stats["httpError"], stats["timeout"], stats["authFailure"], stats["connectionError"],
+            stats["total"]["p50"], stats["total"]["p95"], stats["firstByte"]["p95"])
+
+class webCommunication():
+    def __init__(self, mycfg, connection):
+        self.user = mycfg.user
+        self.password = mycfg.password
+        self.connection = connection
+        self.stats = uploadStats()
+        self.name = "geiger " + str(mycfg.number)
+        # Set when the server turned the account down, main() then shuts down
+        self.rejected = False
+
+    def buildRequest(self, sample):
+        sampleCPM = sample[0]
+        sampleTime = sample[1]
+        # Format date and time as required
+        dtime = sampleTime.strftime("%Y-%m-%d%%20%H:%M:%S")
+        url = "GET /radmon.php?user=" + self.user + "&password=" + self.password + "&function=submit&datetime=" + dtime + "&value=" + str(sampleCPM) + "&unit=CPM HTTP/1.1"
+        return url + "\r\nHost: " + self.connection.host + "\r\nUser-Agent: pyRadMon " + VERSION + "\r\nConnection: keep-alive\r\n\r\n"
+
+    def checkResponse(self, response):
+        print "Server response => " + self.name + ": ", response.statusLine, "\r\n"
+        logger.info("Server response => " + self.name + ": " + response.statusLine)
+
+        if "incorrect" in response.body.lower():
+            self.stats.recordResponse(response, "authFailure")
+            print "You are using incorrect user/password combination => " + self.name + "!\r\n"
+            logger.error("You are using incorrect user/password combination => " + self.name + "!")
+            self.rejected = True
+            return False
+
+        if response.status != 200:
+            self.stats.recordResponse(response, "httpError")
+            return False
+
+        self.stats.recordResponse(response, "success")
+        return True
+
+    def sendSample(self, sample):
+        if not self.user or not self.password: return True
+
+        print "Connecting to server => " + self.name + "\r\n"
+        logger.info("Connecting to server => " + self.name)
+        request = self.buildRequest(sample)
+        print "Sending average sample => " + self.name + ": " + str(sample[0]) + " CPM\r\n"
+
+        try:
+            # Send over the kept-alive connection, returns as soon as the response is complete
+            response = self.connection.request(request)
+        except socket.timeout as ex:
+            self.stats.recordFailure("timeout")
+            print "Could not communicate with the Server, timeout reached. => " + self.name + ": ", ex, "\r\n"
+            logger.exception("Could not communicate with the Server, timeout reached. => " + self.name + ": " + str(ex))
+            return False
+        except Exception as ex:
+            self.stats.recordFailure("connectionError")
+            print "Could not communicate with the Server => " + self.name + ": ",ex,"\r\n"
+            logger.exception("Could not communicate with the Server => " + self.name + ": " + str(ex))
+            return False
+
+        # Outside the try, checkResponse records the outcome of an answered request itself
+        return self.checkResponse(response)
+
+class circuitBreaker():
+    """
+      Stops upload attempts after 'breakerfailures' consecutive failures. While
+      open every sample goes straight to the spool, after 'breakercooldown'
+      seconds a single trial upload is let through: success closes the
+      breaker, failure opens it for another cool-down. A trial without an
+      outcome gets a new one after another cool-down.
+    """
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, cfg):
+        self.threshold = cfg.breakerFailures
+        self.cooldown = cfg.breakerCooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = 0
+        self.lock = threading.Lock()
+
+    def allowRequest(self):
+        """
+          Call right before sending, a True while not closed is the trial
+          upload and its outcome has to be recorded.
+        """
+        with self.lock:
+            # A trial that never reported back counts as lost after a cool-down
+            if self.state != self.CLOSED and time.time() - self.openedAt >= self.cooldown:
+                print "Upload circuit half-open, trying the server again\r\n"
+                logger.info("Upload circuit half-open, trying the server again")
+                self.state = self.HALF_OPEN
+                self.openedAt = time.time()
+                return True
+
+            return self.state == self.CLOSED
+
+    def recordSuccess(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                print "Upload circuit closed, server is back\r\n"
+                logger.info("Upload circuit closed, server is back")
+
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def recordFailure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                print "Upload circuit open after", self.failures, "failures, spooling for", self.cooldown, "seconds\r\n"
+                logger.warning("Upload circuit open after " + str(self.failures) + " failures, spooling for " + str(self.cooldown) + " seconds")
+                self.state = self.OPEN
+                self.openedAt = time.time()
+
+class uploadWorker(threading.Thread):
+    """
+      Uploads samples handed over by the main loop from a bounded queue, so
+      the aggregation cadence never depends on how fast the server answers.
+      Samples queued together (one cycle of every counter, or a backlog after
+      a slow response) go out as pipelined requests on one connection.
+      A failed upload is retried 'uploadretries' times with exponential
+      backoff and jitter. When the queue is full the oldest batch goes to the
+      spool, as does every sample that could not be uploaded or arrives while
+      the circuit breaker is open. Samples of an account the server turned
+      down are dropped, retrying or replaying them can never succeed.
+    """
+    # Most samples sent in one pipelined round-trip
+    MAX_BATCH = 10
+
+    def __init__(self, cfg, spool, breaker):
+        super(uploadWorker, self).__init__()
+        self.name = "uploadWorker"
+        self.queue = Queue.Queue(cfg.uploadQueue)
+        self.spool = spool
+        self.breaker = breaker
+        self.retries = cfg.uploadRetries
+        self.backoff = cfg.retryBackoff
+        self.stopwork = 0
+        self.dropped = 0
+        self.maxDepth = 0
+
+    def submit(self, service, sample):
+        self.submitBatch([(service, sample)])
+
+    def submitBatch(self, items):
+        """
+          Queue the (service, sample) pairs that are due in the same cycle.
+        """
+        while True:
+            try:
+                self.queue.put_nowait(items)
+                break
+            except Queue.Full:
+                try:
+                    for oldService, oldSample in self.accepted(self.queue.get_nowait()):
+                        self.spool.append(oldService.name, oldSample)
+                        self.dropped += 1
+
+                    print "Upload queue full, oldest samples spooled\r\n"
+                    logger.warning("Upload queue full, oldest samples spooled")
+                except Queue.Empty:
+                    pass
+
+        self.maxDepth = max(self.maxDepth, self.queue.qsize())
+
+    def getQueueDepth(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while(self.stopwork == 0):
+            try:
+                items = list(self.queue.get(True, 0.5))
+            except Queue.Empty:
+                continue
+
+            # Coalesce whatever else is waiting into the same round-trip
+            while len(items) < self.MAX_BATCH:
+                try:
+                    items.extend(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            for service, sample in self.upload(items):
+                self.spool.append(service.name, sample)
+
+        # Keep whatever is still queued for the next run
+        while not self.queue.empty():
+            for service, sample in self.accepted(self.queue.get_nowait()):
+                self.spool.append(service.name, sample)
+
+        self.spool.sync()
+
+    def accepted(self, items):
+        """
+          Leaves out the samples of accounts the server rejected.
+        """
+        return [item for item in items if not item[0].rejected]
+
+    def upload(self, items):
+        """
+          Returns the (service, sample) pairs that could not be uploaded.
+        """
+        # Same as sendSample, without an account there is nothing to upload
+        pending = [item for item in self.accepted(items) if item[0].user and item[0].password]
+
+        for attempt in range(0, self.retries + 1):
+            if self.stopwork == 1 or len(pending) == 0:
+                return pending
+
+            if attempt > 0:
+                # Exponential backoff, stretched by up to 100% jitter
+                delay = self.backoff * (2 ** (attempt - 1)) * (1.0 + random.random())
+                names = ", ".join([service.name for service, sample in pending])
+                print "Retrying upload in %.1f seconds => %s\r\n" % (delay, names)
+                logger.info("Retrying upload in %.1f seconds => %s" % (delay, names))
+                stopTime = time.time() + delay
+
+                while time.time() < stopTime and self.stopwork == 0:
+                    time.sleep(max(0, min(0.5, stopTime - time.time())))
+
+            # Right before sending, an open breaker's trial is not wasted
+            if self.stopwork == 1 or not self.breaker.allowRequest():
+                return pending
+
+            count = len(pending)
+            failed = self.send(pending)
+            pending = self.accepted(failed)
+
+            # A rejected login is an answer from the server, not an outage
+            if len(failed) < count:
+                self.breaker.recordSuccess()
+
+            if len(pending) == 0:
+                return pending
+
+            self.breaker.recordFailure()
+
+        return pending
+
+    def send(self, items):
+        if len(items) == 1:
+            service, sample = items[0]
+
+            try:
+                sent = service.sendSample(sample)
+            except Exception as e:
+                print "Error communicating server:\r\n\t", str(e), "\r\n"
+                logger.exception("Error communicating server: " + str(e))
+                sent = False
+
+            return [] if sent else items
+
+        # One pipelined round-trip per connection, in practice there is only one
+        groups = []
+
+        for service, sample in items:
+            for connection, group in groups:
+                if connection is service.connection:
+                    group.append((service, sample))
+                    break
+            else:
+                groups.append((service.connection, [(service, sample)]))
+
+        failed = []
+
+        for connection, group in groups:
+            print "Sending", len(group), "pipelined samples =>", ", ".join([service.name for service, sample in group]), "\r\n"
+            logger.info("Sending " + str(len(group)) + " pipelined samples")
+
+            try:
+                responses = connection.pipeline([service.buildRequest(sample) for service, sample in group])
+            except Exception as e:
+                print "Error communicating server:\r\n\t", str(e), "\r\n"
+                logger.exception("Error communicating server: " + str(e))
+                responses = []
+
+            for i in range(0, len(group)):
+                service, sample = group[i]
+
+                if i >= len(responses):
+                    service.stats.recordFailure("connectionError")
+                    failed.append(group[i])
+                elif not self.isAccepted(service, responses[i]):
+                    failed.append(group[i])
+
+        return failed
+
+    def isAccepted(self, service, response):
+        try:
+            return service.checkResponse(response)
+        except Exception as e:
+            logger.exception("Bad response => " + service.name + ": " + str(e))
+            return False
+
+    def stop(self):
+        self.stopwork = 1
+
+################################################################################
+# Part 3b - upload spool
+#
+# Samples that could not be uploaded are appended to a spool file and sent
+# again by the replay thread once the server can be reached. A record is
+#   [4 byte length][payload][4 byte crc32]
+# with payload "name<TAB>datetime<TAB>cpm", so a record torn by a crash or
+# power cut is detected and cut off when the spool is opened again. The
+# offset of the first unsent record is kept in a separate checkpoint file.
+################################################################################
+class sampleSpool():
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.posFileName = fileName + ".pos"
+        self.lock = threading.Lock()
+        # fsync after this many records or seconds, whichever comes first
+        self.syncRecords = 10
+        self.syncSeconds = 5.0
+        self.unsynced = 0
+        self.lastSync = time.time()
+        self.position = self.readPosition()
+        self.f = open(self.fileName, "a+b")
+        self.recover()
+
+    def readPosition(self):
+        try:
+            f = open(self.posFileName)
+            position = int(f.read().strip() or 0)
+            f.close()
+            return position
+        except (IOError, ValueError):
+            return 0
+
+    def writePosition(self, position):
+        # Write and rename, so the checkpoint is either the old or the new one
+        f = open(self.posFileName + ".tmp", "w")
+        f.write(str(position))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+        if os.name == "nt" and os.path.exists(self.posFileName):
+            os.remove(self.posFileName)
+
+        os.rename(self.posFileName + ".tmp", self.posFileName)
+        self.position = position
+
+    def recover(self):
+        # Cut off a torn record at the end of the file
+        records, end = self.readRecords(0, None)
+        self.f.seek(0, os.SEEK_END)
+
+        if self.f.tell() != end:
+            print "Spool: dropping damaged record at end of", self.fileName, "\r\n"
+            logger.warning("Spool: dropping damaged record at end of " + self.fileName)
+            self.f.truncate(end)
+
+        if self.position > end:
+            self.writePosition(end)
+
+        if self.getPending() > 0:
+            print "Spool: found", len(records), "records,", self.getPending(), "bytes not uploaded yet\r\n"
+            logger.info("Spool: found " + str(len(records)) + " records, " + str(self.getPending()) + " bytes not uploaded yet")
+
+    def readRecords(self, position, maxRecords):
+        """
+          Returns ([(endOffset, name, utcTime, cpm), ...], offset after last valid record)
+        """
+        records = []
+        self.f.seek(position)
+
+        while maxRecords is None or len(records) < maxRecords:
+            header = self.f.read(4)
+
+            if len(header) < 4:
+                break
+
+            length = struct.unpack(">I", header)[0]
+            payload = self.f.read(length)
+            footer = self.f.read(4)
+
+            if len(payload) < length or len(footer) < 4:
+                break
+
+            if struct.unpack(">I", footer)[0] != zlib.crc32(payload) & 0xffffffff:
+                break
+
+            position = position + 8 + length
+            name, utcTime, cpm = payload.split("\t")
+            records.append((position, name, datetime.datetime.strptime(utcTime, "%Y-%m-%d %H:%M:%S"), int(cpm)))
+
+        return records, position
+
+    def append(self, name, sample):
+        payload = "%s\t%s\t%d" % (name, sample[1].strftime("%Y-%m-%d %H:%M:%S"), sample[0])
+
+        with self.lock:
+            self.f.seek(0, os.SEEK_END)
+            self.f.write(struct.pack(">I", len(payload)) + payload + struct.pack(">I", zlib.crc32(payload) & 0xffffffff))
+            self.f.flush()
+            self.unsynced += 1
+
+            if self.unsynced >= self.syncRecords or time.time() - self.lastSync >= self.syncSeconds:
+                self.syncLocked()
+
+    def sync(self):
+        with self.lock:
+            self.syncLocked()
+
+    def syncLocked(self):
+        if self.unsynced > 0:
+            os.fsync(self.f.fileno())
+
+        self.unsynced = 0
+        self.lastSync = time.time()
+
+    def getPending(self):
+        with self.lock:
+            self.f.seek(0, os.SEEK_END)
+            return self.f.tell() - self.position
+
+    def read(self, maxRecords):
+        with self.lock:
+            return self.readRecords(self.position, maxRecords)[0]
+
+    def commit(self, position):
+        """
+          Mark everything up to position as uploaded, an empty spool is truncated.
+        """
+        with self.lock:
+            self.f.seek(0, os.SEEK_END)
+
+            if position >= self.f.tell():
+                self.syncLocked()
+                self.f.truncate(0)
+                position = 0
+
+            self.writePosition(position)
+
+    def close(self):
+        with self.lock:
+            self.syncLocked()
+            self.f.close()
+
+class rateLimiter():
+    """
+      Token bucket, allows 'rate' requests per second on average with bursts
+      of up to 'burst' requests.
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def acquire(self, count):
+        """
+          Takes count tokens and returns 0, or returns how many seconds to wait
+          before they are available.
+        """
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0.0
+
+        return (count - self.tokens) / self.rate
+
+class spoolReplayWorker(threading.Thread):
+    """
+      Backfills the spool in the background, oldest sample first. Records are
+      appended in the order the samples were taken, so file order is timestamp
+      order. They are pipelined 'backfillpipeline' at a time over the shared
+      kept-alive connection, at most 'backfillrate' requests per second so the
+      server does not throttle us, and the checkpoint is moved after every
+      window so an interrupted backfill resumes where it stopped. Stops at the
+      first failure and tries again after 'interval' seconds, and leaves the
+      server alone while the upload circuit breaker is open.
+    """
+    def __init__(self, cfg, spool, connection, breaker, services):
+        super(spoolReplayWorker, self).__init__()
+        self.name = "spoolReplayWorker"
+        self.spool = spool
+        self.connection = connection
+        self.breaker = breaker
+        self.services = dict([(service.name, service) for service in services])
+        self.pipelineDepth = cfg.backfillPipeline
+        self.limiter = rateLimiter(cfg.backfillRate, cfg.backfillPipeline)
+        self.interval = 30
+        self.stopwork = 0
+
+    def run(self):
+        while(self.stopwork == 0):
+            self.replay()
+
+            for i in range(0, self.interval * 2):
+                if self.stopwork == 1: break
+
+                time.sleep(0.5)
+
+    def waitForTokens(self, count):
+        wait = self.limiter.acquire(count)
+
+        while wait > 0:
+            if self.stopwork == 1: return False
+
+            time.sleep(min(wait, 0.5))
+            wait = self.limiter.acquire(count)
+
+        return True
+
+    def isAccepted(self, service, response):
+        try:
+            return service.checkResponse(response)
+        except Exception as e:
+            logger.exception("Backfill: bad response => " + service.name + ": " + str(e))
+            return False
+
+    def replay(self):
+        sent = 0
+        startTime = time.time()
+
+        while(self.stopwork == 0 and self.spool.getPending() > 0):
+            records = self.spool.read(self.pipelineDepth)
+
+            if len(records) == 0:
+                break
+
+            window = []
+            requests = []
+            rejected = False
+
+            for record in records:
+                service = self.services.get(record[1])
+
+                if service is not None and (not service.user or not service.password):
+                    service = None
+
+                if service is not None and service.rejected:
+                    # Keep it spooled, main() is shutting down for a bad login
+                    rejected = True
+                    break
+
+                if service is not None:
+                    requests.append(service.buildRequest([record[3], record[2]]))
+                else:
+                    # Counter is no longer configured, nothing to upload it to
+                    logger.warning("Backfill: skipping sample of unknown counter " + record[1])
+
+                window.append((record, service))
+
+            responses = []
+
+            if len(requests) > 0:
+                # Only ask for the breaker's trial when a request really goes out
+                if not self.waitForTokens(len(requests)) or not self.breaker.allowRequest():
+                    break
+
+                responses = self.connection.pipeline(requests)
+
+            position = None
+            accepted = 0
+            failed = False
+
+            for record, service in window:
+                if service is not None:
+                    if accepted >= len(responses) or not self.isAccepted(service, responses[accepted]):
+                        rejected = service.rejected
+                        failed = not rejected
+                        break
+
+                    accepted += 1
+
+                position = record[0]
+
+            if position is not None:
+                self.spool.commit(position)
+
+            sent += accepted
+
+            if accepted > 0:
+                self.breaker.recordSuccess()
+
+            if failed:
+                self.breaker.recordFailure()
+                print "Backfill: server did not accept sample, retrying in", self.interval, "seconds\r\n"
+                logger.warning("Backfill: server did not accept sample, retrying in " + str(self.interval) + " seconds")
+                break
+
+            if rejected:
+                break
+
+        if sent > 0:
+            elapsed = max(time.time() - startTime, 0.001)
+            print "Backfill: %d samples in %.1f s (%.2f samples/s), %d bytes left in spool" % (sent, elapsed, sent / elapsed, self.spool.getPending()), "\r\n"
+            logger.info("Backfill: %d samples in %.1f s (%.2f samples/s), %d bytes left in spool" % (sent, elapsed, sent / elapsed, self.spool.getPending()))
+
+    def stop(self):
+        self.stopwork = 1
+
+################################################################################
+# Part 3c - sample sinks
+#   Every destination besides radmon.org gets its own thread and bounded queue,
+#   so a slow or dead destination only ever delays (and drops) its own samples.
+################################################################################
+def sampleRecord(device, sample):
+    record = {"device": device, "time": sample[1].strftime("%Y-%m-%d %H:%M:%S"), "cpm": sample[0],
+        "counts": sample[2], "seconds": sample[3], "cpmLow": sample[4], "cpmHigh": sample[5]}
+
+    if len(sample) > 8:
+        record["usvh"] = sample[6]
+        record["usvhLow"] = sample[7]
+        record["usvhHigh"] = sample[8]
+
+    return record
+
+class baseSampleSink(threading.Thread):
+    def __init__(self, name, queueSize):
+        super(baseSampleSink, self).__init__()
+        self.name = name
+        self.queue = Queue.Queue(queueSize)
+        self.stopwork = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        # Seconds from submit until the destination took the sample
+        self.latencyTotal = 0.0
+        self.latencyMax = 0.0
+
+    def submit(self, device, sample):
+        item = (device, sample, time.time())
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                break
+            except Queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except Queue.Empty:
+                    continue
+
+    def getStats(self):
+        return {"sent": self.sent, "failed": self.failed, "dropped": self.dropped, "queued": self.queue.qsize(),
+            "latency": self.latencyTotal / self.sent if self.sent > 0 else 0.0, "latencyMax": self.latencyMax}
+
+    def run(self):
+        while(self.stopwork == 0):
+            try:
+                device, sample, submitted = self.queue.get(True, 1)
+            except Queue.Empty:
+                continue
+
+            try:
+                self.send(device, sample)
+            except Exception as e:
+                self.failed += 1
+                print "Sample sink", self.name, "failed:", str(e), "\r\n"
+                logger.warning("Sample sink " + self.name + " failed: " + str(e))
+                self.close()
+                continue
+
+            latency = time.time() - submitted
+            self.sent += 1
+            self.latencyTotal += latency
+            self.latencyMax = max(self.latencyMax, latency)
+
+        self.close()
+
+    def send(self, device, sample):
+        pass
+
+    def close(self):
+        pass
+
+    def stop(self):
+        self.stopwork = 1
+
+class httpSampleSink(baseSampleSink):
+    """
+      POSTs every sample as JSON to a local collector over a kept-alive
+      connection.
+    """
+    def __init__(self, url, queueSize, resolver):
+        super(httpSampleSink, self).__init__("httpSink " + url, queueSize)
+        parsed = urlparse.urlparse(url)
+        self.hostName = parsed.hostname
+        self.path = parsed.path or "/"
+
+        if parsed.scheme == "https":
+            self.connection = httpConnection(parsed.hostname, parsed.port or 443, resolver, createSslContext())
+        else:
+            self.connection = httpConnection(parsed.hostname, parsed.port or 80, resolver)
+
+    def send(self, device, sample):
+        body = json.dumps(sampleRecord(device, sample))
+        request = "POST " + self.path + " HTTP/1.1\r\nHost: " + self.hostName + "\r\nUser-Agent: pyRadMon " + VERSION
+        request += "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\nConnection: keep-alive\r\n\r\n" + body
+        response = self.connection.request(request)
+
+        if response.status < 200 or response.status > 299:
+            raise Exception("HTTP status " + str(response.status))
+
+    def close(self):
+        self.connection.close()
 
-                continue
-            except Exception as ex:
-                print "Problem with audio port => 1\r\n\t", str(ex), "\r\n\tExiting\r\n\t"
-                logger.exception("Problem with serial port => geiger 1: " + str(ex))
+class mqttSampleSink(baseSampleSink):
+    """
+      Publishes every sample as JSON to an MQTT broker, QoS 0 over a plain
+      MQTT 3.1.1 connection. The url is mqtt://host[:port]/topic.
+    """
+    def __init__(self, url, queueSize, resolver):
+        super(mqttSampleSink, self).__init__("mqttSink " + url, queueSize)
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 1883
+        self.topic = parsed.path.lstrip("/") or "pyradmon"
+        self.resolver = resolver
+        self.clientId = "pyradmon-" + str(os.getpid())
+        self.sock = None
 
-                if self.stream:
-                    self.stream.stop_stream()
-                    self.stream.close()
-                    self.stream = None
+    @staticmethod
+    def packet(packetType, payload):
+        # Fixed header with the variable length "remaining length" field
+        header = chr(packetType)
+        length = len(payload)
 
-                self.stop()
-                # Set EOL for log
-                logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-                logging.shutdown()
-                sys.exit(1)
+        while True:
+            digit = length % 128
+            length //= 128
 
-            amplitude = get_rms(block)
+            if length > 0:
+                digit |= 0x80
 
-            if amplitude > 0.010:
-                # Noisy block
-                self.noisycount += 1
+            header += chr(digit)
 
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
+            if length == 0:
+                return header + payload
 
-        if self.noisycount >= 0:
-            cpm = self.noisycount * (60 / 30)
-            self.noisycount = 0
+    @staticmethod
+    def string(value):
+        return struct.pack(">H", len(value)) + value
 
-        utcTime = datetime.datetime.utcnow()
-        data = [cpm, utcTime]
-        return data
+    def connect(self):
+        sock = self.resolver.connect(self.host, self.port, 10.0)
 
-    def stop(self):
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
+        try:
+            # Protocol level 4, clean session, keep alive disabled
+            sock.sendall(self.packet(0x10, self.string("MQTT") + "\x04\x02\x00\x00" + self.string(self.clientId)))
+            connack = ""
 
-        self.stopwork = 1
-        self.queueLock = 0
-        self.is_running = 0
+            while len(connack) < 4:
+                data = sock.recv(4 - len(connack))
 
-    def getResult(self):
-        # Check if we have some data in queue
-        if len(self.queue) > 0:
-            # Check if it's safe to process queue
-            while(self.queueLock == 1):
-                print "getResult: quene locked! => geiger 1\r\n"
-                logger.warning("getResult: queue locked! => geiger 1")
-                time.sleep(0.5)
+                if not data:
+                    raise socket.error("Broker closed the connection")
 
-            """
-              Put a lock so measuring process will not interfere with queue,
-              processing should be fast enought to not break data acquisition from geiger
-            """
-            self.queueLock = 1
-            cpm = 0
-
-            # Now get sum of all CPM's
-            for singleData in self.queue:
-                cpm = cpm + singleData[0]
-
-            # And divide by number of elements to get mean value, 0.5 is for rounding up/down
-            cpm = int((float(cpm) / len(self.queue)) + 0.5)
-            # Report with latest time from quene
-            utcTime = self.queue.pop()[1]
-            # Clear queue and remove lock
-            self.queue.clear()
-            self.queueLock = 0
-            data = [cpm, utcTime]
-        else:
-            # No data in queue, return invalid CPM data and current time
-            data = [-1, datetime.datetime.utcnow()]
+                connack += data
+        except socket.error:
+            sock.close()
+            raise
 
-        return data
-    
-def get_rms2(block):
+        if connack[0] != "\x20" or connack[3] != "\x00":
+            sock.close()
+            raise Exception("Broker refused the connection, return code " + str(ord(connack[3])))
+
+        self.sock = sock
+
+    def send(self, device, sample):
+        if self.sock is None:
+            self.connect()
+
+        self.sock.sendall(self.packet(0x30, self.string(self.topic) + json.dumps(sampleRecord(device, sample))))
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.sendall("\xe0\x00")
+            except socket.error:
+                pass
+
+            self.sock.close()
+            self.sock = None
+
+class csvSampleSink(baseSampleSink):
     """
-      RMS amplitude is defined as the square root of the mean over time of the square of the amplitude.
-      So we need to convert this string of bytes into a string of 16-bit samples...
-      We will get one short out for each two chars in the string.
+      Appends "datetime,cpm,usvh,device" lines, the file can be reprocessed
+      later with --convert.
     """
-    count = len(block) / 2
-    format = "%dh"%(count)
-    shorts = struct.unpack(format, block)
-    # Iterate over the block.
-    sum_squares = 0.0
+    def __init__(self, fileName, queueSize):
+        super(csvSampleSink, self).__init__("csvSink " + fileName, queueSize)
+        self.fileName = fileName
 
-    for sample in shorts:
-        # Sample is a signed short in +/- 32768. Normalize it to 1.0
-        n = sample * (1.0 / 32768.0)
-        sum_squares += n * n
+    def send(self, device, sample):
+        f = open(self.fileName, "a")
 
-    return math.sqrt(sum_squares / count)
+        try:
+            usvh = "%.5f" % sample[6] if len(sample) > 8 else ""
+            f.write("%s,%s,%s,%s\n" % (sample[1].strftime("%Y-%m-%d %H:%M:%S"), repr(sample[0]), usvh, device))
+        finally:
+            f.close()
 
-class audioCommunication2(threading.Thread):
+class udpSampleSink(baseSampleSink):
+    """
+      Sends every sample as one JSON datagram to host:port.
+    """
+    def __init__(self, target, queueSize, resolver):
+        super(udpSampleSink, self).__init__("udpSink " + target, queueSize)
+        host, port = target.rsplit(":", 1)
+        self.host = host
+        self.port = int(port)
+        self.resolver = resolver
+        self.sock = None
 
-    def __init__(self, cfg):
-        super(audioCommunication2, self).__init__()
-        self.initCommunication()
-        self.timeout = cfg.timeout
-        self.stopwork = 0
-        self.queue = deque()
-        self.queueLock = 0
-        self.is_running = 1
-        self.pa = pyaudio.PyAudio()
-        self.device_index = cfg.deviceIndex
-        self.device_Channels = self.pa.get_device_info_by_index(self.device_index)['maxInputChannels']
-        self.noisycount = 0
-        self.bSquelchIoerror = int(1) != 0
-        self.name = "audioCommunication2"
+    def send(self, device, sample):
+        family, address = self.resolver.resolve(self.host, self.port)[0]
 
-    def initCommunication(self):
-        print "Initializing audio communication => geiger 2\r\n"
-        logger.info("Initializing audio communication => geiger 2")
+        if self.sock is None or self.sock.family != family:
+            self.close()
+            self.sock = socket.socket(family, socket.SOCK_DGRAM)
 
-    def run(self):
-        try:
-            print "Gathering data started => geiger 2\r\n"
+        self.sock.sendto(json.dumps(sampleRecord(device, sample)), address)
 
-            while(self.stopwork == 0):
-                result = self.getData()
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
 
-                while(self.queueLock == 1):
-                    print "Geiger communication: quene locked! => geiger 2\r\n"
-                    logger.warning("Geiger communication: quene locked! => geiger 2")
-                    time.sleep(0.5)
+class sampleDispatcher():
+    """
+      Fans every valid sample out to the sinks configured with httpsink,
+      mqttsink, csvsink and udpsink. publish never blocks, a full sink queue
+      drops its oldest sample.
+    """
+    def __init__(self, cfg, resolver):
+        self.sinks = []
+
+        for kind, target in cfg.sampleSinks:
+            if kind == "http":
+                self.sinks.append(httpSampleSink(target, cfg.sinkQueue, resolver))
+            elif kind == "mqtt":
+                self.sinks.append(mqttSampleSink(target, cfg.sinkQueue, resolver))
+            elif kind == "csv":
+                self.sinks.append(csvSampleSink(target, cfg.sinkQueue))
+            elif kind == "udp":
+                self.sinks.append(udpSampleSink(target, cfg.sinkQueue, resolver))
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def publish(self, device, sample):
+        for sink in self.sinks:
+            sink.submit(device, sample)
+
+    def getStats(self):
+        return dict((sink.name, sink.getStats()) for sink in self.sinks)
+
+    def logStats(self):
+        for name, stats in sorted(self.getStats().items()):
+            print "Sample sink %s: %d sent, %d failed, %d dropped, latency %.3f s (max %.3f s)" % (name,
+                stats["sent"], stats["failed"], stats["dropped"], stats["latency"], stats["latencyMax"]), "\r\n"
+            logger.info("Sample sink %s: %d sent, %d failed, %d dropped, latency %.3f s (max %.3f s)" % (name,
+                stats["sent"], stats["failed"], stats["dropped"], stats["latency"], stats["latencyMax"]))
 
-                self.queueLock = 1
-                self.queue.append(result)
-                self.queueLock = 0
-                print "Geiger sample => geiger 2:\tCPM =", result[0], "\t", str(result[1]), "\r\n"
+    def stop(self):
+        for sink in self.sinks:
+            sink.stop()
 
-            print "Gathering data from Geiger stopped => geiger 2\r\n"
-        except Exception as e:
-            print "Problem with audio port => geiger 2:\r\n\t", str(e), "\r\nExiting\r\n"
-            logger.exception("Problem with audio port => geiger 2: " + str(e))
-            self.stop() # Set EOL for log
-            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-            logging.shutdown()
-            sys.exit(1)
+        self.logStats()
 
-    def getData(self):
-        if self.device_Channels > 2:
-            self.device_Channels = 2
+################################################################################
+# Part 4 - alerting
+#
+# Rules are built once from the configuration and evaluated on every
+# aggregated sample by the alerting thread, never by the acquisition threads.
+# A rule raises after 'alertdebounce' consecutive samples over its level and
+# clears once the value drops 'alerthysteresis' below the level.
+################################################################################
+class alertRule():
+    def __init__(self, name, level, hysteresis, debounce):
+        self.name = name
+        self.level = level
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self.active = False
+        self.pending = 0
+
+    def getValue(self, sample):
+        return sample[0]
+
+    def update(self, sample):
+        """
+          Returns "raised" or "cleared" when the rule changes state, else None.
+        """
+        value = self.getValue(sample)
+
+        if value is None:
+            return None
+
+        if self.active:
+            over = value >= self.level - self.hysteresis
+        else:
+            over = value > self.level
 
-        self.stream = self.pa.open(format = pyaudio.paInt16,
-                                   channels = self.device_Channels,
-                                   rate = 44100,
-                                   input = True,
-                                   input_device_index = self.device_index,
-                                   start = True,
-                                   frames_per_buffer = int(44100 * 0.05))
+        if over == self.active:
+            self.pending = 0
+            return None
 
-        for i in range(0, int(44100 / 1024 * 30)):
-            try:
-                if not self.stream: break
+        self.pending += 1
 
-                block = self.stream.read(1024)
-            except (pyaudio.paInputOverflowed, IOError,):
-                """
-                  Buffer overflows are a real problem in pyaudio depending on the choice of fRate and CHUNK.
-                  Signal them to the user, but ignore them - play with fRate and CHUNK until they are at a minimum
-                """
-                if self.is_running and not self.bSquelchIoerror:
-                    print "paInputOverflow on audio port => %d"
-                    logger.error("paInputOverflow on audio port => %d")
+        if self.pending < self.debounce:
+            return None
 
-                continue
-            except Exception as ex:
-                print "Problem with audio port => 2\r\n\t", str(ex), "\r\n\tExiting\r\n\t"
-                logger.exception("Problem with serial port => geiger 2: " + str(ex))
+        self.pending = 0
+        self.active = over
+        return "raised" if over else "cleared"
 
-                if self.stream:
-                    self.stream.stop_stream()
-                    self.stream.close()
-                    self.stream = None
+class thresholdRule(alertRule):
+    def __init__(self, level, hysteresis, debounce):
+        alertRule.__init__(self, "threshold %g CPM" % level, level, hysteresis, debounce)
 
-                self.stop()
-                # Set EOL for log
-                logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
-                logging.shutdown()
-                sys.exit(1)
+class rateRule(alertRule):
+    # Rise of the CPM between two aggregates, in CPM per minute
+    def __init__(self, level, hysteresis, debounce):
+        alertRule.__init__(self, "rate %g CPM/min" % level, level, hysteresis, debounce)
+        self.lastSample = None
 
-            amplitude = get_rms2(block)
+    def getValue(self, sample):
+        lastSample = self.lastSample
+        self.lastSample = sample
 
-            if amplitude > 0.010:
-                # Noisy block
-                self.noisycount += 1
+        if lastSample is None:
+            return None
 
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
+        minutes = (sample[1] - lastSample[1]).total_seconds() / 60.0
 
-        if self.noisycount >= 0:
-            cpm = self.noisycount * (60 / 30)
-            self.noisycount = 0
+        if minutes <= 0:
+            return None
 
-        utcTime = datetime.datetime.utcnow()
-        data = [cpm, utcTime]
-        return data
+        return (sample[0] - lastSample[0]) / minutes
 
-    def stop(self):
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
+class sustainedRule(alertRule):
+    # CPM above cpmLevel for at least 'seconds' without interruption
+    def __init__(self, cpmLevel, seconds, hysteresis, debounce):
+        alertRule.__init__(self, "sustained %g CPM for %g s" % (cpmLevel, seconds), seconds, 0, debounce)
+        self.cpmLevel = cpmLevel
+        self.cpmHysteresis = hysteresis
+        self.since = None
 
-        self.stopwork = 1
-        self.queueLock = 0
-        self.is_running = 0
+    def getValue(self, sample):
+        # The value compared against the level is how long the CPM has been elevated
+        level = self.cpmLevel
 
-    def getResult(self):
-        # Check if we have some data in queue
-        if len(self.queue) > 0:
+        if self.active:
+            level = self.cpmLevel - self.cpmHysteresis
 
-            # Check if it's safe to process queue
-            while(self.queueLock == 1):
-                print "getResult: quene locked! => geiger 2\r\n"
-                logger.warning("getResult: queue locked! => geiger 2")
-                time.sleep(0.5)
+        if sample[0] <= level:
+            self.since = None
+            return 0
 
-            """
-              Put a lock so measuring process will not interfere with queue,
-              processing should be fast enought to not break data acquisition from geiger
-            """
-            self.queueLock = 1
-            cpm = 0
-
-            # Now get sum of all CPM's
-            for singleData in self.queue:
-                cpm = cpm + singleData[0]
-
-            # And divide by number of elements to get mean value, 0.5 is for rounding up/down
-            cpm = int((float(cpm) / len(self.queue)) + 0.5)
-            # Report with latest time from quene
-            utcTime = self.queue.pop()[1]
-            # Clear queue and remove lock
-            self.queue.clear()
-            self.queueLock = 0
-            data = [cpm, utcTime]
-        else:
-            # no data in queue, return invalid CPM data and current time
-            data = [-1, datetime.datetime.utcnow()]
+        if self.since is None:
+            self.since = sample[1]
 
-        return data
+        return (sample[1] - self.since).total_seconds()
 
-################################################################################
-# Part 3 - Web server communication
-################################################################################
-class webCommunication():
-    HOST = "www.radmon.org"
-    #HOST="127.0.0.1" # uncomment this for debug purposes on localhost
-    PORT = 80
+class alertFileSink():
+    def __init__(self, fileName):
+        self.fileName = fileName
 
-    def __init__(self, mycfg):
-        self.user = mycfg.user
-        self.password = mycfg.password
+    def send(self, event):
+        f = open(self.fileName, "a")
+        f.write("%(time)s %(device)s %(state)s %(rule)s %(cpm)d CPM %(usvh).3f uSv/h\n" % event)
+        f.close()
 
-    def sendSample(self, sample):
-        if not self.user or not self.password: return
+class alertCommandSink():
+    def __init__(self, command):
+        self.command = shlex.split(command)
+        self.processes = []
 
-        sampleCPM = sample[0]
-        sampleTime = sample[1]
-        # Format date and time as required
-        dtime = sampleTime.strftime("%Y-%m-%d%%20%H:%M:%S")
-        print "Connecting to server => geiger 1\r\n"
-        logger.info("Connecting to server => geiger 1")
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        url = "GET /radmon.php?user=" + self.user + "&password=" + self.password + "&function=submit&datetime=" + dtime + "&value=" + str(sampleCPM) + "&unit=CPM HTTP/1.1"
-        request = url + "\r\nHost: www.radmon.org\r\nUser-Agent: pyRadMon " + VERSION + "\r\n\r\n"
-        print "Sending average sample => geiger 1: " + str(sampleCPM) + " CPM\r\n"
+    def send(self, event):
+        # Reap hooks that finished, never wait for a running one
+        self.processes = [p for p in self.processes if p.poll() is None]
+        self.processes.append(subprocess.Popen(self.command + [event["state"], event["rule"], event["device"],
+            str(event["cpm"]), "%.3f" % event["usvh"], event["time"]]))
+
+class alertHttpSink():
+    def __init__(self, url):
+        parsed = urlparse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+
+    def send(self, event):
+        connection = httplib.HTTPConnection(self.host, self.port, timeout = 5)
 
         try:
-            s.connect((self.HOST, self.PORT))
-            s.settimeout(10.0) # 10 seconds to timeout, this will prevent crash
-            data = None
-            doneSend = False
-            s.send(request)
-            time.sleep(0.5)
-            data = s.recv(1024)
-            time.sleep(0.5)
-
-            for i in range(0, 10):
-                if doneSend is False:
-                    if data is not None:
-                        httpResponse = str(data).splitlines()[0]
-                        print "Server response => geiger 1: ", httpResponse, "\r\n"
-                        logger.info("Server response => geiger 1: " + httpResponse)
-
-                        if "incorrect" in data.lower():
-                            print "You are using incorrect user/password combination => geiger 1!\r\n"
-                            geigerCommunication.stop()
-                            geigerCommunication2.stop()
-                            sys.exit(1)
-
-                        doneSend = True
-        except Exception as ex:
-            print "Could not communicate with the Server, timeout reached. => geiger 1: ",ex,"\r\n"
-            logger.exception("Could not communicate with the Server, timeout reached. => geiger 1: " + str(ex))
+            connection.request("POST", self.path, json.dumps(event), {"Content-Type": "application/json"})
+            connection.getresponse().read()
         finally:
-            s.close()
+            connection.close()
 
-class webCommunication2():
-    HOST = "www.radmon.org"
-    #HOST="127.0.0.1" # uncomment this for debug purposes on localhost
-    PORT = 80
+class alertEngine(threading.Thread):
+    def __init__(self, cfg):
+        super(alertEngine, self).__init__()
+        self.name = "alertEngine"
+        self.cfg = cfg
+        self.queue = Queue.Queue(100)
+        self.rules = {}
+        self.sinks = []
+        self.stopwork = 0
 
-    def __init__(self, mycfg):
-        self.user = mycfg.user
-        self.password = mycfg.password
+        if cfg.alertFile:
+            self.sinks.append(alertFileSink(cfg.alertFile))
 
-    def sendSample(self, sample):
-        if not self.user or not self.password: return
+        if cfg.alertCommand:
+            self.sinks.append(alertCommandSink(cfg.alertCommand))
 
-        sampleCPM = sample[0]
-        sampleTime = sample[1]
-        # Format date and time as required
-        dtime = sampleTime.strftime("%Y-%m-%d%%20%H:%M:%S")
-        print "Connecting to server => geiger 2\r\n"
-        logger.info("Connecting to server => geiger 2")
-        s2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        url = "GET /radmon.php?user=" + self.user + "&password=" + self.password + "&function=submit&datetime=" + dtime + "&value=" + str(sampleCPM) + "&unit=CPM HTTP/1.1"
-        request = url + "\r\nHost: www.radmon.org\r\nUser-Agent: pyRadMon " + VERSION + "\r\n\r\n"
-        print "Sending average sample => geiger 2: " + str(sampleCPM) + " CPM\r\n"
+        if cfg.alertUrl:
+            self.sinks.append(alertHttpSink(cfg.alertUrl))
+
+        self.enabled = len(self.createRules()) > 0 and len(self.sinks) > 0
+
+    def createRules(self):
+        cfg = self.cfg
+        rules = []
+
+        if cfg.alertThreshold is not None:
+            rules.append(thresholdRule(cfg.alertThreshold, cfg.alertHysteresis, cfg.alertDebounce))
+
+        if cfg.alertRate is not None:
+            rules.append(rateRule(cfg.alertRate, cfg.alertHysteresis, cfg.alertDebounce))
+
+        if cfg.alertSustained is not None:
+            rules.append(sustainedRule(cfg.alertSustained[0], cfg.alertSustained[1], cfg.alertHysteresis, cfg.alertDebounce))
+
+        return rules
+
+    def publish(self, device, sample):
+        """
+          Hand an aggregate over to the alerting thread, never blocks.
+        """
+        if not self.enabled: return
 
         try:
-            s2.connect((self.HOST, self.PORT))
-            s2.settimeout(10.0) # 10 seconds to timeout, this will prevent crash
-            data = None
-            doneSend = False
-            s2.send(request)
-            time.sleep(0.5)
-            data = s2.recv(1024)
-            time.sleep(0.5)
-
-            for i in range(0, 10):
-                if doneSend is False:
-                    if data is not None:
-                        httpResponse = str(data).splitlines()[0]
-                        print "Server response => geiger 2: ", httpResponse, "\r\n"
-                        logger.info("Server response => geiger 2: " + httpResponse)
-
-                        if "incorrect" in data.lower():
-                            print "You are using incorrect user/password combination => geiger 2!\r\n"
-                            logger.error("You are using incorrect user/password combination => geiger 2!")
-                            geigerCommunication.stop()
-                            geigerCommunication2.stop()
-                            sys.exit(1)
-
-                        doneSend = True
-        except Exception as ex:
-            print "Could not communicate with the Server, timeout reached. => geiger 2: ", ex, "\r\n"
-            logger.exception("Could not communicate with the Server, timeout reached. => geiger 2: " + str(ex))
-        finally:
-            s2.close()
+            self.queue.put_nowait((device, sample))
+        except Queue.Full:
+            logger.warning("Alert queue full, sample dropped => " + device)
+
+    def run(self):
+        while(self.stopwork == 0):
+            try:
+                device, sample = self.queue.get(True, 0.5)
+            except Queue.Empty:
+                continue
+
+            if device not in self.rules:
+                # Every device gets its own rule state
+                self.rules[device] = self.createRules()
+
+            for rule in self.rules[device]:
+                state = rule.update(sample)
+
+                if state is not None:
+                    self.dispatch(device, rule, state, sample)
+
+    def dispatch(self, device, rule, state, sample):
+        event = {
+            "device": device,
+            "rule": rule.name,
+            "state": state,
+            "cpm": sample[0],
+            "usvh": sample[6] if len(sample) > 6 else 0.0,
+            "time": sample[1].strftime("%Y-%m-%d %H:%M:%S")
+        }
+        print "Alert", state, "=>", device + ":", rule.name, "at", sample[0], "CPM\r\n"
+        logger.warning("Alert " + state + " => " + device + ": " + rule.name + " at " + str(sample[0]) + " CPM")
+
+        for sink in self.sinks:
+            try:
+                sink.send(event)
+            except Exception as e:
+                logger.exception("Alert sink failed => " + device + ": " + str(e))
+
+    def stop(self):
+        self.stopwork = 1
 
 ################################################################################
 # Main code
 ################################################################################
-def main():
+def main(singleCounter = False):
     """
       Main loop is in while loop.
-      Check if file exists, if not, create one and exit
+      Check if file exists, if not, create one and exit.
+      singleCounter is set by PyRadmon.py: the default configuration file is
+      written for one counter and samples are taken every 30 seconds.
     """
+    uploadInterval = 30 if singleCounter else 60
+
     if (os.path.isfile("config.txt") == 0):
         print "\tNo configuration file, creating default one.\r\n\t"
+        p = None
 
         try:
             f = open("config.txt", 'w')
             f.write("# Parameter names are not case-sensitive\r\n")
             f.write("# Parameter values are case-sensitive\r\n")
-            f.write("user=test_user\r\n")
-            f.write("password=test_password\r\n")
-            f.write("user2=test_user\r\n")
-            f.write("password2=test_password\r\n")
+            f.write("# Sample filter: hampel rejects spikes (garbled reads) before averaging, none disables it\r\n")
+
+            if not singleCounter:
+                f.write("# Set here for every counter, or per counter in its section\r\n")
+
+            f.write("filter=hampel\r\n")
+            f.write("filterwindow=9\r\n")
+            f.write("filtersigma=5\r\n")
+            f.write("# Seconds between two samples, taken at whole multiples of it on the clock\r\n")
+
+            if not singleCounter:
+                f.write("# Set here for every counter, or per counter in its section\r\n")
+
+            f.write("uploadinterval=" + str(uploadInterval) + "\r\n")
+            f.write("# A counter without samples for this many seconds is restarted\r\n")
+            f.write("stalltimeout=300\r\n")
+
+            if not singleCounter:
+                f.write("# Pool co-located tubes of one type into one more counter, give it its own account:\r\n")
+                f.write("#[fused]\r\n")
+                f.write("#user=fused_user\r\n")
+                f.write("#password=fused_password\r\n")
+                f.write("#members=1,2\r\n")
+                f.write("# Count taps of two or more audio counters within this many seconds as coincident (muons)\r\n")
+                f.write("#coincidencewindow=0.0005\r\n")
+                f.write("# Run every counter in a process of its own, lets audio counters use more than one core\r\n")
+                f.write("processmode=no\r\n")
+
+            f.write("# Upload over TLS (the default, port 443 unless serverport is set), keeps your password off the wire.\r\n")
+            f.write("# https=no uploads in plain HTTP, on port 80 unless serverport is set.\r\n")
+            f.write("https=yes\r\n")
+            f.write("# Extra sample destinations, each may be repeated:\r\n")
+            f.write("#httpsink=http://localhost:8080/samples\r\n")
+            f.write("#mqttsink=mqtt://localhost:1883/pyradmon\r\n")
+            f.write("#csvsink=samples.csv\r\n")
+            f.write("#udpsink=localhost:5005\r\n")
+            if not singleCounter:
+                f.write("# One [deviceN] section per counter, add as many as you need.\r\n")
+
             f.write("# Port is usually /dev/ttyUSBx in Linux and COMx in Windows\r\n")
-            f.write("serialport=/dev/ttyUSB0\r\n")
-            f.write("speed=2400\r\n")
-            f.write("serialport2=/dev/ttyUSB1\r\n")
-            f.write("speed2=2400\r\n")
             f.write("# Protocols: demo, mygeiger, gmc, netio, audio\r\n")
-            f.write("protocol=demo\r\n")
-            f.write("protocol2=demo\r\n")
+            f.write("# Tube for uSv/h conversion: sbm-20, sbm-19, si-29bg, lnd-712, j305, m4011 (or set conversionfactor)\r\n")
             f.write("# In case of audio, input the device number here, default is 0.\r\n")
-            p = pyaudio.PyAudio()
 
-            # For each audio device, determine if is an input or an output and add it to the appropriate list and dictionary
-            for i in range (0, p.get_device_count()):
-                dev = p.get_device_info_by_index(i)
+            if pyaudio is not None:
+                p = pyaudio.PyAudio()
 
-                if dev['maxInputChannels'] > 0:
-                    f.write("# " + str(i) + " - " + dev['name'] + " \r\n")
-                else:
-                    continue
+                # For each audio device, determine if is an input or an output and add it to the appropriate list and dictionary
+                for i in range (0, p.get_device_count()):
+                    dev = p.get_device_info_by_index(i)
+
+                    if dev['maxInputChannels'] > 0:
+                        f.write("# " + str(i) + " - " + dev['name'] + " \r\n")
+                    else:
+                        continue
+
+            for i in range(1, 2 if singleCounter else 3):
+                if not singleCounter:
+                    f.write("[device" + str(i) + "]\r\n")
+
+                f.write("user=test_user\r\n")
+                f.write("password=test_password\r\n")
+                f.write("serialport=/dev/ttyUSB" + str(i - 1) + "\r\n")
+                f.write("speed=2400\r\n")
+                f.write("protocol=demo\r\n")
+                f.write("tube=sbm-20\r\n")
+                f.write("device=0\r\n")
 
-            f.write("device=0\r\n")
-            f.write("device2=0\r\n")
             print "\tPlease open config.txt file using text editor and update configuration.\r\n"
         except Exception as e:
             print "\tFailed to create configuration file\r\n\t", str(e)
             logger.exception("Failed to create configuration file" + str(e))
         finally:
             time.sleep(1)
-            p.terminate()
+
+            if p is not None:
+                p.terminate()
+
             f.close()
 
         # Set EOL for log
@@ -1304,134 +3829,167 @@ def main():
         sys.exit(1)
     else:
         # Create and read configuration data
-        cfg = config()
+        cfg = config(uploadInterval)
         cfg.readConfig()
 
-        # Create geiger communication object
-        if cfg.protocol == config.MYGEIGER:
-            print "Using myGeiger protocol => geiger 1\r\n"
-            logger.info("Using myGeiger protocol => geiger 1")
-            geigerCommunication = myGeiger(cfg)
-        elif cfg.protocol == config.DEMO:
-            print "Using Demo mode for 1 => geiger 1\r\n"
-            logger.info("Using DEMO protocol => geiger 1")
-            geigerCommunication = Demo(cfg)
-        elif cfg.protocol == config.GMC:
-            print "Using GMC protocol for 1 => geiger 1\r\n"
-            geigerCommunication = gmc(cfg)
-        elif cfg.protocol == config.NETIO:
-            print "Using NetIO protocol for 1 => geiger 1\r\n"
-            geigerCommunication = netio(cfg)
-        elif cfg.protocol == config.AUDIO:
-            print "Using audio protocol for 1 => geiger 1\r\n"
-            geigerCommunication = audioCommunication(cfg)
-        else:
-            print "Unknown protocol configured, can't run => geiger 1\r\n"
-            logger.error("Unknown protocol configured, can't run => geiger 1")
+        if len(cfg.devices) == 0:
+            print "No device configured, can't run\r\n"
+            logger.error("No device configured, can't run")
             # Set EOL for log
             logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
             logging.shutdown()
             sys.exit(1)
 
-        # Create and read configuration 2 data
-        cfg2 = config2()
-        cfg2.readConfig()
-
-        # Create geiger communication object
-        if cfg2.protocol == config2.MYGEIGER:
-            print "Using myGeiger protocol => geiger 2\r\n"
-            logger.info("Using myGeiger protocol => geiger 2")
-            geigerCommunication2 = myGeiger2(cfg2)
-        elif cfg2.protocol == config2.DEMO:
-            print "Using Demo mode => geiger 2\r\n"
-            logger.info("Using DEMO protocol => geiger 2")
-            geigerCommunication2 = Demo2(cfg2)
-        elif cfg2.protocol == config2.GMC:
-            print "Using GMC protocol => geiger 2\r\n"
-            geigerCommunication2 = gmc2(cfg2)
-        elif cfg2.protocol == config2.NETIO:
-            print "Using NetIO protocol => geiger 2\r\n"
-            geigerCommunication2 = netio2(cfg2)
-        elif cfg2.protocol == config2.AUDIO:
-            print "Using audio protocol for 1 => geiger 1\r\n"
-            geigerCommunication2 = audioCommunication2(cfg2)
-        else:
-            print "Unknown protocol configured, can't run => geiger 2\r\n"
-            logger.error("Unknown protocol configured, can't run => geiger 2")
+        # Reprocess stored history with the configured calibration and exit,
+        # --convert file [device number], --convert2 file still works
+        if len(sys.argv) > 2 and sys.argv[1] in ("--convert", "--convert2"):
+            number = 2 if sys.argv[1] == "--convert2" else (int(sys.argv[3]) if len(sys.argv) > 3 else 1)
+            deviceCfgs = [deviceCfg for deviceCfg in cfg.devices if deviceCfg.number == number]
+
+            if len(deviceCfgs) == 0:
+                print "Unknown device", number, "\r\n"
+                logger.error("Unknown device " + str(number))
+                logging.shutdown()
+                sys.exit(1)
+
+            converted = doseConverter(deviceCfgs[0]).convertHistoryFile(sys.argv[2])
+            print "Converted", converted, "samples to", sys.argv[2] + ".usvh.csv\r\n"
+            logger.info("Converted " + str(converted) + " samples of " + sys.argv[2] + " => geiger " + str(number))
+            # Set EOL for log
+            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
+            logging.shutdown()
+            sys.exit(0)
+
+        httpsProblem = checkHttpsSupport(cfg)
+
+        if httpsProblem is not None:
+            print httpsProblem + "\r\n"
+            logger.error(httpsProblem)
             # Set EOL for log
             logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
             logging.shutdown()
             sys.exit(1)
 
-        try:
-            # Create web server communication object
-            webService = webCommunication(cfg)
-            webService2 = webCommunication2(cfg2)
-            # Start measuring thread
-            geigerCommunication.start()
-            geigerCommunication2.start()
-
-            # Now send data to web site every 30 seconds
-            while(geigerCommunication.is_running == 1 and geigerCommunication2.is_running == 1):
-                sample = geigerCommunication.getResult()
-                sample2 = geigerCommunication2.getResult()
-
-                if sample[0] != -1:
-                    # Sample is valid, CPM !=-1
-                    print "Average result => geiger 1:\tCPM =", sample[0], "\t", str(sample[1]), "\r\n"
+        # Create alerting thread, only runs when rules and sinks are configured
+        alertService = alertEngine(cfg)
+        # Create web server communication objects sharing one kept-alive connection
+        hostCache = hostResolver(cfg)
+        radmonConnection = httpConnection(cfg.serverHost, cfg.serverPort, hostCache, createSslContext(cfg.caFile) if cfg.https else None,
+            cfg.connectTimeout, cfg.sendTimeout, cfg.receiveTimeout)
+        # Create a driver, dose conversion and upload account per counter
+        devices = [geigerDevice(deviceCfg, radmonConnection, cfg.processMode) for deviceCfg in cfg.devices]
 
-                    try:
-                        webService.sendSample(sample)
-                    except Exception as e:
-                        print "Error communicating server => geiger 1:\r\n\t", str(e), "\r\n"
-                        logger.exception("Error communicating server => geiger 1: " + str(e))
+        if len([device for device in devices if device.driver is None]) > 0:
+            # Set EOL for log
+            logger.info("--------------------------------------- EOL ---------------------------------------\r\n")
+            logging.shutdown()
+            sys.exit(1)
 
-                    print "Waiting 30 seconds => geiger 1\r\n"
+        # Pooled reading of co-located counters, uploaded like one more counter
+        if cfg.fused is not None:
+            members = [device for device in devices if cfg.fusedMembers is None or device.number in cfg.fusedMembers]
+            devices.append(fusedDevice(cfg.fused, radmonConnection, members, cfg.fusedStale))
+
+        # Create upload threads, samples that could not be uploaded go to the spool
+        uploadSpool = sampleSpool(cfg.spoolFile)
+        uploadBreaker = circuitBreaker(cfg)
+        uploadService = uploadWorker(cfg, uploadSpool, uploadBreaker)
+        # Fan out to the other configured destinations
+        sinkService = sampleDispatcher(cfg, hostCache)
+        replayService = spoolReplayWorker(cfg, uploadSpool, radmonConnection, uploadBreaker, [device.webService for device in devices])
+        # Restarts failed counters, the others keep running
+        supervisor = deviceSupervisor(cfg, [device for device in devices if not isinstance(device, fusedDevice)])
+        # Coincident taps of the audio counters
+        coincidenceService = None
+
+        if cfg.coincidenceWindow is not None:
+            coincidenceService = coincidenceEngine(cfg)
+            counters = [device.name for device in devices if device.enableCoincidence(coincidenceService)]
+
+            if len(counters) < 2:
+                print "Coincidence detection needs two audio counters in thread mode, it is off\r\n"
+                logger.warning("Coincidence detection needs two audio counters in thread mode, it is off")
+                coincidenceService = None
+            else:
+                print "Coincidence detection => " + ", ".join(counters) + "\r\n"
+                logger.info("Coincidence detection => " + ", ".join(counters))
 
-                    """
-                      Waiting 60x0.5 seconds, it has a better response when CTRL+C is used,
-                      might be changed in future.
-                    """
-                    for i in range(0, 60):
-                        time.sleep(0.5)
-                else:
-                    print "No samples in queue, waiting 5 seconds => geiger 1\r\n"
-                    for i in range(0, 10):
-                        time.sleep(0.5)
+        try:
+            # Start measuring, upload and alerting threads
+            for device in devices:
+                device.driver.start()
 
-                    continue
+            supervisor.start()
 
-                if sample2[0] != -1:
-                    # Sample2 is valid, CPM !=-1
-                    print "Average result => geiger 2:\tCPM =", sample2[0], "\t", str(sample2[1]), "\r\n"
+            if coincidenceService is not None:
+                coincidenceService.start()
 
-                    try:
-                        webService2.sendSample(sample2)
-                    except Exception as e:
-                        print "Error communicating server => geiger 2:\r\n\t", str(e), "\r\n"
-                        logger.exception("Error communicating server => geiger 2: " + str(e))
+            hostCache.start()
+            uploadService.start()
+            replayService.start()
+            sinkService.start()
 
-                    print "Waiting 30 seconds => geiger 2\r\n"
+            if alertService.enabled:
+                alertService.start()
 
-                    """
-                      Waiting 60x0.5 seconds, it has a better response when CTRL+C is used,
-                      might be changed in future.
-                    """
-                    for i in range(0, 60):
-                        time.sleep(0.5)
-                else:
-                    print "No samples in queue, waiting 5 seconds => geiger 2\r\n"
+            # Every counter is read and uploaded on its own schedule, aligned to the wall clock
+            scheduler = deviceScheduler(devices)
+            print "First sample at", datetime.datetime.fromtimestamp(scheduler.nextDue()).strftime("%H:%M:%S"), "\r\n"
+            rejected = lambda: len([device for device in devices if device.webService.rejected]) > 0
+            scheduler.wait(rejected)
 
-                    for i in range(0, 10):
-                        time.sleep(0.5)
+            # Failed counters are left to the supervisor, stop when radmon.org rejects an account
+            while not rejected():
+                # Samples due this cycle, uploaded together in one round-trip
+                uploads = []
 
-                    continue
+                for device, due in scheduler.popDue():
+                    sample = device.driver.getResult()
+
+                    if sample[0] == -1:
+                        print "No samples in queue, retrying in", deviceScheduler.RETRY_INTERVAL, "seconds => " + device.name + "\r\n"
+                        scheduler.empty(device)
+                        continue
+
+                    # Sample is valid, CPM !=-1
+                    device.doseService.convert(sample)
+                    print "Average result => " + device.name + ":\tCPM =", sample[0], "\t", str(sample[1]), "\r\n"
+                    print "Counts => " + device.name + ":\t%.0f in %.1f s, CI %.1f - %.1f CPM" % (sample[2], sample[3], sample[4], sample[5]), "\r\n"
+                    logger.info("Average result => " + device.name + ": %d CPM (CI %.1f - %.1f) from %.0f counts in %.1f s" % (sample[0], sample[4], sample[5], sample[2], sample[3]))
+                    print "Dose rate => " + device.name + ":\t%.3f uSv/h, CI %.3f - %.3f uSv/h" % (sample[6], sample[7], sample[8]), "\r\n"
+                    alertService.publish(device.name, sample)
+                    sinkService.publish(device.name, sample)
+                    uploads.append((device.webService, sample))
+                    scheduler.sampled(device, due)
+
+                if len(uploads) > 0:
+                    # Hand over to the upload thread, the network never delays the next slot
+                    uploadService.submitBatch(uploads)
+                    print "Upload queue depth:", uploadService.getQueueDepth(), "\r\n"
+
+                    for webService, sample in uploads:
+                        print "Upload stats => " + webService.name + ":", webService.stats.formatStats(), "\r\n"
+                        logger.info("Upload stats => " + webService.name + ": " + webService.stats.formatStats())
+
+                    if coincidenceService is not None:
+                        coincidences = coincidenceService.formatStats(coincidenceService.getStats())
+                        print "Coincidences:", coincidences, "\r\n"
+                        logger.info("Coincidences: " + coincidences)
+
+                    print "Scheduler:", scheduler.formatStats(), "\r\n"
+                    logger.info("Scheduler: " + scheduler.formatStats())
+                    print "Next sample at", datetime.datetime.fromtimestamp(scheduler.nextDue()).strftime("%H:%M:%S"), "\r\n"
+
+                scheduler.wait(rejected)
+
+            print "Server rejected the user/password combination, exiting program\r\n"
+            logger.error("Server rejected the user/password combination, exiting program")
 
         except KeyboardInterrupt as e:
             print "\r\nCTRL+C pressed, exiting program\r\n\t", str(e), "\r\n"
             logger.exception("CTRL+C pressed, exiting program: " + str(e))
 
-        except SystemExit:
+        except SystemExit as e:
             print "\r\nSystem exit\r\n\t", str(e), "\r\n"
             logger.exception("System exit: " + str(e))
 
@@ -1439,8 +3997,25 @@ def main():
             print "\r\nUnhandled error\r\n\t", str(e), "\r\n"
             logger.exception("Unhandled error: " + str(e))
 
-        geigerCommunication.stop()
-        geigerCommunication2.stop()
+        supervisor.stop()
+
+        if coincidenceService is not None:
+            coincidenceService.stop()
+
+        for device in devices:
+            try:
+                device.driver.stop()
+            except Exception as e:
+                print "Error stopping => " + device.name + ":\r\n\t", str(e), "\r\n"
+                logger.exception("Error stopping => " + device.name + ": " + str(e))
+
+        hostCache.stop()
+        uploadService.stop()
+        replayService.stop()
+        # Samples of an upload cut short are spooled by the upload thread
+        radmonConnection.abort()
+        sinkService.stop()
+        alertService.stop()
         # Threading fix
         print "Waiting and reap threads"
         logger.warning("Waiting and reap threads")
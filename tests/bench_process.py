@@ -0,0 +1,154 @@
+#!/usr/bin/python
+'''
+Benchmark audio counters in thread mode (processmode=no, every driver shares
+the GIL) and process mode (processmode=yes, one device process per counter).
+
+Every counter is a real geigerDevice with the audio protocol, reading from a
+fake sound card that delivers a noisy 1024 frame block every
+1024 / 44100 / speedup seconds. A driver that falls more than BUFFER_BLOCKS
+behind overflows and loses blocks, like PortAudio does. Samples come back
+through the normal driver path (the device process pipe in process mode),
+every processed block is a tap, so the blocks a counter missed are the
+blocks the card delivered in its listening time minus the taps it counted.
+
+speedup makes each fake card that many times faster than a real one, so a
+few counters stand in for many: a counter that misses nothing at speedup 50
+has at least 50x headroom.
+
+Needs the MultiPyRadmon dependencies and fork (Linux, macOS), device
+processes inherit the fake sound card.
+Run : python bench_process.py [counters] [seconds] [speedup]
+'''
+import imp
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+MultiPyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+# Blocks per second of a real sound card
+BLOCK_RATE = 44100 / 1024.0
+# Blocks the card buffers before it overflows
+BUFFER_BLOCKS = 8
+# One 1024 frame block of 16-bit mono noise, loud enough to count as a tap
+BLOCK = struct.pack("1024h", *[(i * 7919) % 65536 - 32768 for i in range(0, 1024)])
+
+class fakeStream():
+    def __init__(self, speedup):
+        self.blockTime = 1 / (BLOCK_RATE * speedup)
+        self.started = time.time()
+        # Next block handed out
+        self.next = 0
+
+    def read(self, frames):
+        now = time.time()
+        # Blocks the card has completed by now
+        available = int((now - self.started) / self.blockTime)
+
+        if available - self.next > BUFFER_BLOCKS:
+            self.next = available
+            raise IOError("Input overflowed")
+
+        if available <= self.next:
+            time.sleep(self.started + (self.next + 1) * self.blockTime - now)
+
+        self.next += 1
+        return BLOCK
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+class fakeSoundCard():
+    def __init__(self, speedup):
+        self.speedup = speedup
+
+    def get_device_info_by_index(self, index):
+        return {"maxInputChannels": 1, "name": "bench card " + str(index)}
+
+    def open(self, **options):
+        return fakeStream(self.speedup)
+
+    def terminate(self):
+        pass
+
+class fakePyaudio():
+    """
+      Stands in for the pyaudio module in the engine.
+    """
+    paInt16 = 8
+    paInputOverflowed = IOError
+
+    def __init__(self, speedup):
+        self.speedup = speedup
+
+    def PyAudio(self):
+        return fakeSoundCard(self.speedup)
+
+def createConfig(number):
+    cfg = MultiPyRadmon.deviceConfig(number)
+    cfg.protocol = MultiPyRadmon.config.AUDIO
+    cfg.deviceIndex = number - 1
+    # Every window has the same count, nothing for a spike filter to do
+    cfg.filter = MultiPyRadmon.config.FILTER_NONE
+    return cfg
+
+def run(counters, seconds, speedup, processMode):
+    """
+      Returns [counted blocks, listening seconds] per counter.
+    """
+    MultiPyRadmon.pyaudio = fakePyaudio(speedup)
+    # Drivers print every sample, device processes inherit the redirect
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    try:
+        devices = [MultiPyRadmon.geigerDevice(createConfig(number), None, processMode) for number in range(1, counters + 1)]
+
+        for device in devices:
+            device.driver.start()
+
+        # An audio window is 30 s of the card, leave time for the first and drop it
+        time.sleep(2 * 30 / speedup + 1)
+
+        for device in devices:
+            device.driver.getResult()
+
+        time.sleep(seconds)
+        results = [device.driver.getResult() for device in devices]
+
+        for device in devices:
+            device.driver.stop()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return [result[2:4] if result[0] != -1 else [0.0, 0.0] for result in results]
+
+def report(name, speedup, results):
+    print "%s:" % name
+
+    for i in range(0, len(results)):
+        counts, seconds = results[i]
+        delivered = seconds * BLOCK_RATE * speedup
+
+        if delivered == 0:
+            print "  geiger %d: no complete window, run longer" % (i + 1)
+            continue
+
+        missed = max(0.0, delivered - counts)
+        print "  geiger %d: %7.0f blocks in %5.1f s, %7.0f missed (%5.1f%%)" % (i + 1, counts, seconds, missed, 100 * missed / delivered)
+
+if __name__ == "__main__":
+    counters = int(sys.argv[1]) if len(sys.argv) > 1 else max(2, multiprocessing.cpu_count())
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    speedup = float(sys.argv[3]) if len(sys.argv) > 3 else 50.0
+    print "%d audio counters, %d cores, cards %.0fx real time (%.0f blocks/s each)\n" % (counters,
+        multiprocessing.cpu_count(), speedup, BLOCK_RATE * speedup)
+    report("processmode=no (threads)", speedup, run(counters, seconds, speedup, False))
+    report("processmode=yes (processes)", speedup, run(counters, seconds, speedup, True))
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+'''
+Benchmark the cost of TLS uploads against the mock radmon.org server.
+Compares a fresh connection per sample (full TCP + TLS handshake every
+time, what a naive HTTPS port would do) with the kept-alive connection the
+uploader uses, both over TLS and plaintext.
+
+Needs the PyRadmon dependencies and the openssl command line tool.
+Run : python bench_tls.py [requests]
+'''
+import imp
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+# PyRadmon.py runs on the MultiPyRadmon engine
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+from mock_radmon import createCertificate, mockRadmonServer
+
+class benchConfig():
+    dnsTtl = 300
+    dnsNegativeTtl = 30
+
+def request(host):
+    return "GET /radmon.php?user=bench&password=bench&function=submit&datetime=2016-01-01%2000:00:00&value=20&unit=CPM HTTP/1.1\r\nHost: " + host + "\r\nConnection: keep-alive\r\n\r\n"
+
+def run(port, context, count, reuse):
+    resolver = PyRadmon.hostResolver(benchConfig())
+    connection = PyRadmon.httpConnection("localhost", port, resolver, context)
+    durations = []
+
+    for i in range(0, count):
+        started = time.time()
+        response = connection.request(request("localhost"))
+
+        if response.status != 200:
+            raise Exception("Unexpected response: " + response.statusLine)
+
+        durations.append(time.time() - started)
+
+        if not reuse:
+            connection.close()
+
+    connection.close()
+    durations.sort()
+    return durations
+
+def report(name, durations):
+    print "%-32s mean %7.2f ms   p50 %7.2f ms   p95 %7.2f ms" % (name, 1000 * sum(durations) / len(durations),
+        1000 * durations[len(durations) // 2], 1000 * durations[int(len(durations) * 0.95)])
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    certFile = os.path.join(tempfile.mkdtemp(), "mock_radmon.pem")
+    createCertificate(certFile)
+
+    tlsServer = mockRadmonServer(port = 0, certFile = certFile)
+    plainServer = mockRadmonServer(port = 0)
+    tlsServer.start()
+    plainServer.start()
+    context = PyRadmon.createSslContext(certFile)
+
+    print "%d requests per case against localhost\n" % count
+    report("plaintext, new connection", run(plainServer.port, None, count, False))
+    report("plaintext, kept alive", run(plainServer.port, None, count, True))
+    report("TLS, full handshake each", run(tlsServer.port, context, count, False))
+    report("TLS, kept alive", run(tlsServer.port, context, count, True))
+    print "\n%d TLS handshakes served" % tlsServer.handshakes
+
+    tlsServer.stop()
+    plainServer.stop()
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+'''
+Benchmark per-upload cost against the mock radmon.org server: a fresh
+socket per upload (how uploads used to work), the kept-alive connection
+the uploader uses and pipelining on that connection.
+
+Needs the PyRadmon dependencies.
+Run : python bench_upload.py [uploads] [server latency in seconds]
+'''
+import imp
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+# PyRadmon.py runs on the MultiPyRadmon engine
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+from mock_radmon import mockRadmonServer
+
+class benchConfig():
+    dnsTtl = 300
+    dnsNegativeTtl = 30
+
+def request(i):
+    return "GET /radmon.php?user=bench&password=bench&function=submit&datetime=2016-01-01%2000:00:00&value=" + str(i) + "&unit=CPM HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: keep-alive\r\n\r\n"
+
+def sequential(port, count, reuse):
+    connection = PyRadmon.httpConnection("127.0.0.1", port, PyRadmon.hostResolver(benchConfig()))
+
+    for i in range(0, count):
+        if connection.request(request(i)).status != 200:
+            raise Exception("Upload failed")
+
+        if not reuse:
+            connection.close()
+
+    connection.close()
+
+def pipelined(port, count):
+    connection = PyRadmon.httpConnection("127.0.0.1", port, PyRadmon.hostResolver(benchConfig()))
+
+    for start in range(0, count, 10):
+        responses = connection.pipeline([request(i) for i in range(start, min(count, start + 10))])
+
+        if len([response for response in responses if response.status == 200]) != min(10, count - start):
+            raise Exception("Upload failed")
+
+    connection.close()
+
+def report(name, count, function, *args):
+    started = time.time()
+    function(*args)
+    elapsed = time.time() - started
+    print "%-30s %8.1f ms total   %6.2f ms per upload" % (name, 1000 * elapsed, 1000 * elapsed / count)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    server = mockRadmonServer(port = 0, latency = latency)
+    server.start()
+
+    print "%d uploads, %.0f ms server latency\n" % (count, 1000 * latency)
+    report("new socket per upload", count, sequential, server.port, count, False)
+    report("kept-alive connection", count, sequential, server.port, count, True)
+    report("pipelined, 10 per trip", count, pipelined, server.port, count)
+
+    server.stop()
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+'''
+Mock radmon.org server for offline testing and upload benchmarks.
+Implements GET /radmon.php?function=submit over HTTP/1.1 with keep-alive.
+
+Run standalone    : python mock_radmon.py --port 8080 --latency 0.2 --error-rate 0.1
+Point PyRadmon at : serverhost=127.0.0.1, serverport=8080 and https=no in config.txt
+Use from a test   : server = mockRadmonServer(port = 0); server.start()
+                    ... server.port, server.submissions ...
+                    server.stop()
+TLS stand-in      : python mock_radmon.py --port 8443 --tls
+                    then https=yes, serverport=8443 and cafile=mock_radmon.pem
+'''
+import argparse
+import BaseHTTPServer
+import json
+import os
+import random
+import socket
+import SocketServer
+import ssl
+import struct
+import subprocess
+import threading
+import time
+import urlparse
+
+def createCertificate(fileName, host = "localhost"):
+    '''
+    Write a self-signed certificate and its key to fileName (PEM), needs the
+    openssl command line tool. The file doubles as cafile for the client.
+    '''
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30",
+        "-subj", "/CN=" + host, "-addext", "subjectAltName=DNS:" + host + ",IP:127.0.0.1",
+        "-keyout", fileName + ".key", "-out", fileName + ".crt"])
+    f = open(fileName, "w")
+    f.write(open(fileName + ".crt").read() + open(fileName + ".key").read())
+    f.close()
+    os.remove(fileName + ".crt")
+    os.remove(fileName + ".key")
+
+class mockRadmonHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer each response and send it in one go, like a real server would
+    wbufsize = -1
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+
+        with server.lock:
+            server.requests += 1
+
+        if server.latency > 0 or server.jitter > 0:
+            time.sleep(server.latency + random.random() * server.jitter)
+
+        if random.random() < server.resetRate:
+            # Abort with a TCP reset instead of an orderly close
+            with server.lock:
+                server.resets += 1
+
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = 1
+            return
+
+        if url.path != "/radmon.php" or query.get("function", [""])[0] != "submit":
+            self.reply(404, "Not found")
+            return
+
+        if random.random() < server.errorRate:
+            with server.lock:
+                server.errors += 1
+
+            self.reply(500, "Internal server error")
+            return
+
+        user = query.get("user", [""])[0]
+        password = query.get("password", [""])[0]
+
+        if (server.user is not None and user != server.user) or (server.password is not None and password != server.password):
+            # radmon.org answers bad credentials with a 200 and this text
+            self.reply(200, "Incorrect login.")
+            return
+
+        submission = {"user": user, "datetime": query.get("datetime", [""])[0], "value": query.get("value", [""])[0],
+            "unit": query.get("unit", [""])[0], "received": time.time(), "client": self.client_address[0]}
+
+        with server.lock:
+            server.submissions.append(submission)
+
+        if server.logFile:
+            f = open(server.logFile, "a")
+            f.write(json.dumps(submission) + "\n")
+            f.close()
+
+        self.reply(200, "OK")
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+
+        if self.server.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write("%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class mockRadmonServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Room for load tests that open many connections at once
+    request_queue_size = 128
+
+    def __init__(self, host = "127.0.0.1", port = 8080, latency = 0.0, jitter = 0.0, errorRate = 0.0, resetRate = 0.0,
+            user = None, password = None, chunked = False, logFile = None, verbose = False, certFile = None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), mockRadmonHandler)
+        self.context = None
+
+        if certFile is not None:
+            self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            self.context.load_cert_chain(certFile)
+
+        self.port = self.server_address[1]
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.resetRate = resetRate
+        self.user = user
+        self.password = password
+        self.chunked = chunked
+        self.logFile = logFile
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.submissions = []
+        self.requests = 0
+        self.errors = 0
+        self.resets = 0
+        self.handshakes = 0
+        self.thread = None
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        if self.context is not None:
+            # Handshake in the handler thread, a slow client must not block accept
+            sock = self.context.wrap_socket(sock, server_side = True, do_handshake_on_connect = False)
+
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        # Clients dropping the connection are expected here
+        if self.verbose:
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def finish_request(self, request, client_address):
+        if self.context is not None:
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, socket.error):
+                return
+
+            with self.lock:
+                self.handshakes += 1
+
+        BaseHTTPServer.HTTPServer.finish_request(self, request, client_address)
+
+    def start(self):
+        self.thread = threading.Thread(target = self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Mock radmon.org upload server")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--latency", type = float, default = 0.0, help = "seconds before every response")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "random extra latency, up to this many seconds")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "fraction of requests answered with a 500")
+    parser.add_argument("--reset-rate", type = float, default = 0.0, help = "fraction of requests answered with a TCP reset")
+    parser.add_argument("--user", help = "expected user, anything else gets the incorrect login response")
+    parser.add_argument("--password", help = "expected password")
+    parser.add_argument("--chunked", action = "store_true", help = "use chunked transfer encoding")
+    parser.add_argument("--log", help = "append every accepted submission to this file as JSON")
+    parser.add_argument("--tls", action = "store_true", help = "serve HTTPS with a self-signed certificate")
+    parser.add_argument("--cert", default = "mock_radmon.pem", help = "certificate and key (PEM), created when missing")
+    parser.add_argument("-v", "--verbose", action = "store_true")
+    args = parser.parse_args()
+    certFile = None
+
+    if args.tls:
+        if not os.path.isfile(args.cert):
+            createCertificate(args.cert)
+
+        certFile = args.cert
+
+    server = mockRadmonServer(args.host, args.port, args.latency, args.jitter, args.error_rate, args.reset_rate,
+        args.user, args.password, args.chunked, args.log, args.verbose, certFile)
+    print "Mock radmon.org listening on %s:%d" % (args.host, server.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.server_close()
+    print "%d requests, %d submissions, %d errors, %d resets" % (server.requests, len(server.submissions), server.errors, server.resets)
@@ -0,0 +1,145 @@
+'''
+Test the alert rules of MultiPyRadmon and the alerting thread that runs them
+To run tests : nosetests test_alert.py
+Verobse (-v) : nosetests -v test_alert.py
+'''
+import datetime
+import imp
+import os
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+def createSample(cpm, minute = 0):
+    # Aggregate as the main loop publishes it: [cpm, utcTime, counts, seconds, low, high, uSv/h]
+    return [cpm, datetime.datetime(2024, 1, 1, 12, 0, 0) + datetime.timedelta(minutes = minute), cpm, 60.0, 0.0, 0.0, cpm / 100.0]
+
+def feed(rule, values):
+    """
+      Returns the state changes of rule for one sample a minute.
+    """
+    return [rule.update(createSample(values[i], i)) for i in range(0, len(values))]
+
+class recordingSink():
+    def __init__(self):
+        self.events = []
+
+    def send(self, event):
+        self.events.append(event)
+
+class brokenSink():
+    def send(self, event):
+        raise IOError("Hook is gone")
+
+class TestThresholdRule:
+
+    def test_raise_hold_clear(self):
+        rule = PyRadmon.thresholdRule(100, 5, 1)
+        # Over the level raises, inside the band below it holds, under the band clears
+        assert feed(rule, [100, 101, 99, 95, 94.9, 99]) == [None, "raised", None, None, "cleared", None]
+
+    def test_debounce(self):
+        rule = PyRadmon.thresholdRule(100, 5, 3)
+        assert feed(rule, [150, 150, 150]) == [None, None, "raised"]
+        assert rule.active
+        assert feed(rule, [10, 10, 10]) == [None, None, "cleared"]
+
+    def test_interrupted_run_starts_over(self):
+        rule = PyRadmon.thresholdRule(100, 5, 2)
+        assert feed(rule, [150, 50, 150, 50]) == [None, None, None, None]
+        assert not rule.active
+        rule = PyRadmon.thresholdRule(100, 5, 2)
+        # Once raised, a single sample under the band does not clear it
+        assert feed(rule, [150, 150, 50, 97, 50, 50]) == [None, "raised", None, None, None, "cleared"]
+
+class TestRateRule:
+
+    def test_rise_per_minute(self):
+        rule = PyRadmon.rateRule(10, 5, 1)
+        # 20 CPM/min, then 6 CPM/min is inside the band, then flat
+        assert feed(rule, [20, 40, 46, 46]) == [None, "raised", None, "cleared"]
+
+    def test_rate_over_longer_gap(self):
+        rule = PyRadmon.rateRule(10, 5, 1)
+        assert rule.update(createSample(20, 0)) is None
+        # 30 CPM more, but over 5 minutes
+        assert rule.update(createSample(50, 5)) is None
+        assert not rule.active
+
+    def test_same_time_is_ignored(self):
+        rule = PyRadmon.rateRule(10, 5, 1)
+        rule.update(createSample(20, 0))
+        assert rule.getValue(createSample(500, 0)) is None
+
+class TestSustainedRule:
+
+    def test_raise_after_duration(self):
+        rule = PyRadmon.sustainedRule(50, 120, 5, 1)
+        # Elevated from minute 0, more than 120 s only at minute 3
+        assert feed(rule, [60, 60, 60, 60]) == [None, None, None, "raised"]
+
+    def test_drop_resets_duration(self):
+        rule = PyRadmon.sustainedRule(50, 120, 5, 1)
+        assert feed(rule, [60, 60, 40, 60, 60, 60]) == [None, None, None, None, None, None]
+        assert rule.update(createSample(60, 6)) == "raised"
+
+    def test_hysteresis_on_cpm(self):
+        rule = PyRadmon.sustainedRule(50, 120, 5, 1)
+        feed(rule, [60, 60, 60, 60])
+        assert rule.active
+        # 47 CPM is inside the band and keeps it raised, 44 CPM clears it
+        assert rule.update(createSample(47, 4)) is None
+        assert rule.update(createSample(44, 5)) == "cleared"
+
+class TestAlertEngine:
+
+    def setup(self):
+        self.cfg = PyRadmon.config()
+        self.cfg.alertThreshold = 100
+        self.cfg.alertHysteresis = 5
+        self.cfg.alertDebounce = 2
+        self.sink = recordingSink()
+
+    def createEngine(self):
+        engine = PyRadmon.alertEngine(self.cfg)
+        engine.sinks = [brokenSink(), self.sink]
+        engine.enabled = True
+        return engine
+
+    def run(self, engine, samples):
+        engine.start()
+
+        for device, sample in samples:
+            engine.publish(device, sample)
+
+        deadline = time.time() + 5
+
+        while not engine.queue.empty() and time.time() < deadline:
+            time.sleep(0.05)
+
+        # Let the thread finish the last sample
+        time.sleep(0.2)
+        engine.stop()
+        engine.join(5.0)
+
+    def test_disabled_without_sink(self):
+        engine = PyRadmon.alertEngine(self.cfg)
+        assert not engine.enabled
+        engine.publish("geiger 1", createSample(500))
+        assert engine.queue.empty()
+
+    def test_raise_hold_clear_after_debounce(self):
+        values = [150, 150, 97, 97, 50, 50]
+        self.run(self.createEngine(), [("geiger 1", createSample(values[i], i)) for i in range(0, len(values))])
+        assert [(event["state"], event["cpm"], event["time"]) for event in self.sink.events] == [
+            ("raised", 150, "2024-01-01 12:01:00"), ("cleared", 50, "2024-01-01 12:05:00")]
+        assert self.sink.events[0]["device"] == "geiger 1"
+        assert self.sink.events[0]["rule"] == "threshold 100 CPM"
+        assert self.sink.events[0]["usvh"] == 1.5
+
+    def test_every_device_has_its_own_state(self):
+        # One sample over the level each, neither passes the debounce
+        self.run(self.createEngine(), [("geiger 1", createSample(150, 0)), ("geiger 2", createSample(150, 0)),
+            ("geiger 2", createSample(150, 1))])
+        assert [(event["device"], event["state"]) for event in self.sink.events] == [("geiger 2", "raised")]
@@ -0,0 +1,126 @@
+'''
+Test tap timestamps of the MultiPyRadmon audio driver on a fake sound card
+To run tests : nosetests test_audio.py
+Verobse (-v) : nosetests -v test_audio.py
+'''
+import imp
+import os
+import struct
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+SILENCE = struct.pack("1024h", *([0] * 1024))
+# One tap at frame 100 of the block
+TAP = struct.pack("1024h", *([0] * 100 + [32000] + [0] * 923))
+
+class fakeStream():
+    """
+      Hands out a block per read, "overflow" entries raise like PortAudio does.
+    """
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.reads = 0
+
+    def read(self, frames):
+        block = self.blocks.get(self.reads, SILENCE)
+        self.reads += 1
+
+        if block == "overflow":
+            raise IOError("Input overflowed")
+
+        return block
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+class fakeSoundCard():
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def get_device_info_by_index(self, index):
+        return {"maxInputChannels": 1, "name": "test card"}
+
+    def open(self, **options):
+        if self.blocks is None:
+            raise IOError("Invalid input device")
+
+        return fakeStream(self.blocks)
+
+    def terminate(self):
+        pass
+
+class recordingStream():
+    """
+      pulseStream that keeps the first watermark, the end of the first block
+      on the sample clock.
+    """
+    def __init__(self):
+        self.stream = PyRadmon.pulseStream(1, 100)
+        self.first = None
+
+    def add(self, timestamp):
+        self.stream.add(timestamp)
+
+    def advance(self, timestamp):
+        if self.first is None:
+            self.first = timestamp
+
+        self.stream.advance(timestamp)
+
+class fakePyaudio():
+    """
+      Stands in for the pyaudio module, blocks None is a card that does not open.
+    """
+    paInt16 = 8
+    paInputOverflowed = IOError
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def PyAudio(self):
+        return fakeSoundCard(self.blocks)
+
+class TestAudioCommunication:
+
+    def setup(self):
+        self.pyaudio = PyRadmon.pyaudio
+
+    def teardown(self):
+        PyRadmon.pyaudio = self.pyaudio
+
+    def listen(self, blocks):
+        """
+          One audio window, returns the sample and the tap times in frames
+          from the start of the stream.
+        """
+        PyRadmon.pyaudio = fakePyaudio(blocks)
+        driver = PyRadmon.audioCommunication(PyRadmon.deviceConfig(1))
+        driver.pulseStream = recordingStream()
+        data = driver.getData()
+        start = driver.pulseStream.first - 1024 / 44100.0
+        taps = driver.pulseStream.stream.take(driver.pulseStream.stream.watermark)
+        return data, [int(round((tap - start) * 44100)) for tap, number in taps]
+
+    def test_tap_time(self):
+        data, taps = self.listen({10: TAP})
+        assert data[2] == 1
+        assert taps == [10 * 1024 + 100]
+
+    def test_overflow_keeps_the_sample_clock(self):
+        # The lost blocks still passed, later taps are not stamped early
+        data, taps = self.listen({3: "overflow", 4: "overflow", 10: TAP})
+        assert data[2] == 1
+        assert taps == [10 * 1024 + 100]
+
+    def test_card_that_does_not_open(self):
+        PyRadmon.pyaudio = fakePyaudio(None)
+        driver = PyRadmon.audioCommunication(PyRadmon.deviceConfig(1))
+        driver.run()
+        # Failed for the supervisor to restart, not crashed on the missing stream
+        assert driver.failed == 1
+        assert driver.is_running == 0
+        driver.stop()
@@ -0,0 +1,73 @@
+'''
+Test how MultiPyRadmon resolves the upload scheme and port from config.txt
+and whether this Python can make the HTTPS connections
+To run tests : nosetests test_config.py
+Verobse (-v) : nosetests -v test_config.py
+'''
+import imp
+import os
+import shutil
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+class oldSsl():
+    """
+      ssl module of Python before 2.7.9, without verified contexts.
+    """
+    SSLError = IOError
+
+class TestUploadServer:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.ssl = PyRadmon.ssl
+
+    def teardown(self):
+        PyRadmon.ssl = self.ssl
+        shutil.rmtree(self.directory)
+
+    def readConfig(self, lines):
+        fileName = os.path.join(self.directory, "config.txt")
+        f = open(fileName, "w")
+        f.write("\r\n".join(["user=test_user", "password=test_password", "protocol=demo"] + lines) + "\r\n")
+        f.close()
+        cfg = PyRadmon.config()
+        cfg.CONFIGFILE = fileName
+        cfg.readConfig()
+        return cfg
+
+    def test_https_by_default(self):
+        cfg = self.readConfig([])
+        assert cfg.https
+        assert cfg.serverPort == 443
+
+    def test_plain_http(self):
+        cfg = self.readConfig(["https=no"])
+        assert not cfg.https
+        assert cfg.serverPort == 80
+
+    def test_explicit_port_wins(self):
+        for lines in (["serverport=8080", "https=no"], ["https=no", "serverport=8080"], ["serverport=8080"]):
+            assert self.readConfig(lines).serverPort == 8080
+
+    def test_explicit_https(self):
+        cfg = self.readConfig(["https=yes"])
+        assert cfg.https
+        assert cfg.serverPort == 443
+
+    def test_https_supported(self):
+        assert PyRadmon.checkHttpsSupport(self.readConfig([])) is None
+
+    def test_https_on_old_python(self):
+        PyRadmon.ssl = oldSsl()
+        assert "https=no" in PyRadmon.checkHttpsSupport(self.readConfig([]))
+        assert PyRadmon.checkHttpsSupport(self.readConfig(["https=no"])) is None
+        assert "http://" in PyRadmon.checkHttpsSupport(self.readConfig(["https=no", "httpsink=https://127.0.0.1/samples"]))
+
+        try:
+            PyRadmon.createSslContext()
+            assert False, "createSslContext should fail"
+        except IOError:
+            pass
@@ -0,0 +1,88 @@
+'''
+Test the fused reading of MultiPyRadmon, co-located counters pooled into one
+To run tests : nosetests test_fused.py
+Verobse (-v) : nosetests -v test_fused.py
+'''
+import datetime
+import imp
+import os
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+class fakeDriver():
+    def __init__(self):
+        self.failed = 0
+        self.fusion = None
+
+class fakeMember():
+    """
+      Member counter, only what the fused counter looks at.
+    """
+    def __init__(self, number):
+        self.name = "geiger " + str(number)
+        self.driver = fakeDriver()
+        self.fusion = None
+
+def sampleTime(minute):
+    return datetime.datetime(2024, 1, 1, 12, minute, 0)
+
+class TestFusedCommunication:
+
+    def setup(self):
+        self.first = fakeMember(1)
+        self.second = fakeMember(2)
+        self.device = PyRadmon.fusedDevice(PyRadmon.deviceConfig(3), None, [self.first, self.second], 120)
+        self.fused = self.device.driver
+
+    def test_members_are_wired(self):
+        for member in (self.first, self.second):
+            assert member.fusion is self.fused
+            assert member.driver.fusion is self.fused
+
+    def test_pools_counts_over_time(self):
+        self.fused.add("geiger 1", [10, 60.0], sampleTime(1))
+        self.fused.add("geiger 2", [100, 30.0], sampleTime(0))
+        data = self.fused.getResult()
+        # 110 counts in 90 s, not the mean of 10 and 200 CPM
+        assert data[0] == 73
+        assert data[1] == sampleTime(1)
+        assert data[2:4] == [110, 90.0]
+        assert data[4:] == PyRadmon.poissonInterval(110, 90.0)
+
+    def test_stale_member_is_left_out(self):
+        self.fused.add("geiger 1", [10, 60.0], sampleTime(0))
+        self.fused.add("geiger 2", [100, 60.0], sampleTime(0))
+        # Last delivered longer than fusedstale ago
+        self.fused.members["geiger 2"][3] = time.time() - 121
+        assert self.fused.getHealthy() == ["geiger 1"]
+        assert self.fused.getResult()[2:4] == [10, 60.0]
+
+    def test_failed_member_is_left_out(self):
+        self.fused.add("geiger 1", [10, 60.0], sampleTime(0))
+        self.fused.add("geiger 2", [100, 60.0], sampleTime(0))
+        self.second.driver.failed = 1
+        assert self.fused.getResult()[2:4] == [10, 60.0]
+
+    def test_member_without_samples_is_left_out(self):
+        self.fused.add("geiger 1", [10, 60.0], sampleTime(0))
+        assert self.fused.getHealthy() == ["geiger 1"]
+
+    def test_every_window_starts_over(self):
+        self.fused.add("geiger 1", [10, 60.0], sampleTime(0))
+        self.fused.add("geiger 2", [100, 60.0], sampleTime(0))
+        self.second.driver.failed = 1
+        self.fused.getResult()
+        assert self.fused.getResult()[0] == -1
+        # Counts of the left out member were dropped with the window
+        self.second.driver.failed = 0
+        self.fused.add("geiger 2", [5, 60.0], sampleTime(2))
+        data = self.fused.getResult()
+        assert data[2:4] == [5, 60.0]
+        assert data[1] == sampleTime(2)
+
+    def test_no_healthy_member(self):
+        self.fused.add("geiger 1", [10, 60.0], sampleTime(0))
+        self.first.driver.failed = 1
+        assert self.fused.getResult()[0] == -1
@@ -0,0 +1,84 @@
+'''
+Test the wall-clock aligned scheduler of MultiPyRadmon
+To run tests : nosetests test_scheduler.py
+Verobse (-v) : nosetests -v test_scheduler.py
+'''
+import imp
+import os
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+class fakeDevice():
+    def __init__(self, number, uploadInterval):
+        self.number = number
+        self.cfg = PyRadmon.deviceConfig(number, uploadInterval)
+
+class TestNextAlignedSlot:
+
+    def test_next_multiple(self):
+        assert PyRadmon.nextAlignedSlot(0.5, 30) == 30
+        assert PyRadmon.nextAlignedSlot(59.9, 30) == 60
+        assert PyRadmon.nextAlignedSlot(1000, 60) == 1020
+
+    def test_strictly_after(self):
+        assert PyRadmon.nextAlignedSlot(30, 30) == 60
+        assert PyRadmon.nextAlignedSlot(0, 10) == 10
+
+class TestDeviceScheduler:
+
+    def setup(self):
+        self.fast = fakeDevice(1, 30)
+        self.slow = fakeDevice(2, 60)
+        self.scheduler = PyRadmon.deviceScheduler([self.slow, self.fast], now = 1000)
+
+    def test_first_slots_are_aligned(self):
+        assert self.scheduler.nextDue() == 1020
+        assert [device.number for device, due in self.scheduler.popDue(now = 1019.9)] == []
+        # Same slot, the lower device number first
+        assert [(device.number, due) for device, due in self.scheduler.popDue(now = 1020)] == [(1, 1020), (2, 1020)]
+        assert self.scheduler.nextDue() is None
+
+    def test_every_device_keeps_its_interval(self):
+        for device, due in self.scheduler.popDue(now = 1020.2):
+            self.scheduler.sampled(device, due, now = 1020.3)
+
+        assert [(device.number, due) for device, due in self.scheduler.popDue(now = 1050)] == [(1, 1050)]
+        self.scheduler.sampled(self.fast, 1050, now = 1050.1)
+        assert [(device.number, due) for device, due in self.scheduler.popDue(now = 1080)] == [(1, 1080), (2, 1080)]
+
+    def test_processing_time_does_not_add_up(self):
+        self.scheduler.popDue(now = 1020)
+        # Sampling took 25 s, the next slot stays on the wall-clock grid
+        self.scheduler.sampled(self.fast, 1020, now = 1045)
+        assert self.scheduler.nextDue() == 1050
+        assert self.scheduler.missed == 0
+
+    def test_missed_slots_are_skipped(self):
+        self.scheduler.popDue(now = 1020)
+        # Busy until 1125, slots 1050 to 1110 passed
+        self.scheduler.sampled(self.fast, 1020, now = 1125)
+        assert self.scheduler.missed == 3
+        assert self.scheduler.nextDue() == 1140
+
+    def test_empty_queue_is_retried_alone(self):
+        self.scheduler.popDue(now = 1020)
+        self.scheduler.empty(self.fast, now = 1020)
+        self.scheduler.sampled(self.slow, 1020, now = 1020)
+        assert self.scheduler.nextDue() == 1020 + PyRadmon.deviceScheduler.RETRY_INTERVAL
+        assert [device.number for device, due in self.scheduler.popDue(now = 1025)] == [1]
+        assert self.scheduler.nextDue() == 1080
+
+    def test_jitter_is_measured(self):
+        self.scheduler.popDue(now = 1020.25)
+        stats = self.scheduler.jitter.getStats()
+        assert stats["count"] == 2
+        assert abs(stats["max"] - 0.25) < 1e-9
+        assert "0 missed slots" in self.scheduler.formatStats()
+
+    def test_wait_is_interrupted(self):
+        scheduler = PyRadmon.deviceScheduler([self.fast], now = time.time() + 60)
+        started = time.time()
+        scheduler.wait(lambda: True)
+        assert time.time() - started < 0.5
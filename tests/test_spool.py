@@ -0,0 +1,103 @@
+'''
+Test the upload spool of MultiPyRadmon: CRC framed records, recovery of a
+damaged end of file and the .pos checkpoint
+To run tests : nosetests test_spool.py
+Verobse (-v) : nosetests -v test_spool.py
+'''
+import datetime
+import imp
+import os
+import shutil
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+def createSample(cpm, minute = 0):
+    return [cpm, datetime.datetime(2024, 1, 1, 12, minute, 0)]
+
+class TestSampleSpool:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.directory, "spool.dat")
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self, count):
+        spool = PyRadmon.sampleSpool(self.fileName)
+
+        for i in range(0, count):
+            spool.append("geiger 1", createSample(10 + i, i))
+
+        spool.close()
+
+    def test_round_trip(self):
+        self.fill(3)
+        records = PyRadmon.sampleSpool(self.fileName).read(10)
+        assert [(record[1], record[3]) for record in records] == [("geiger 1", 10), ("geiger 1", 11), ("geiger 1", 12)]
+        assert records[2][2] == datetime.datetime(2024, 1, 1, 12, 2, 0)
+        assert records[2][0] == os.path.getsize(self.fileName)
+
+    def test_torn_record_is_dropped(self):
+        self.fill(2)
+        size = os.path.getsize(self.fileName)
+        f = open(self.fileName, "ab")
+        # Length header and half a payload, as left by a power cut
+        f.write("\x00\x00\x00\x20geiger 1\t2024")
+        f.close()
+        spool = PyRadmon.sampleSpool(self.fileName)
+        assert len(spool.read(10)) == 2
+        assert os.path.getsize(self.fileName) == size
+        spool.append("geiger 1", createSample(30))
+        assert [record[3] for record in spool.read(10)] == [10, 11, 30]
+
+    def test_crc_mismatch_cuts_off_the_rest(self):
+        self.fill(3)
+        records = PyRadmon.sampleSpool(self.fileName).read(10)
+        f = open(self.fileName, "r+b")
+        # Flip a payload byte of the second record
+        f.seek(records[0][0] + 6)
+        byte = f.read(1)
+        f.seek(records[0][0] + 6)
+        f.write(chr(ord(byte) ^ 0xff))
+        f.close()
+        spool = PyRadmon.sampleSpool(self.fileName)
+        assert [record[3] for record in spool.read(10)] == [10]
+        assert os.path.getsize(self.fileName) == records[0][0]
+
+    def test_checkpoint_survives_restart(self):
+        self.fill(3)
+        spool = PyRadmon.sampleSpool(self.fileName)
+        records = spool.read(1)
+        spool.commit(records[0][0])
+        spool.close()
+        assert open(self.fileName + ".pos").read() == str(records[0][0])
+        spool = PyRadmon.sampleSpool(self.fileName)
+        assert [record[3] for record in spool.read(10)] == [11, 12]
+        assert spool.getPending() == os.path.getsize(self.fileName) - records[0][0]
+
+    def test_commit_of_everything_truncates(self):
+        self.fill(3)
+        spool = PyRadmon.sampleSpool(self.fileName)
+        spool.commit(spool.read(10)[-1][0])
+        assert spool.getPending() == 0
+        assert os.path.getsize(self.fileName) == 0
+        assert open(self.fileName + ".pos").read() == "0"
+
+    def test_checkpoint_past_end_is_reset(self):
+        self.fill(1)
+        f = open(self.fileName + ".pos", "w")
+        f.write("100000")
+        f.close()
+        spool = PyRadmon.sampleSpool(self.fileName)
+        assert spool.position == os.path.getsize(self.fileName)
+        assert spool.getPending() == 0
+
+    def test_damaged_checkpoint_starts_over(self):
+        self.fill(2)
+        f = open(self.fileName + ".pos", "w")
+        f.write("garbage")
+        f.close()
+        assert len(PyRadmon.sampleSpool(self.fileName).read(10)) == 2
@@ -0,0 +1,132 @@
+'''
+Test the statistics helpers of MultiPyRadmon: the running median and the
+Hampel spike filter built on it, and the Poisson confidence interval of a
+counting rate
+To run tests : nosetests test_statistics.py
+Verobse (-v) : nosetests -v test_statistics.py
+'''
+import datetime
+import imp
+import os
+import random
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2 == 1:
+        return float(values[middle])
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def close(value, expected, tolerance):
+    return abs(value - expected) <= tolerance * expected
+
+class TestRunningMedian:
+
+    def check(self, window, values):
+        running = PyRadmon.runningMedian(window)
+
+        for i in range(0, len(values)):
+            running.add(values[i])
+            assert running.median() == median(values[max(0, i + 1 - window):i + 1]), (window, i)
+
+        assert len(running) == min(window, len(values))
+
+    def test_matches_sorted_window(self):
+        generator = random.Random(1)
+
+        for window in (1, 2, 5, 9):
+            self.check(window, [generator.randint(0, 1000) for i in range(0, 300)])
+
+    def test_duplicates(self):
+        generator = random.Random(2)
+
+        for window in (2, 5, 9):
+            self.check(window, [generator.randint(0, 3) for i in range(0, 300)])
+
+    def test_trends(self):
+        self.check(9, range(0, 100) + range(100, 0, -1))
+
+def createSample(cpm):
+    return [cpm, datetime.datetime(2024, 1, 1, 12, 0, 0)]
+
+class TestHampelFilter:
+
+    def setup(self):
+        self.cfg = PyRadmon.deviceConfig(1)
+        self.filter = PyRadmon.createSampleFilter(self.cfg)
+        generator = random.Random(3)
+        # Background around 20 CPM
+        self.background = [generator.randint(15, 25) for i in range(0, 30)]
+
+        for cpm in self.background:
+            assert self.filter.check(createSample(cpm))
+
+    def test_concatenated_reading_is_rejected(self):
+        # Two readings of 20 and 21 CPM run together on the serial line
+        spike = createSample(2021)
+        assert not self.filter.check(spike)
+        assert self.filter.rejectedCount == 1
+        assert list(self.filter.rejected) == [spike]
+        assert self.filter.check(createSample(21))
+
+    def test_real_step_is_followed(self):
+        results = [self.filter.check(createSample(200)) for i in range(0, 20)]
+        # Rejected until the step fills half the window, then followed
+        rejected = self.cfg.filterWindow // 2 + 1
+        assert results == [False] * rejected + [True] * (20 - rejected)
+        assert self.filter.rejectedCount == rejected
+
+    def test_integration_time_widens_the_band(self):
+        # 60 CPM over 5 s is only 5 counts, well within Poisson noise of 20 CPM
+        assert self.filter.check([60, datetime.datetime(2024, 1, 1), 5, 5.0])
+        assert not self.filter.check([60, datetime.datetime(2024, 1, 1), 60, 60.0])
+
+    def test_invalid_reading_is_rejected(self):
+        assert not self.filter.check(createSample(-1))
+        assert self.filter.rejectedCount == 1
+
+    def test_warm_up(self):
+        fresh = PyRadmon.createSampleFilter(self.cfg)
+        assert fresh.check(createSample(20))
+        assert fresh.check(createSample(5000))
+        assert fresh.check(createSample(20))
+
+    def test_no_filter(self):
+        self.cfg.filter = PyRadmon.config.FILTER_NONE
+        unfiltered = PyRadmon.createSampleFilter(self.cfg)
+        assert unfiltered.check(createSample(2021))
+        assert not unfiltered.check(createSample(-1))
+
+class TestPoissonInterval:
+
+    def test_no_time(self):
+        assert PyRadmon.poissonInterval(10, 0) == [0.0, 0.0]
+
+    def test_zero_counts(self):
+        low, high = PyRadmon.poissonInterval(0, 60)
+        assert low == 0.0
+        # Exact 95% upper limit for 0 counts is 3.689
+        assert close(high, 3.689, 0.02)
+
+    def test_matches_exact_limits(self):
+        # Exact (chi-square) 95% limits for 10 and 100 counts
+        low, high = PyRadmon.poissonInterval(10, 60)
+        assert close(low, 4.795, 0.02) and close(high, 18.39, 0.02)
+        low, high = PyRadmon.poissonInterval(100, 60)
+        assert close(low, 81.36, 0.01) and close(high, 121.63, 0.01)
+
+    def test_scales_to_cpm(self):
+        low, high = PyRadmon.poissonInterval(100, 60)
+        longLow, longHigh = PyRadmon.poissonInterval(100, 120)
+        assert close(longLow, low / 2, 1e-9)
+        assert close(longHigh, high / 2, 1e-9)
+
+    def test_contains_the_rate(self):
+        for counts in (1, 5, 20, 500, 10000):
+            low, high = PyRadmon.poissonInterval(counts, 30)
+            assert low < counts * 2 < high
@@ -0,0 +1,131 @@
+'''
+Test how the MultiPyRadmon device supervisor restarts failed drivers
+To run tests : nosetests test_supervisor.py
+Verobse (-v) : nosetests -v test_supervisor.py
+'''
+import imp
+import os
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+
+class fakeDriver():
+    """
+      Driver that fails as soon as it starts when failing, stop() raises
+      when brokenStop like a sound card that never opened.
+    """
+    def __init__(self, failing, brokenStop = False):
+        self.failing = failing
+        self.brokenStop = brokenStop
+        self.failed = 0
+        self.lastSample = time.time()
+        self.started = False
+        self.stopped = 0
+
+    def start(self):
+        self.started = True
+        self.failed = 1 if self.failing else 0
+
+    def is_alive(self):
+        return self.started and self.failed == 0
+
+    def stop(self):
+        self.stopped += 1
+
+        if self.brokenStop:
+            raise AttributeError("audioCommunication instance has no attribute 'stream'")
+
+    def getResult(self):
+        return [-1, -1, 0, 0.0]
+
+def createDevice(number, drivers):
+    """
+      A real geigerDevice whose restarts hand out the next of drivers, an
+      exception in the list is raised like a driver that cannot be created.
+    """
+    device = PyRadmon.geigerDevice(PyRadmon.deviceConfig(number), None)
+
+    def createDriver():
+        driver = drivers.pop(0)
+
+        if isinstance(driver, Exception):
+            raise driver
+
+        return driver
+
+    device.createDriver = createDriver
+    device.driver = createDriver()
+    device.driver.start()
+    return device
+
+class TestDeviceSupervisor:
+
+    def setup(self):
+        self.cfg = PyRadmon.config()
+        self.cfg.stallTimeout = 60
+        self.cfg.restartBackoff = 5
+        self.cfg.restartMax = 20
+        self.now = time.time()
+
+    def test_failed_driver_is_restarted_after_backoff(self):
+        device = createDevice(1, [fakeDriver(True), fakeDriver(False)])
+        first = device.driver
+        supervisor = PyRadmon.deviceSupervisor(self.cfg, [device])
+        supervisor.check(self.now)
+        assert first.stopped == 1
+        supervisor.check(self.now + 4.9)
+        assert device.driver is first
+        supervisor.check(self.now + 5)
+        assert device.driver is not first
+        assert device.driver.started
+
+    def test_backoff_doubles_up_to_max(self):
+        device = createDevice(1, [fakeDriver(True) for i in range(0, 5)])
+        supervisor = PyRadmon.deviceSupervisor(self.cfg, [device])
+        now = self.now
+        delays = []
+
+        for i in range(0, 4):
+            supervisor.check(now)
+            delays.append(supervisor.state[1][1] - now)
+            now = supervisor.state[1][1]
+            supervisor.check(now)
+
+        assert delays == [5, 10, 20, 20]
+        assert supervisor.state[1][0] == 4
+
+    def test_recovery_resets_backoff(self):
+        device = createDevice(1, [fakeDriver(True), fakeDriver(True), fakeDriver(False)])
+        supervisor = PyRadmon.deviceSupervisor(self.cfg, [device])
+
+        for now in (self.now, self.now + 5, self.now + 5.1, self.now + 15.1):
+            supervisor.check(now)
+
+        assert supervisor.state[1][0] == 2
+        # The third driver works, once it delivers the backoff starts over
+        device.driver.lastSample = device.started + 1
+        supervisor.check(self.now + 16)
+        assert supervisor.state[1] == [0, None]
+
+    def test_driver_that_cannot_be_created_backs_off(self):
+        device = createDevice(1, [fakeDriver(True), IOError("No such device"), fakeDriver(False)])
+        supervisor = PyRadmon.deviceSupervisor(self.cfg, [device])
+        supervisor.check(self.now)
+        supervisor.check(self.now + 5)
+        assert supervisor.state[1][0] == 1
+        assert supervisor.state[1][1] == self.now + 15
+        supervisor.check(self.now + 15)
+        assert device.driver.started
+        assert device.driver.failed == 0
+
+    def test_broken_stop_does_not_end_supervision(self):
+        broken = createDevice(1, [fakeDriver(True, brokenStop = True), fakeDriver(False)])
+        other = createDevice(2, [fakeDriver(True), fakeDriver(False)])
+        supervisor = PyRadmon.deviceSupervisor(self.cfg, [broken, other])
+        supervisor.check(self.now)
+        assert other.driver.stopped == 1
+        # Both are still restarted
+        supervisor.check(self.now + 5)
+        assert broken.driver.failed == 0
+        assert other.driver.failed == 0
@@ -0,0 +1,527 @@
+'''
+Test the upload path of MultiPyRadmon against the mock radmon.org server
+To run tests : nosetests test_upload.py
+Verobse (-v) : nosetests -v test_upload.py
+'''
+import datetime
+import imp
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+PyRadmon = imp.load_source("MultiPyRadmon", os.path.join(here, "..", "MultiPyRadmon", "MultiPyRadmon.py"))
+from mock_radmon import mockRadmonServer
+
+def createConfig():
+    cfg = PyRadmon.config()
+    cfg.uploadRetries = 2
+    cfg.retryBackoff = 0.1
+    cfg.breakerFailures = 3
+    cfg.breakerCooldown = 0.3
+    cfg.backfillRate = 100.0
+    return cfg
+
+def createService(server, user = "test_user", password = "test_password", number = 1, connection = None):
+    deviceCfg = PyRadmon.deviceConfig(number)
+    deviceCfg.user = user
+    deviceCfg.password = password
+
+    if connection is None:
+        connection = PyRadmon.httpConnection("127.0.0.1", server.port, PyRadmon.hostResolver(createConfig()))
+
+    return PyRadmon.webCommunication(deviceCfg, connection)
+
+def unusedPort():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    # Nothing listens on it once it is closed
+    sock.close()
+    return port
+
+def createSample(cpm = 20, minute = 0):
+    return [cpm, datetime.datetime(2024, 1, 1, 12, minute, 0)]
+
+class fakeSocket():
+    """
+      Hands out the given pieces one recv at a time, then reports a close.
+    """
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, size):
+        if self.pieces:
+            return self.pieces.pop(0)
+
+        return ""
+
+def readResponse(pieces, buffer = ""):
+    response = PyRadmon.httpResponse(fakeSocket(pieces), time.time() + 5, buffer)
+    response.read()
+    return response
+
+class serverTest(object):
+    """
+      Stops the mock server a test started, tests start it with the options they need.
+    """
+    def setup(self):
+        self.server = None
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        if self.server is not None:
+            self.server.stop()
+
+        shutil.rmtree(self.directory)
+
+    def startServer(self, **options):
+        self.server = mockRadmonServer(port = 0, user = "test_user", password = "test_password", **options)
+        self.server.start()
+        return self.server
+
+    def createSpool(self):
+        return PyRadmon.sampleSpool(os.path.join(self.directory, "spool.dat"))
+
+class TestWebCommunication(serverTest):
+
+    def test_upload_success(self):
+        service = createService(self.startServer())
+        assert service.sendSample(createSample(20))
+        assert len(self.server.submissions) == 1
+        assert self.server.submissions[0]["value"] == "20"
+        assert self.server.submissions[0]["datetime"] == "2024-01-01 12:00:00"
+        stats = service.stats.getStats()
+        assert stats["success"] == 1
+        assert stats["connectionError"] == 0
+
+    def test_bad_login_is_only_an_auth_failure(self):
+        service = createService(self.startServer(), password = "wrong")
+        assert not service.sendSample(createSample())
+        assert service.rejected
+        assert len(self.server.submissions) == 0
+        stats = service.stats.getStats()
+        assert stats["authFailure"] == 1
+        assert stats["connectionError"] == 0
+        assert stats["httpError"] == 0
+        assert stats["success"] == 0
+
+    def test_server_error_is_http_error(self):
+        service = createService(self.startServer(errorRate = 1.0))
+        assert not service.sendSample(createSample())
+        assert not service.rejected
+        assert self.server.errors == 1
+        assert len(self.server.submissions) == 0
+        stats = service.stats.getStats()
+        assert stats["httpError"] == 1
+        assert stats["connectionError"] == 0
+
+    def test_reset_is_connection_error(self):
+        service = createService(self.startServer(resetRate = 1.0))
+        assert not service.sendSample(createSample())
+        assert self.server.resets == 1
+        stats = service.stats.getStats()
+        assert stats["connectionError"] == 1
+        assert stats["authFailure"] == 0
+        assert stats["success"] == 0
+
+    def test_chunked_reply(self):
+        service = createService(self.startServer(chunked = True))
+
+        for i in range(0, 3):
+            assert service.sendSample(createSample(20 + i, i))
+
+        assert [submission["value"] for submission in self.server.submissions] == ["20", "21", "22"]
+        assert service.stats.getStats()["success"] == 3
+
+    def test_keep_alive_reuse(self):
+        service = createService(self.startServer())
+
+        for i in range(0, 5):
+            assert service.sendSample(createSample(20, i))
+
+        assert self.server.requests == 5
+        stats = service.stats.getStats()
+        # Only the first upload paid for a connect
+        assert stats["connect"]["count"] == 1
+        assert stats["total"]["count"] == 5
+
+    def test_reconnect_after_server_closed_idle_connection(self):
+        service = createService(self.startServer())
+        assert service.sendSample(createSample(20, 0))
+        # Server side close while idle, the next upload goes out on a new connection
+        service.connection.sock.shutdown(socket.SHUT_RDWR)
+        assert service.sendSample(createSample(20, 1))
+        assert len(self.server.submissions) == 2
+        assert service.stats.getStats()["connectionError"] == 0
+
+class TestHttpResponse:
+
+    def test_content_length_split_over_reads(self):
+        response = readResponse(["HTTP/1.1 200 OK\r\nContent-Le", "ngth: 11\r\n\r\nHello", " world"])
+        assert response.status == 200
+        assert response.reason == "OK"
+        assert response.body == "Hello world"
+        assert response.keepAlive
+
+    def test_chunked(self):
+        response = readResponse(["HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n",
+            "5;ext=1\r\nHello\r\n", "6\r\n world\r\n0\r\n", "Trailer: x\r\n\r\n"])
+        assert response.body == "Hello world"
+        assert response.keepAlive
+
+    def test_pipelined_responses_share_the_buffer(self):
+        first = readResponse(["HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nOKHTTP/1.1 500 Error\r\nContent-Length: 5\r\n\r\nError"])
+        second = readResponse([], first.buffer)
+        assert first.body == "OK"
+        assert second.status == 500
+        assert second.body == "Error"
+        assert second.buffer == ""
+
+    def test_read_until_close(self):
+        response = readResponse(["HTTP/1.0 200 OK\r\n\r\nIncorrect ", "login."])
+        assert response.body == "Incorrect login."
+        assert not response.keepAlive
+
+    def test_connection_close(self):
+        response = readResponse(["HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 0\r\n\r\n"])
+        assert response.body == ""
+        assert not response.keepAlive
+
+    def test_invalid_status_line(self):
+        try:
+            readResponse(["garbage\r\n\r\n"])
+            assert False, "read should fail"
+        except socket.error:
+            pass
+
+class TestCircuitBreaker:
+
+    def test_open_half_open_closed(self):
+        breaker = PyRadmon.circuitBreaker(createConfig())
+        assert breaker.allowRequest()
+
+        for i in range(0, 3):
+            breaker.recordFailure()
+
+        assert breaker.state == PyRadmon.circuitBreaker.OPEN
+        assert not breaker.allowRequest()
+        time.sleep(0.35)
+        # One trial upload after the cool-down, a failure opens it again
+        assert breaker.allowRequest()
+        assert breaker.state == PyRadmon.circuitBreaker.HALF_OPEN
+        breaker.recordFailure()
+        assert breaker.state == PyRadmon.circuitBreaker.OPEN
+        assert not breaker.allowRequest()
+        time.sleep(0.35)
+        assert breaker.allowRequest()
+        breaker.recordSuccess()
+        assert breaker.state == PyRadmon.circuitBreaker.CLOSED
+        assert breaker.allowRequest()
+
+    def test_success_resets_failure_count(self):
+        breaker = PyRadmon.circuitBreaker(createConfig())
+        breaker.recordFailure()
+        breaker.recordFailure()
+        breaker.recordSuccess()
+        breaker.recordFailure()
+        assert breaker.state == PyRadmon.circuitBreaker.CLOSED
+
+    def test_lost_trial_is_granted_again(self):
+        breaker = PyRadmon.circuitBreaker(createConfig())
+
+        for i in range(0, 3):
+            breaker.recordFailure()
+
+        time.sleep(0.35)
+        assert breaker.allowRequest()
+        # The trial never reported back, no second one within the cool-down
+        assert not breaker.allowRequest()
+        time.sleep(0.35)
+        assert breaker.allowRequest()
+        assert breaker.state == PyRadmon.circuitBreaker.HALF_OPEN
+
+def openBreaker(breaker):
+    """
+      Opens the breaker and waits out the cool-down, the next request is the trial.
+    """
+    for i in range(0, breaker.threshold):
+        breaker.recordFailure()
+
+    time.sleep(breaker.cooldown + 0.05)
+
+class TestUploadWorker(serverTest):
+
+    def createWorker(self, cfg = None):
+        cfg = cfg or createConfig()
+        return PyRadmon.uploadWorker(cfg, self.createSpool(), PyRadmon.circuitBreaker(cfg))
+
+    def test_retry_with_backoff(self):
+        service = createService(self.startServer(errorRate = 1.0))
+        worker = self.createWorker()
+        started = time.time()
+        failed = worker.upload([(service, createSample())])
+        # Backoff is 0.1 s then 0.2 s, each stretched by up to 100% jitter
+        elapsed = time.time() - started
+        assert 0.3 <= elapsed < 1.0
+        assert len(failed) == 1
+        assert self.server.errors == 3
+        assert service.stats.getStats()["httpError"] == 3
+
+    def test_retry_succeeds(self):
+        service = createService(self.startServer(errorRate = 1.0))
+        worker = self.createWorker()
+        threading.Timer(0.05, setattr, [self.server, "errorRate", 0.0]).start()
+        assert worker.upload([(service, createSample())]) == []
+        assert len(self.server.submissions) == 1
+        assert worker.breaker.state == PyRadmon.circuitBreaker.CLOSED
+
+    def test_breaker_stops_uploads_until_server_is_back(self):
+        cfg = createConfig()
+        cfg.uploadRetries = 5
+        cfg.retryBackoff = 0.01
+        service = createService(self.startServer(errorRate = 1.0))
+        worker = self.createWorker(cfg)
+        assert len(worker.upload([(service, createSample())])) == 1
+        # Opened after breakerfailures attempts, the other retries never reached the server
+        assert self.server.requests == 3
+        assert worker.breaker.state == PyRadmon.circuitBreaker.OPEN
+        assert len(worker.upload([(service, createSample())])) == 1
+        assert self.server.requests == 3
+        self.server.errorRate = 0.0
+        time.sleep(0.35)
+        assert worker.upload([(service, createSample())]) == []
+        assert worker.breaker.state == PyRadmon.circuitBreaker.CLOSED
+        assert len(self.server.submissions) == 1
+
+    def test_pipelined_batch(self):
+        server = self.startServer()
+        first = createService(server, number = 1)
+        second = createService(server, number = 2, connection = first.connection)
+        worker = self.createWorker()
+        assert worker.upload([(first, createSample(20)), (second, createSample(30))]) == []
+        assert sorted([submission["value"] for submission in server.submissions]) == ["20", "30"]
+
+    def test_failed_samples_are_spooled(self):
+        service = createService(self.startServer(errorRate = 1.0))
+        worker = self.createWorker()
+        worker.start()
+        worker.submit(service, createSample(42))
+        time.sleep(1.0)
+        worker.stop()
+        worker.join(5.0)
+        records = worker.spool.read(10)
+        assert len(records) == 1
+        assert records[0][1] == "geiger 1"
+        assert records[0][3] == 42
+
+    def test_rejected_samples_are_dropped(self):
+        service = createService(self.startServer(), password = "wrong")
+        worker = self.createWorker()
+        assert worker.upload([(service, createSample())]) == []
+        # No retries for a bad login, and it is not an outage
+        assert self.server.requests == 1
+        assert worker.breaker.failures == 0
+        worker.submit(service, createSample())
+        worker.stop()
+        worker.run()
+        assert worker.spool.getPending() == 0
+
+    def test_nothing_to_send_keeps_the_trial(self):
+        service = createService(self.startServer(), user = "")
+        worker = self.createWorker()
+        openBreaker(worker.breaker)
+        assert worker.upload([(service, createSample())]) == []
+        assert worker.breaker.state == PyRadmon.circuitBreaker.OPEN
+        assert worker.breaker.allowRequest()
+
+class TestSpoolReplay(serverTest):
+
+    def createReplay(self, services, spool):
+        cfg = createConfig()
+        return PyRadmon.spoolReplayWorker(cfg, spool, services[0].connection, PyRadmon.circuitBreaker(cfg), services)
+
+    def test_backfill_in_order(self):
+        service = createService(self.startServer())
+        spool = self.createSpool()
+
+        for i in range(0, 7):
+            spool.append(service.name, createSample(10 + i, i))
+
+        self.createReplay([service], spool).replay()
+        assert [submission["value"] for submission in self.server.submissions] == [str(10 + i) for i in range(0, 7)]
+        assert spool.getPending() == 0
+
+    def test_backfill_resumes_after_failure(self):
+        service = createService(self.startServer(errorRate = 1.0))
+        spool = self.createSpool()
+
+        for i in range(0, 3):
+            spool.append(service.name, createSample(10 + i, i))
+
+        replay = self.createReplay([service], spool)
+        replay.replay()
+        assert len(spool.read(10)) == 3
+        self.server.errorRate = 0.0
+        replay.replay()
+        assert [submission["value"] for submission in self.server.submissions] == ["10", "11", "12"]
+        assert spool.getPending() == 0
+
+    def test_rejected_login_is_kept_spooled(self):
+        service = createService(self.startServer(), password = "wrong")
+        spool = self.createSpool()
+        spool.append(service.name, createSample())
+        spool.append(service.name, createSample())
+        replay = self.createReplay([service], spool)
+        replay.replay()
+        assert service.rejected
+        assert len(spool.read(10)) == 2
+        assert replay.breaker.failures == 0
+        requests = self.server.requests
+        replay.replay()
+        # Not tried again once the account is known to be rejected
+        assert self.server.requests == requests
+        assert len(spool.read(10)) == 2
+
+    def test_backfill_survives_unreachable_server(self):
+        connection = PyRadmon.httpConnection("127.0.0.1", unusedPort(), PyRadmon.hostResolver(createConfig()))
+        service = createService(None, connection = connection)
+        spool = self.createSpool()
+        spool.append(service.name, createSample())
+        pending = spool.getPending()
+        replay = self.createReplay([service], spool)
+        replay.start()
+        time.sleep(0.5)
+        alive = replay.isAlive()
+        replay.stop()
+        replay.join(5.0)
+        assert alive
+        assert spool.getPending() == pending
+        assert replay.breaker.failures == 1
+
+    def test_unknown_counters_keep_the_trial(self):
+        service = createService(self.startServer())
+        spool = self.createSpool()
+        spool.append("geiger 9", createSample())
+        replay = self.createReplay([service], spool)
+        openBreaker(replay.breaker)
+        replay.replay()
+        # Nothing was sent, the records of a removed counter are simply skipped
+        assert self.server.requests == 0
+        assert spool.getPending() == 0
+        assert replay.breaker.state == PyRadmon.circuitBreaker.OPEN
+        assert replay.breaker.allowRequest()
+
+class TestHostResolver(serverTest):
+
+    def setup(self):
+        serverTest.setup(self)
+        self.startServer()
+        self.resolver = PyRadmon.hostResolver(createConfig())
+        self.dead = (socket.AF_INET, ("127.0.0.1", unusedPort()))
+        self.alive = (socket.AF_INET, ("127.0.0.1", self.server.port))
+        self.getaddrinfo = socket.getaddrinfo
+        self.lookups = 0
+
+    def teardown(self):
+        socket.getaddrinfo = self.getaddrinfo
+        self.resolver.stop()
+        serverTest.teardown(self)
+
+    def fakeDns(self, addresses):
+        """
+          Every lookup answers with addresses, None fails like a DNS outage.
+        """
+        def getaddrinfo(host, port, family = 0, socktype = 0):
+            self.lookups += 1
+
+            if addresses is None:
+                raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+
+            return [(address[0], socket.SOCK_STREAM, 6, "", address[1]) for address in addresses]
+
+        socket.getaddrinfo = getaddrinfo
+
+    def test_connect_falls_back_to_next_address(self):
+        self.resolver.entries[("radmon.test", 80)] = [[self.dead, self.alive], time.time(), 0]
+        sock = self.resolver.connect("radmon.test", 80, 1.0)
+        sock.close()
+        entry = self.resolver.entries[("radmon.test", 80)]
+        # The address that answered is tried first next time, the entry stays fresh
+        assert entry[0] == [self.alive, self.dead]
+        assert entry[1] > 0
+
+    def test_connect_invalidates_when_all_fail(self):
+        self.resolver.entries[("radmon.test", 80)] = [[self.dead], time.time(), 0]
+
+        try:
+            self.resolver.connect("radmon.test", 80, 1.0)
+            assert False, "connect should fail"
+        except socket.error:
+            pass
+
+        assert self.resolver.entries[("radmon.test", 80)][1] == 0
+
+    def test_invalidated_entry_is_looked_up_again(self):
+        self.fakeDns([self.alive])
+        self.resolver.entries[("radmon.test", 80)] = [[self.dead], time.time(), 0]
+        assert self.resolver.resolve("radmon.test", 80) == [self.dead]
+        assert self.lookups == 0
+        self.resolver.invalidate("radmon.test", 80)
+        assert self.resolver.resolve("radmon.test", 80) == [self.alive]
+        assert self.lookups == 1
+        sock = self.resolver.connect("radmon.test", 80, 1.0)
+        sock.close()
+
+    def test_expired_entry_is_looked_up_again(self):
+        self.fakeDns([self.alive])
+        self.resolver.entries[("radmon.test", 80)] = [[self.dead], time.time() - self.resolver.ttl - 1, 0]
+        assert self.resolver.resolve("radmon.test", 80) == [self.alive]
+        assert self.lookups == 1
+
+    def test_outage_keeps_expired_addresses(self):
+        self.fakeDns(None)
+        self.resolver.entries[("radmon.test", 80)] = [[self.dead], 0, 0]
+        assert self.resolver.resolve("radmon.test", 80) == [self.dead]
+        # The failure is cached, no lookup on every sample
+        assert self.resolver.resolve("radmon.test", 80) == [self.dead]
+        assert self.lookups == 1
+
+    def test_refresh_survives_unresolved_host(self):
+        self.fakeDns(None)
+        self.resolver.entries[("radmon.test", 80)] = [None, 0, 0]
+        self.resolver.start()
+        time.sleep(0.3)
+        assert self.resolver.isAlive()
+        assert self.lookups == 1
+        self.resolver.stop()
+        self.resolver.join(5.0)
+
+class TestHttpConnection(serverTest):
+
+    def test_abort_ends_request_in_flight(self):
+        service = createService(self.startServer(latency = 5.0))
+        connection = service.connection
+        errors = []
+
+        def upload():
+            try:
+                connection.request(service.buildRequest(createSample()))
+            except socket.error as e:
+                errors.append(e)
+
+        worker = threading.Thread(target = upload)
+        started = time.time()
+        worker.start()
+        time.sleep(0.5)
+        connection.abort()
+        worker.join(3.0)
+        assert not worker.isAlive()
+        assert time.time() - started < 3.0
+        assert len(errors) == 1